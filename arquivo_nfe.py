@@ -0,0 +1,309 @@
+"""
+Arquivo local dos XMLs originais de NF-e, comprimido e endereçado pela chave de acesso.
+
+Cada XML ingerido é comprimido (gzip) e acrescentado ao segmento corrente;
+o índice (texto, só acréscimos) liga a chave de acesso ao SHA-256 do XML e à
+posição do registro. O endereço é a chave, não o conteúdo: cada chave é
+arquivada uma vez (o primeiro XML recebido) e um XML diferente com a mesma
+chave é ignorado. O hash serve só para conferir a integridade na leitura.
+Com o arquivo, mudanças no parser ou colunas novas são preenchidas
+reprocessando os XMLs locais, sem baixar tudo do Mainô de novo.
+
+Estrutura em NFE_ARQUIVO_DIR (padrão: ./arquivo_nfe; vazio desativa):
+    segmento-000001.gz   membros gzip concatenados (um XML cada; `zcat` lê o segmento inteiro)
+    indice.tsv           chave, sha256, segmento, posição, tamanho
+
+Vários workers podem gravar ao mesmo tempo: a gravação é serializada por um
+lock no índice (fcntl, quando disponível) e cada worker relê só o final do
+índice para conhecer o que os outros gravaram. Uma linha incompleta no fim
+do índice (queda no meio da gravação) é descartada antes do próximo acréscimo,
+e linhas malformadas são ignoradas na leitura com um aviso.
+
+Uso:
+    python arquivo_nfe.py reprocessar [--processos 4] [--substituir]
+    python arquivo_nfe.py verificar
+"""
+import argparse
+import hashlib
+import logging
+import os
+import threading
+import zlib
+from collections import Counter, namedtuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DIRETORIO_ARQUIVO = os.getenv('NFE_ARQUIVO_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'arquivo_nfe'))
+TAMANHO_SEGMENTO = int(os.getenv('NFE_ARQUIVO_SEGMENTO_MB', '256')) * 1024 * 1024
+# Cada XML é um membro gzip independente (leitura por posição). Em documentos de
+# poucos KB o lzma comprime só ~5% mais e custa de 4 a 15 vezes o tempo na ingestão
+NIVEL_COMPRESSAO = int(os.getenv('NFE_ARQUIVO_NIVEL', '6'))
+NOME_INDICE = 'indice.tsv'
+# Documentos lidos do arquivo por lote no reprocessamento
+XMLS_POR_LOTE = 1000
+
+Entrada = namedtuple('Entrada', 'sha256 segmento posicao tamanho')
+
+
+def _nome_segmento(numero):
+    return f'segmento-{numero:06d}.gz'
+
+
+def _comprimir(conteudo):
+    compressor = zlib.compressobj(NIVEL_COMPRESSAO, zlib.DEFLATED, 31)
+    return compressor.compress(conteudo) + compressor.flush()
+
+
+class ArquivoNFe:
+    def __init__(self, diretorio):
+        self.diretorio = diretorio
+        self.caminho_indice = os.path.join(diretorio, NOME_INDICE)
+        self._indice = {}
+        self._lido = 0
+        self._lock = threading.Lock()
+
+    def _atualizar(self):
+        """Lê as linhas do índice acrescentadas desde a última leitura (deste ou de outros workers)."""
+        if not os.path.exists(self.caminho_indice):
+            return
+        with open(self.caminho_indice, 'rb') as indice:
+            indice.seek(self._lido)
+            novo = indice.read()
+        # Só linhas completas; uma gravação em andamento é lida na próxima vez
+        completo = novo[:novo.rfind(b'\n') + 1]
+        self._lido += len(completo)
+        for linha in completo.decode(errors='replace').splitlines():
+            try:
+                chave, sha256, segmento, posicao, tamanho = linha.split('\t')
+                entrada = Entrada(sha256, int(segmento), int(posicao), int(tamanho))
+            except ValueError:
+                logger.warning(f"Linha malformada ignorada no índice do arquivo de NF-e: {linha[:120]!r}")
+                continue
+            self._indice.setdefault(chave, entrada)
+
+    def __len__(self):
+        with self._lock:
+            self._atualizar()
+            return len(self._indice)
+
+    def contem(self, chave):
+        with self._lock:
+            self._atualizar()
+            return chave in self._indice
+
+    def _segmento_corrente(self):
+        numeros = [int(nome[len('segmento-'):-len('.gz')]) for nome in os.listdir(self.diretorio)
+                   if nome.startswith('segmento-') and nome.endswith('.gz')]
+        numero = max(numeros, default=1)
+        caminho = os.path.join(self.diretorio, _nome_segmento(numero))
+        if os.path.exists(caminho) and os.path.getsize(caminho) >= TAMANHO_SEGMENTO:
+            numero += 1
+        return numero
+
+    def gravar(self, documentos):
+        """
+        Acrescenta ao arquivo os documentos (chave de acesso, XML) cujas chaves ainda
+        não foram arquivadas. Retorna quantos foram gravados.
+        """
+        with self._lock:
+            self._atualizar()
+            pendentes = {}
+            for chave, conteudo in documentos:
+                if chave and chave not in self._indice and chave not in pendentes:
+                    pendentes[chave] = conteudo.encode('utf-8') if isinstance(conteudo, str) else conteudo
+        if not pendentes:
+            return 0
+
+        # Compressão fora do lock: os outros workers só esperam a escrita
+        registros = [(chave, hashlib.sha256(conteudo).hexdigest(), _comprimir(conteudo))
+                     for chave, conteudo in pendentes.items()]
+
+        os.makedirs(self.diretorio, exist_ok=True)
+        with self._lock, open(self.caminho_indice, 'ab') as indice:
+            if fcntl is not None:
+                fcntl.flock(indice, fcntl.LOCK_EX)
+            try:
+                # Outro worker pode ter arquivado as mesmas chaves enquanto comprimíamos
+                self._atualizar()
+                registros = [registro for registro in registros if registro[0] not in self._indice]
+                if not registros:
+                    return 0
+                # Com o lock, o que passa da última linha completa é resto de uma gravação interrompida
+                if os.fstat(indice.fileno()).st_size > self._lido:
+                    logger.warning("Linha incompleta descartada do fim do índice do arquivo de NF-e")
+                    indice.truncate(self._lido)
+
+                numero = self._segmento_corrente()
+                linhas = []
+                with open(os.path.join(self.diretorio, _nome_segmento(numero)), 'ab') as segmento:
+                    posicao = segmento.tell()
+                    for chave, sha256, comprimido in registros:
+                        segmento.write(comprimido)
+                        linhas.append(f'{chave}\t{sha256}\t{numero}\t{posicao}\t{len(comprimido)}\n')
+                        posicao += len(comprimido)
+                indice.write(''.join(linhas).encode())
+                indice.flush()
+                self._atualizar()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(indice, fcntl.LOCK_UN)
+        return len(registros)
+
+    def _ler_entrada(self, arquivo_segmento, entrada):
+        arquivo_segmento.seek(entrada.posicao)
+        conteudo = zlib.decompress(arquivo_segmento.read(entrada.tamanho), wbits=31)
+        if hashlib.sha256(conteudo).hexdigest() != entrada.sha256:
+            raise ValueError(f'Conteúdo arquivado não confere com o hash {entrada.sha256}')
+        return conteudo
+
+    def ler(self, chave):
+        """XML arquivado da chave (bytes), ou None."""
+        with self._lock:
+            self._atualizar()
+            entrada = self._indice.get(chave)
+        if entrada is None:
+            return None
+        with open(os.path.join(self.diretorio, _nome_segmento(entrada.segmento)), 'rb') as segmento:
+            return self._ler_entrada(segmento, entrada)
+
+    def percorrer(self, chaves=None):
+        """
+        Gera (chave, XML) de todas as chaves (ou só das `chaves`) na ordem em que
+        estão em disco (leitura sequencial).
+        """
+        with self._lock:
+            self._atualizar()
+            entradas = sorted((item for item in self._indice.items() if chaves is None or item[0] in chaves),
+                              key=lambda item: (item[1].segmento, item[1].posicao))
+        segmento, numero = None, None
+        try:
+            for chave, entrada in entradas:
+                if entrada.segmento != numero:
+                    if segmento:
+                        segmento.close()
+                    numero = entrada.segmento
+                    segmento = open(os.path.join(self.diretorio, _nome_segmento(numero)), 'rb')
+                yield chave, self._ler_entrada(segmento, entrada)
+        finally:
+            if segmento:
+                segmento.close()
+
+
+_arquivo = None
+_arquivo_lock = threading.Lock()
+
+
+def arquivo_padrao():
+    """Arquivo de NFE_ARQUIVO_DIR (um por processo), ou None se desativado."""
+    global _arquivo
+    if not DIRETORIO_ARQUIVO:
+        return None
+    with _arquivo_lock:
+        if _arquivo is None:
+            _arquivo = ArquivoNFe(DIRETORIO_ARQUIVO)
+    return _arquivo
+
+
+def arquivar(documentos):
+    """Arquiva os XMLs ingeridos; uma falha no arquivo é logada e não interrompe a ingestão."""
+    arquivo = arquivo_padrao()
+    if arquivo is None:
+        return 0
+    try:
+        return arquivo.gravar(documentos)
+    except Exception:
+        logger.exception("Erro ao arquivar XMLs de NF-e")
+        return 0
+
+
+def _lotes(documentos, tamanho_lote):
+    lote = []
+    for documento in documentos:
+        lote.append(documento)
+        if len(lote) >= tamanho_lote:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def reprocessar(app, arquivo=None, substituir=False, processos=None, tamanho_lote=XMLS_POR_LOTE, chaves=None):
+    """
+    Reingere os XMLs arquivados (todos ou só os de `chaves`): leitura sequencial do
+    arquivo, parse em um pool de processos e gravação em lote (insert_nfe_batch),
+    sem acesso à rede.
+
+    Sem `substituir`, só grava as notas que faltam no banco (ex.: banco novo). Com
+    `substituir`, as notas já gravadas são regravadas com o parser atual; saldos e
+    snapshots são corrigidos na mesma transação de cada lote.
+
+    Returns:
+        Counter: inseridas, duplicadas e falhas
+    """
+    from insert_nfe_data import insert_nfe_batch
+    from models.user import db
+    from nfe_parser import pool_de_leitura
+
+    arquivo = arquivo or arquivo_padrao()
+    totais = Counter()
+    with pool_de_leitura(processos) as executor:
+        for lote in _lotes(arquivo.percorrer(chaves), tamanho_lote):
+            with app.app_context():
+                resultados = insert_nfe_batch([(f'{chave}.xml', xml) for chave, xml in lote],
+                                              executor=executor, substituir=substituir)
+                db.session.remove()
+            for resultado in resultados:
+                if resultado['success']:
+                    totais['inseridas'] += 1
+                elif resultado['duplicada']:
+                    totais['duplicadas'] += 1
+                else:
+                    totais['falhas'] += 1
+                    logger.warning(f"{resultado['arquivo']}: {resultado['message']}")
+            logger.info(f"Reprocessamento: {sum(totais.values())} XMLs lidos ({dict(totais)})")
+    return totais
+
+
+def verificar(arquivo=None):
+    """Relê todo o arquivo conferindo os hashes. Retorna (registros lidos, chaves com erro)."""
+    arquivo = arquivo or arquivo_padrao()
+    lidos, erros = 0, []
+    with arquivo._lock:
+        arquivo._atualizar()
+        entradas = list(arquivo._indice.items())
+    for chave, entrada in entradas:
+        try:
+            with open(os.path.join(arquivo.diretorio, _nome_segmento(entrada.segmento)), 'rb') as segmento:
+                arquivo._ler_entrada(segmento, entrada)
+            lidos += 1
+        except (OSError, ValueError, zlib.error) as e:
+            erros.append((chave, str(e)))
+    return lidos, erros
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Arquivo local dos XMLs de NF-e')
+    parser.add_argument('comando', choices=['reprocessar', 'verificar'])
+    parser.add_argument('--processos', type=int, default=None, help='processos de parse (padrão: número de CPUs)')
+    parser.add_argument('--substituir', action='store_true', help='regrava as notas já existentes com o parser atual')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if arquivo_padrao() is None:
+        parser.error('NFE_ARQUIVO_DIR está vazio: arquivo desativado.')
+
+    if args.comando == 'reprocessar':
+        from main import app
+        totais = reprocessar(app, substituir=args.substituir, processos=args.processos)
+        print(f"Reprocessamento concluído: {totais['inseridas']} inserida(s), "
+              f"{totais['duplicadas']} duplicada(s), {totais['falhas']} falha(s).")
+    else:
+        lidos, erros = verificar()
+        for chave, erro in erros[:50]:
+            print(f"{chave}: {erro}")
+        print(f"{lidos} XML(s) conferido(s), {len(erros)} com erro.")
@@ -0,0 +1,87 @@
+"""
+Benchmark de opme_logic.calculate_balance: motor colunar (NumPy) contra o
+laço linha a linha anterior.
+
+Uso (a partir da raiz do projeto):
+    python -m benchmarks.bench_balance [--linhas 1000000] [--clientes 200]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from opme_logic import calculate_balance, calcular_saldos_colunar, movimentos_colunares  # noqa: E402
+
+CFOPS = ["5917", "6917", "1918", "2918", "1919", "2919", "5114", "6114"]
+
+
+def gerar_movimentos(linhas, clientes, produtos=500, produtos_por_cliente=50, seed=42):
+    aleatorio = random.Random(seed)
+    inicio = date(2020, 1, 1)
+    movimentos = []
+    for i in range(linhas):
+        cliente = aleatorio.randrange(clientes)
+        # Cada hospital consome um conjunto próprio de produtos, em poucos lotes
+        produto = (cliente * 7 + aleatorio.randrange(produtos_por_cliente)) % produtos
+        lote = f"L{produto:04d}{aleatorio.randrange(5):02d}" if aleatorio.random() < 0.9 else None
+        movimentos.append((
+            str(i), (inicio + timedelta(days=aleatorio.randrange(5 * 365))).isoformat(),
+            f"{cliente:014d}", f"HOSPITAL {cliente}", f"P{produto:05d}", f"PRODUTO {produto}",
+            aleatorio.choice(CFOPS), float(aleatorio.randint(1, 5)),
+            lote, float(aleatorio.randint(1, 5)) if lote else None
+        ))
+    return movimentos
+
+
+def saldo_laco(movements):
+    """Implementação anterior: laço em Python com testes de pertinência por linha."""
+    balance = {}
+    for nNF, dEmi, CNPJ_dest, xNome_dest, cProd, xProd, CFOP, qCom, nLote, qLote in movements:
+        quantity = qLote if qLote else qCom
+        key = (CNPJ_dest, xNome_dest, cProd, xProd, nLote if nLote else "SEM_LOTE")
+        if key not in balance:
+            balance[key] = 0.0
+        if CFOP in ["5917", "6917"]:
+            balance[key] -= quantity
+        elif CFOP in ["1918", "2918"] or CFOP in ["1919", "2919"]:
+            balance[key] += quantity
+    return balance
+
+
+def cronometrar(nome, funcao, *args, **kwargs):
+    inicio = time.perf_counter()
+    resultado = funcao(*args, **kwargs)
+    print(f"  {nome:45s} {(time.perf_counter() - inicio) * 1000:10.1f} ms")
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do cálculo de saldo")
+    parser.add_argument("--linhas", type=int, default=1_000_000)
+    parser.add_argument("--clientes", type=int, default=200)
+    args = parser.parse_args()
+
+    movimentos = gerar_movimentos(args.linhas, args.clientes)
+    print(f"{args.linhas} movimentos, {args.clientes} clientes")
+
+    esperado = cronometrar("laço linha a linha", saldo_laco, movimentos)
+    obtido = cronometrar("calculate_balance (colunar, com conversão)", calculate_balance, movimentos)
+    colunas = cronometrar("conversão para colunas", movimentos_colunares, movimentos)
+    cronometrar("group-by vetorizado", calcular_saldos_colunar, colunas)
+    cronometrar("calculate_balance (colunas já carregadas)", calculate_balance, colunas)
+    cortes = [date(ano, 12, 31) for ano in range(2020, 2025)]
+    cronometrar(f"group-by com {len(cortes)} cortes de data", calcular_saldos_colunar, colunas, datas_corte=cortes)
+    clientes = [f"{c:014d}" for c in range(0, args.clientes, 10)]
+    cronometrar(f"group-by para {len(clientes)} clientes", calcular_saldos_colunar, colunas, clientes=clientes)
+
+    divergentes = [k for k in esperado.keys() | obtido.keys()
+                   if abs(esperado.get(k, 0.0) - obtido.get(k, 0.0)) > 1e-6]
+    print(f"  chaves divergentes: {len(divergentes)}")
+
+
+if __name__ == "__main__":
+    main()
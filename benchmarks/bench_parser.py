@@ -0,0 +1,113 @@
+"""
+Benchmark do parser de NF-e: motor iterparse (nfe_parser) contra a leitura
+anterior baseada em find() repetidos, em NF-es com 1.000 itens.
+
+Uso (a partir da raiz do projeto):
+    python -m benchmarks.bench_parser [--itens 1000] [--repeticoes 20]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nfe_parser import parse_nfe  # noqa: E402
+from parse_nfe_xml import parse_nfe_xml  # noqa: E402
+
+NS = {"nfe": "http://www.portalfiscal.inf.br/nfe"}
+
+
+def gerar_nfe_xml(qtd_itens=1000):
+    """Gera o XML de uma NF-e de consignação com `qtd_itens` itens rastreados."""
+    itens = []
+    for i in range(1, qtd_itens + 1):
+        itens.append(
+            f'<det nItem="{i}"><prod><cProd>P{i:05d}</cProd><cEAN>SEM GTIN</cEAN>'
+            f'<xProd>PARAFUSO CORTICAL 3.5MM X {i}MM</xProd><NCM>90211020</NCM>'
+            f'<CFOP>5917</CFOP><uCom>UN</uCom><qCom>2.0000</qCom><vUnCom>150.0000000000</vUnCom>'
+            f'<vProd>300.00</vProd><rastro><nLote>L{i:06d}</nLote><qLote>2.000</qLote>'
+            f'<dFab>2024-01-10</dFab><dVal>2029-01-10</dVal></rastro></prod>'
+            f'<imposto><ICMS><ICMS40><orig>0</orig><CST>41</CST></ICMS40></ICMS></imposto></det>'
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00"><NFe>'
+        '<infNFe Id="NFe35240112345678000190550010000012341000012345" versao="4.00">'
+        '<ide><cUF>35</cUF><natOp>REMESSA EM CONSIGNACAO</natOp><serie>1</serie><nNF>1234</nNF>'
+        '<dhEmi>2024-01-15T10:30:00-03:00</dhEmi><dEmi>2024-01-15</dEmi></ide>'
+        '<emit><CNPJ>12345678000190</CNPJ><xNome>AKOS MED LTDA</xNome></emit>'
+        '<dest><CNPJ>98765432000110</CNPJ><xNome>HOSPITAL EXEMPLO</xNome>'
+        '<enderDest><xLgr>RUA A</xLgr></enderDest></dest>'
+        + "".join(itens) +
+        '</infNFe></NFe></nfeProc>'
+    ).encode("utf-8")
+
+
+def parse_legado(xml_bytes):
+    """Leitura anterior: árvore completa e dois find() por campo."""
+    root = ET.fromstring(xml_bytes)
+    ide = root.find(".//nfe:ide", NS)
+    dest = root.find(".//nfe:dest", NS)
+    cabecalho = {
+        "nNF": ide.find("nfe:nNF", NS).text if ide is not None and ide.find("nfe:nNF", NS) is not None else "",
+        "CNPJ_dest": dest.find("nfe:CNPJ", NS).text if dest is not None and dest.find("nfe:CNPJ", NS) is not None else "",
+    }
+    produtos = []
+    for det in root.findall(".//nfe:det", NS):
+        prod = det.find("nfe:prod", NS)
+        registro = {}
+        for campo in ("cProd", "xProd", "CFOP", "qCom", "vUnCom", "vProd"):
+            registro[campo] = prod.find(f"nfe:{campo}", NS).text if prod.find(f"nfe:{campo}", NS) is not None else ""
+        rastro = prod.find("nfe:rastro", NS)
+        if rastro is not None:
+            for campo in ("nLote", "qLote", "dFab", "dVal"):
+                registro[campo] = rastro.find(f"nfe:{campo}", NS).text if rastro.find(f"nfe:{campo}", NS) is not None else ""
+        produtos.append(registro)
+    # insert_nfe_data fazia uma segunda leitura completa do mesmo documento
+    root = ET.fromstring(xml_bytes)
+    root.find(".//nfe:infNFe", NS)
+    for det in root.findall(".//nfe:det", NS):
+        prod = det.find("nfe:prod", NS)
+        prod.find("nfe:cProd", NS)
+        prod.find("nfe:qCom", NS)
+    return cabecalho, produtos
+
+
+def medir(funcao, xml_bytes, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao(xml_bytes)
+        tempos.append(time.perf_counter() - inicio)
+    return tempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do parser de NF-e")
+    parser.add_argument("--itens", type=int, default=1000)
+    parser.add_argument("--repeticoes", type=int, default=20)
+    args = parser.parse_args()
+
+    xml_bytes = gerar_nfe_xml(args.itens)
+    casos = [
+        ("legado (find x2 + releitura)", parse_legado),
+        ("parse_nfe (iterparse)", lambda dados: parse_nfe(dados, is_file=False)),
+        ("parse_nfe_xml (API legada)", lambda dados: parse_nfe_xml(dados, is_file=False)),
+    ]
+
+    print(f"NF-e com {args.itens} itens, {len(xml_bytes) / 1024:.0f} KiB, {args.repeticoes} repetições")
+    referencia = None
+    for nome, funcao in casos:
+        tempos = medir(funcao, xml_bytes, args.repeticoes)
+        mediana = statistics.median(tempos)
+        referencia = referencia or mediana
+        print(f"  {nome:32s} mediana {mediana * 1000:8.2f} ms  "
+              f"p95 {sorted(tempos)[int(len(tempos) * 0.95) - 1] * 1000:8.2f} ms  "
+              f"{referencia / mediana:5.2f}x")
+
+
+if __name__ == "__main__":
+    main()
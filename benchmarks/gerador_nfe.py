@@ -0,0 +1,139 @@
+"""
+Gerador de NF-es sintéticas de consignação OPME para benchmarks.
+
+Produz documentos no layout 4.00 com chave de acesso válida (dígito
+verificador módulo 11), itens rastreados com um ou mais lotes e um CFOP
+por nota sorteado segundo o mix configurado.
+
+Uso (a partir da raiz do projeto):
+    python -m benchmarks.gerador_nfe --notas 1000 --saida /tmp/nfes.zip
+    python -m benchmarks.gerador_nfe --notas 50 --itens 20 --lotes 2 --saida /tmp/nfes/
+"""
+import argparse
+import os
+import random
+import sys
+import zipfile
+from datetime import datetime, timedelta
+
+# Proporção de notas por CFOP: remessa, retorno, retorno simbólico e faturamento
+MIX_CFOP = {"5917": 0.5, "1918": 0.25, "1919": 0.15, "5114": 0.10}
+
+NATUREZA_OPERACAO = {
+    "5917": "REMESSA DE MERCADORIA EM CONSIGNACAO",
+    "1918": "DEVOLUCAO DE MERCADORIA EM CONSIGNACAO",
+    "1919": "DEVOLUCAO SIMBOLICA DE MERCADORIA EM CONSIGNACAO",
+    "5114": "VENDA DE MERCADORIA EM CONSIGNACAO",
+}
+
+CNPJ_EMITENTE = "12345678000190"
+DESCRICOES = ("PARAFUSO CORTICAL", "PLACA BLOQUEADA", "HASTE INTRAMEDULAR", "PINO DE STEINMANN",
+              "CAGE INTERSOMATICO", "ANCORA DE SUTURA", "FIO DE KIRSCHNER", "PROTESE DE QUADRIL")
+
+
+def _digito_chave(chave43):
+    """Dígito verificador da chave de acesso (módulo 11, pesos 2 a 9)."""
+    soma = sum(int(digito) * (2 + i % 8) for i, digito in enumerate(reversed(chave43)))
+    resto = soma % 11
+    return "0" if resto < 2 else str(11 - resto)
+
+
+def chave_acesso(numero, data, serie=1):
+    chave = f"35{data:%y%m}{CNPJ_EMITENTE}55{serie:03d}{numero:09d}1{numero % 10 ** 8:08d}"
+    return chave + _digito_chave(chave)
+
+
+def cnpj_cliente(indice):
+    return f"{10000000 + indice:08d}0001{indice % 100:02d}"
+
+
+def _det(n_item, cfop, produto, lotes, aleatorio):
+    quantidades = [aleatorio.randint(1, 5) for _ in range(lotes)]
+    valor_unitario = 50 + produto % 200 * 7.5
+    rastros = "".join(
+        f"<rastro><nLote>L{produto:05d}{lote:03d}</nLote><qLote>{qtd:.3f}</qLote>"
+        f"<dFab>2024-{1 + lote % 12:02d}-10</dFab><dVal>{2027 + lote % 4}-{1 + lote % 12:02d}-10</dVal></rastro>"
+        for lote, qtd in zip(aleatorio.sample(range(50), lotes), quantidades)
+    )
+    quantidade = sum(quantidades)
+    return (
+        f'<det nItem="{n_item}"><prod><cProd>P{produto:05d}</cProd><cEAN>SEM GTIN</cEAN>'
+        f"<xProd>{DESCRICOES[produto % len(DESCRICOES)]} {produto % 40 + 1}MM</xProd><NCM>90211020</NCM>"
+        f"<CFOP>{cfop}</CFOP><uCom>UN</uCom><qCom>{quantidade:.4f}</qCom>"
+        f"<vUnCom>{valor_unitario:.10f}</vUnCom><vProd>{quantidade * valor_unitario:.2f}</vProd>"
+        f"{rastros}</prod>"
+        f"<imposto><ICMS><ICMS40><orig>0</orig><CST>41</CST></ICMS40></ICMS></imposto></det>"
+    )
+
+
+def gerar_nfe(numero, aleatorio, itens=10, lotes=1, clientes=200, produtos=2000,
+              mix=MIX_CFOP, inicio=datetime(2020, 1, 1), dias=5 * 365):
+    """
+    Gera uma NF-e.
+
+    Returns:
+        tuple: (chave de acesso, XML em bytes)
+    """
+    cfop = aleatorio.choices(list(mix), weights=list(mix.values()))[0]
+    cliente = aleatorio.randrange(clientes)
+    emissao = inicio + timedelta(days=aleatorio.randrange(dias), minutes=aleatorio.randrange(600))
+    chave = chave_acesso(numero, emissao)
+    # Cada hospital trabalha com um conjunto próprio de produtos
+    base_produto = cliente * 37
+    corpo = "".join(
+        _det(i, cfop, (base_produto + aleatorio.randrange(60)) % produtos, lotes, aleatorio)
+        for i in range(1, itens + 1)
+    )
+    xml = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00"><NFe>'
+        f'<infNFe Id="NFe{chave}" versao="4.00">'
+        f"<ide><cUF>35</cUF><natOp>{NATUREZA_OPERACAO.get(cfop, 'OPERACAO')}</natOp><mod>55</mod>"
+        f"<serie>1</serie><nNF>{numero}</nNF><dhEmi>{emissao:%Y-%m-%dT%H:%M:%S}-03:00</dhEmi></ide>"
+        f"<emit><CNPJ>{CNPJ_EMITENTE}</CNPJ><xNome>AKOS MED LTDA</xNome></emit>"
+        f"<dest><CNPJ>{cnpj_cliente(cliente)}</CNPJ><xNome>HOSPITAL {cliente:04d}</xNome>"
+        "<enderDest><xLgr>RUA A</xLgr></enderDest></dest>"
+        f"{corpo}</infNFe></NFe></nfeProc>"
+    )
+    return chave, xml.encode("utf-8")
+
+
+def gerar_nfes(notas, itens=10, lotes=1, clientes=200, produtos=2000, mix=MIX_CFOP, seed=42, primeiro_numero=1):
+    """Gera `notas` NF-es reprodutíveis (mesma semente, mesmos documentos)."""
+    aleatorio = random.Random(seed)
+    for numero in range(primeiro_numero, primeiro_numero + notas):
+        yield gerar_nfe(numero, aleatorio, itens, lotes, clientes, produtos, mix)
+
+
+def _mix(texto):
+    """Converte '5917=0.5,1918=0.3' no dicionário de proporções."""
+    return {cfop: float(peso) for cfop, peso in (parte.split("=") for parte in texto.split(","))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera NF-es sintéticas de consignação")
+    parser.add_argument("--notas", type=int, default=100)
+    parser.add_argument("--itens", type=int, default=10)
+    parser.add_argument("--lotes", type=int, default=1, help="lotes (rastro) por item")
+    parser.add_argument("--clientes", type=int, default=200)
+    parser.add_argument("--produtos", type=int, default=2000)
+    parser.add_argument("--mix", type=_mix, default=MIX_CFOP, help="ex.: 5917=0.5,1918=0.25,1919=0.15,5114=0.1")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--saida", required=True, help="arquivo .zip ou diretório")
+    args = parser.parse_args()
+
+    documentos = gerar_nfes(args.notas, args.itens, args.lotes, args.clientes, args.produtos, args.mix, args.seed)
+    if args.saida.endswith(".zip"):
+        with zipfile.ZipFile(args.saida, "w", zipfile.ZIP_DEFLATED) as destino:
+            for chave, xml in documentos:
+                destino.writestr(f"{chave}.xml", xml)
+    else:
+        os.makedirs(args.saida, exist_ok=True)
+        for chave, xml in documentos:
+            with open(os.path.join(args.saida, f"{chave}.xml"), "wb") as destino:
+                destino.write(xml)
+    print(f"{args.notas} NF-es geradas em {args.saida}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Suíte de benchmarks: leitura de NF-e, ingestão, cálculo de saldo e rotas de
+consulta, em bases com 10 mil, 100 mil ou 1 milhão de movimentos geradas por
+benchmarks.gerador_nfe.
+
+Para cada medição imprime vazão e latências (p50/p95/p99) e compara a p50
+com o baseline gravado (benchmarks/baseline.json); termina com código 1 se
+alguma medição ficar mais lenta que o baseline além da tolerância. O
+baseline vale para a máquina em que foi gravado: em outra máquina, grave
+um novo antes de comparar.
+
+Uso (a partir da raiz do projeto):
+    python -m benchmarks.suite [--movimentos 10000 100000] [--tolerancia 0.5]
+    python -m benchmarks.suite --movimentos 1000000 --database-url postgresql://... --recriar
+    python -m benchmarks.suite --gravar-baseline
+
+As tabelas do banco são apagadas e recriadas a cada base. Com --database-url,
+a suíte só aceita um SQLite vazio; outro banco (ou um SQLite com dados) exige
+--recriar, para que um banco real não seja apagado por engano.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.gerador_nfe import cnpj_cliente, gerar_nfes  # noqa: E402
+
+BASELINE_PADRAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+ITENS_POR_NOTA = 20
+CLIENTES = 200
+# Documentos medidos um a um (parse e insert_nfe_data); o restante é carregado em lote
+AMOSTRA_DOCUMENTOS = 200
+REQUISICOES = 50
+
+
+class Resultado:
+    def __init__(self, nome, movimentos, tempos, unidades=1):
+        self.nome = nome
+        self.movimentos = movimentos
+        self.tempos = sorted(tempos)
+        self.unidades = unidades
+
+    @property
+    def chave(self):
+        return f"{self.nome}@{self.movimentos}"
+
+    def percentil(self, p):
+        if len(self.tempos) == 1:
+            return self.tempos[0]
+        return statistics.quantiles(self.tempos, n=100, method="inclusive")[p - 1]
+
+    @property
+    def vazao(self):
+        return self.unidades * len(self.tempos) / sum(self.tempos)
+
+
+def cronometrar(funcao, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return tempos
+
+
+def recriar_tabelas(app):
+    import arquivo_nfe
+    from chaves_nfe import esquecer_chaves
+    from models.user import db
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    # Chaves em memória e arquivo de XMLs da base anterior (mesma semente, mesmas chaves)
+    esquecer_chaves()
+    shutil.rmtree(arquivo_nfe.DIRETORIO_ARQUIVO, ignore_errors=True)
+    arquivo_nfe._arquivo = None
+
+
+def motivo_para_preservar(app):
+    """Por que o banco não deve ser apagado (não é SQLite ou tem dados); None se pode."""
+    from sqlalchemy import inspect, text
+    from models.user import db
+
+    with app.app_context():
+        if db.engine.dialect.name != "sqlite":
+            return f"{db.engine.url.render_as_string(hide_password=True)} não é um SQLite"
+        with db.engine.connect() as conexao:
+            for tabela in inspect(conexao).get_table_names():
+                if conexao.execute(text(f'SELECT 1 FROM "{tabela}" LIMIT 1')).first():
+                    return f"a tabela {tabela} tem dados"
+    return None
+
+
+def preparar_app(database_url, diretorio, recriar=False):
+    """App apontado para o banco de teste; sem `recriar`, recusa um banco que não seja SQLite vazio."""
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["NFE_ARQUIVO_DIR"] = os.path.join(diretorio, "arquivo_nfe")
+    # Sem sincronizações com o Mainô durante as medições
+    os.environ["MAINO_SYNC_INTERVALO_MIN"] = "0"
+    from main import app
+
+    motivo = None if recriar else motivo_para_preservar(app)
+    if motivo:
+        raise SystemExit(f"Banco recusado: {motivo}. As tabelas seriam apagadas; use --recriar para confirmar.")
+    recriar_tabelas(app)
+    return app
+
+
+def medir_base(app, movimentos):
+    """Gera e ingere a base com `movimentos` movimentos e mede cada caminho sobre ela."""
+    from insert_nfe_data import insert_nfe_batch, insert_nfe_data
+    from models.user import db
+    from opme_logic import calculate_balance, carregar_movimentos_colunar
+    from parse_nfe_xml import parse_nfe_xml
+
+    notas = max(movimentos // ITENS_POR_NOTA, 1)
+    documentos = list(gerar_nfes(notas, itens=ITENS_POR_NOTA, clientes=CLIENTES))
+    amostra = documentos[:AMOSTRA_DOCUMENTOS]
+    resultados = []
+
+    tempos = [cronometrar(lambda xml=xml: parse_nfe_xml(xml, is_file=False), 1)[0] for _, xml in amostra]
+    resultados.append(Resultado("parse_nfe_xml", movimentos, tempos, unidades=ITENS_POR_NOTA))
+
+    with app.app_context():
+        tempos = [cronometrar(lambda xml=xml: insert_nfe_data(xml, is_content=True), 1)[0] for _, xml in amostra]
+        resultados.append(Resultado("insert_nfe_data", movimentos, tempos, unidades=ITENS_POR_NOTA))
+
+        restantes = documentos[len(amostra):]
+        tempos = []
+        for inicio in range(0, len(restantes), 1000):
+            bloco = restantes[inicio:inicio + 1000]
+            tempos.extend(cronometrar(lambda bloco=bloco: insert_nfe_batch(bloco), 1))
+        if tempos:
+            resultados.append(Resultado("insert_nfe_batch(1000)", movimentos, tempos, unidades=1000 * ITENS_POR_NOTA))
+        db.session.remove()
+
+        colunas = carregar_movimentos_colunar()
+        resultados.append(Resultado("carregar_movimentos_colunar", movimentos,
+                                    cronometrar(carregar_movimentos_colunar, 3), unidades=movimentos))
+        resultados.append(Resultado("calculate_balance", movimentos,
+                                    cronometrar(lambda: calculate_balance(colunas), 10), unidades=movimentos))
+
+    cliente = app.test_client()
+    aleatorio = random.Random(7)
+    tempos = cronometrar(
+        lambda: cliente.get(f"/api/saldos/consultar?cnpj_cliente={cnpj_cliente(aleatorio.randrange(CLIENTES))}"),
+        REQUISICOES
+    )
+    resultados.append(Resultado("GET /saldos/consultar?cnpj_cliente", movimentos, tempos))
+    resultados.append(Resultado("GET /saldos/consultar", movimentos,
+                                cronometrar(lambda: cliente.get("/api/saldos/consultar"), 5)))
+
+    cursor = {"valor": None}
+
+    def pagina():
+        url = "/api/notas-fiscais/listar?limite=500"
+        if cursor["valor"]:
+            url += f"&cursor={cursor['valor']}"
+        cursor["valor"] = cliente.get(url).headers.get("X-Next-Cursor")
+
+    resultados.append(Resultado("GET /notas-fiscais/listar (500)", movimentos,
+                                cronometrar(pagina, REQUISICOES), unidades=500))
+    return resultados
+
+
+def comparar(resultados, baseline, tolerancia, folga):
+    """Medições cuja p50 passou do baseline além da tolerância relativa e da folga absoluta (s)."""
+    regressoes = []
+    for r in resultados:
+        referencia = baseline.get(r.chave)
+        if referencia and r.percentil(50) > referencia * (1 + tolerancia) + folga:
+            regressoes.append((r, referencia))
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Suíte de benchmarks do OPME Control")
+    parser.add_argument("--movimentos", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--database-url", help="banco de teste (padrão: SQLite temporário); é apagado e recriado")
+    parser.add_argument("--recriar", action="store_true",
+                        help="aceita apagar um --database-url que não seja SQLite ou que tenha dados")
+    parser.add_argument("--baseline", default=BASELINE_PADRAO)
+    parser.add_argument("--tolerancia", type=float, default=0.5, help="aumento aceito na p50 (0.5 = 50%%)")
+    parser.add_argument("--folga-ms", type=float, default=2.0,
+                        help="diferença absoluta ignorada, para medições de poucos milissegundos")
+    parser.add_argument("--gravar-baseline", action="store_true", help="grava as p50 medidas como novo baseline")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        app = preparar_app(args.database_url or f"sqlite:///{os.path.join(diretorio, 'bench.db')}", diretorio,
+                           recriar=args.recriar)
+        resultados = []
+        print(f"{'medição':40s} {'movimentos':>10s} {'vazão/s':>12s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+        for movimentos in args.movimentos:
+            recriar_tabelas(app)
+            for r in medir_base(app, movimentos):
+                resultados.append(r)
+                print(f"{r.nome:40s} {movimentos:10d} {r.vazao:12.0f} {r.percentil(50) * 1000:9.2f} "
+                      f"{r.percentil(95) * 1000:9.2f} {r.percentil(99) * 1000:9.2f}")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as arquivo:
+            baseline = json.load(arquivo)
+
+    if args.gravar_baseline:
+        baseline.update({r.chave: round(r.percentil(50), 6) for r in resultados})
+        with open(args.baseline, "w") as arquivo:
+            json.dump(dict(sorted(baseline.items())), arquivo, indent=2)
+        print(f"Baseline gravado em {args.baseline}")
+        return 0
+
+    regressoes = comparar(resultados, baseline, args.tolerancia, args.folga_ms / 1000)
+    for r, referencia in regressoes:
+        print(f"REGRESSÃO {r.chave}: p50 {r.percentil(50) * 1000:.2f} ms, baseline {referencia * 1000:.2f} ms")
+    return 1 if regressoes else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+Catálogo de clientes e produtos (tabelas cliente e produto) e busca por
+nome ou código.
+
+A ingestão registra cada destinatário e produto das NF-es
+(registrar_catalogo). No PostgreSQL a busca usa índices trigram (pg_trgm)
+nos nomes/descrições e índices de prefixo nos códigos; nos demais bancos
+usa um índice em memória, refeito quando a versão dos dados muda.
+
+Uso (preencher o catálogo com os dados já gravados):
+    python catalogo.py reconstruir
+"""
+import argparse
+import bisect
+import re
+
+from sqlalchemy import case, delete, func, insert, or_, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models.user import Cliente, Produto, Saldo, db
+from versao_dados import cache_por_versao
+
+LIMITE_BUSCA = 10
+LIMITE_BUSCA_MAXIMO = 50
+
+# Índices criados só no PostgreSQL (init_db_pg.py), depois de habilitar pg_trgm
+INDICES_POSTGRES = (
+    'CREATE INDEX IF NOT EXISTS ix_cliente_nome_trgm ON cliente USING gin ("xNome_dest" gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_cliente_cnpj_prefixo ON cliente (cnpj_dest text_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_produto_descricao_trgm ON produto USING gin ("xProd" gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_produto_codigo_trgm ON produto USING gin ("cProd" gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_produto_codigo_prefixo ON produto ("cProd" text_pattern_ops)',
+)
+
+# tipo -> (modelo, coluna do código, coluna do nome)
+CATALOGOS = {
+    'cliente': (Cliente, Cliente.cnpj_dest, Cliente.xNome_dest),
+    'produto': (Produto, Produto.cProd, Produto.xProd),
+}
+
+
+def criar_indices_busca(conn):
+    """Habilita pg_trgm e cria os índices de busca (apenas PostgreSQL)."""
+    if conn.dialect.name != 'postgresql':
+        return
+    conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    for comando in INDICES_POSTGRES:
+        conn.execute(text(comando))
+
+
+def _gravar(modelo, chave, nome, linhas):
+    if not linhas:
+        return
+    # Ordem fixa da chave: ingestões concorrentes não travam as linhas em ciclo
+    linhas = sorted(linhas, key=lambda linha: linha[chave])
+    dialeto = db.session.get_bind().dialect.name
+    if dialeto in ('postgresql', 'sqlite'):
+        modulo = postgresql if dialeto == 'postgresql' else sqlite
+        stmt = modulo.insert(modelo)
+        stmt = stmt.on_conflict_do_update(index_elements=[chave], set_={nome: stmt.excluded[nome]})
+        db.session.execute(stmt, linhas)
+        return
+
+    # Outros bancos: atualização linha a linha
+    for linha in linhas:
+        existente = modelo.query.filter_by(**{chave: linha[chave]}).first()
+        if existente:
+            setattr(existente, nome, linha[nome])
+        else:
+            db.session.add(modelo(**linha))
+
+
+def registrar_catalogo(registros):
+    """
+    Registra (ou renomeia) os destinatários e produtos das NF-es lidas.
+    Não faz commit: deve rodar na mesma transação da ingestão.
+    """
+    clientes = {}
+    produtos = {}
+    for registro in registros:
+        if registro.CNPJ_dest:
+            clientes[registro.CNPJ_dest] = registro.xNome_dest or ''
+        for item in registro.itens:
+            if item.cProd:
+                produtos[item.cProd] = item.xProd or ''
+    _gravar(Cliente, 'cnpj_dest', 'xNome_dest',
+            [{'cnpj_dest': cnpj, 'xNome_dest': nome} for cnpj, nome in clientes.items()])
+    _gravar(Produto, 'cProd', 'xProd',
+            [{'cProd': cprod, 'xProd': nome} for cprod, nome in produtos.items()])
+
+
+def reconstruir_catalogo():
+    """Preenche as tabelas cliente e produto a partir da tabela saldo."""
+    db.session.execute(delete(Cliente))
+    db.session.execute(delete(Produto))
+    db.session.execute(insert(Cliente).from_select(
+        ['cnpj_dest', 'xNome_dest'],
+        select(Saldo.cnpj_dest, func.coalesce(func.max(Saldo.xNome_dest), '')).group_by(Saldo.cnpj_dest)
+    ))
+    db.session.execute(insert(Produto).from_select(
+        ['cProd', 'xProd'],
+        select(Saldo.cProd, func.coalesce(func.max(Saldo.xProd), '')).group_by(Saldo.cProd)
+    ))
+    db.session.commit()
+    return (db.session.scalar(select(func.count()).select_from(Cliente)),
+            db.session.scalar(select(func.count()).select_from(Produto)))
+
+
+def _normalizar_codigo(termo, tipo):
+    # CNPJ pode vir com pontuação (12.345.678/0001-90)
+    return re.sub(r'\D', '', termo) if tipo == 'cliente' else termo
+
+
+def _escapar_like(termo):
+    return termo.replace('/', '//').replace('%', '/%').replace('_', '/_')
+
+
+def _buscar_sql(tipo, termo, limite):
+    """Busca no PostgreSQL: prefixo no código e trecho no nome (índices trigram)."""
+    _, codigo, nome = CATALOGOS[tipo]
+    termo_codigo = _normalizar_codigo(termo, tipo)
+    padrao = _escapar_like(termo)
+    condicoes = [nome.ilike(f'%{padrao}%', escape='/')]
+    faixas = []
+    if termo_codigo:
+        prefixo_codigo = codigo.like(f'{_escapar_like(termo_codigo)}%', escape='/')
+        condicoes.append(prefixo_codigo)
+        faixas = [(codigo == termo_codigo, 0), (prefixo_codigo, 1)]
+    if tipo == 'produto':
+        condicoes.append(codigo.ilike(f'%{padrao}%', escape='/'))
+    rank = case(*faixas, (nome.ilike(f'{padrao}%', escape='/'), 2), else_=3)
+    stmt = (select(codigo, nome).where(or_(*condicoes))
+            .order_by(rank, func.similarity(nome, termo).desc(), nome).limit(limite))
+    return [tuple(linha) for linha in db.session.execute(stmt)]
+
+
+@cache_por_versao
+def _indice_memoria(tipo):
+    """Índice em memória: códigos e nomes (minúsculos) ordenados, para busca por prefixo com bisect."""
+    _, codigo, nome = CATALOGOS[tipo]
+    entradas = [tuple(linha) for linha in db.session.execute(select(codigo, nome))]
+    por_codigo = sorted((c, i) for i, (c, _) in enumerate(entradas))
+    por_nome = sorted(((n or '').lower(), i) for i, (_, n) in enumerate(entradas))
+    return entradas, por_codigo, por_nome
+
+
+def _prefixo(ordenados, prefixo):
+    inicio = bisect.bisect_left(ordenados, (prefixo,))
+    for chave, indice in ordenados[inicio:]:
+        if not chave.startswith(prefixo):
+            break
+        yield chave, indice
+
+
+def _buscar_memoria(tipo, termo, limite):
+    entradas, por_codigo, por_nome = _indice_memoria(tipo)
+    termo_codigo = _normalizar_codigo(termo, tipo)
+    termo_nome = termo.lower()
+
+    rank = {}
+    if termo_codigo:
+        for chave, indice in _prefixo(por_codigo, termo_codigo):
+            rank[indice] = 0 if chave == termo_codigo else 1
+    for _, indice in _prefixo(por_nome, termo_nome):
+        rank.setdefault(indice, 2)
+    if len(rank) < limite:
+        # Trecho no meio do nome (ou do código do produto): varredura do índice em memória
+        for chave, indice in por_nome:
+            if indice not in rank and termo_nome in chave:
+                rank[indice] = 3
+        if tipo == 'produto':
+            for chave, indice in por_codigo:
+                if indice not in rank and termo_nome in chave.lower():
+                    rank[indice] = 3
+
+    ordem = sorted(rank, key=lambda i: (rank[i], (entradas[i][1] or '').lower()))
+    return [entradas[i] for i in ordem[:limite]]
+
+
+def buscar(termo, tipo, limite=LIMITE_BUSCA):
+    """
+    Clientes (CNPJ, nome) ou produtos (código, descrição) que casam com o termo,
+    ordenados por: código exato, prefixo do código, prefixo do nome, trecho do nome.
+    """
+    termo = termo.strip()
+    if not termo:
+        return []
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return _buscar_sql(tipo, termo, limite)
+    return _buscar_memoria(tipo, termo, limite)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Catálogo de clientes e produtos')
+    parser.add_argument('comando', choices=['reconstruir'])
+    args = parser.parse_args()
+
+    from main import app
+
+    with app.app_context():
+        clientes, produtos = reconstruir_catalogo()
+        print(f"Catálogo reconstruído: {clientes} clientes, {produtos} produtos.")
@@ -0,0 +1,81 @@
+"""
+Detecção rápida de NF-es já gravadas, antes do parse.
+
+A chave de acesso é extraída dos bytes do XML (atributo Id de infNFe) com uma
+expressão regular e procurada num conjunto em memória das chaves gravadas,
+carregado de nota_fiscal no primeiro uso e atualizado a cada gravação. Uma
+nota já conhecida é descartada sem parse nem consulta ao banco.
+
+O conjunto é de cada worker e só responde "já existe": chave desconhecida
+segue o caminho normal, em que o banco (consulta por bloco e restrição única
+de chave_acesso) decide. Notas gravadas por outros workers entram no conjunto
+quando o banco as aponta como duplicadas.
+"""
+import re
+import threading
+
+from sqlalchemy import select
+
+from models.user import NotaFiscal, db
+
+PADRAO_CHAVE = re.compile(rb'<(?:[\w.-]+:)?infNFe\b[^>]*?\bId\s*=\s*["\']NFe(\d{44})["\']')
+PADRAO_CHAVE_TEXTO = re.compile(PADRAO_CHAVE.pattern.decode())
+
+_lock = threading.Lock()
+# Chaves guardadas como inteiro (44 dígitos): menos da metade da memória de uma str
+_chaves = set()
+_banco_carregado = None
+
+
+def chave_do_xml(conteudo):
+    """Chave de acesso do XML (bytes ou str) sem montar a árvore; None se não encontrada."""
+    padrao = PADRAO_CHAVE if isinstance(conteudo, (bytes, bytearray)) else PADRAO_CHAVE_TEXTO
+    encontrada = padrao.search(conteudo)
+    if not encontrada:
+        return None
+    chave = encontrada.group(1)
+    return chave.decode() if isinstance(chave, bytes) else chave
+
+
+def _codigo(chave):
+    return int(chave) if chave and len(chave) == 44 and chave.isdigit() else None
+
+
+def _carregar():
+    """Carrega as chaves de nota_fiscal na primeira consulta do worker (ou após trocar de banco)."""
+    global _banco_carregado
+    url = str(db.engine.url)
+    if _banco_carregado == url:
+        return
+    with _lock:
+        if _banco_carregado == url:
+            return
+        from repositorio import ler_em_blocos
+        _chaves.clear()
+        for bloco in ler_em_blocos(select(NotaFiscal.chave_acesso), 10000):
+            _chaves.update(codigo for codigo in map(_codigo, (chave for chave, in bloco)) if codigo is not None)
+        _banco_carregado = url
+
+
+def chave_conhecida(chave):
+    """True se a chave certamente já está gravada; False quando só o banco pode dizer."""
+    codigo = _codigo(chave)
+    if codigo is None:
+        return False
+    _carregar()
+    return codigo in _chaves
+
+
+def lembrar_chaves(chaves):
+    """Acrescenta chaves gravadas (chamar só depois do commit)."""
+    if _banco_carregado is None:
+        return
+    _chaves.update(codigo for codigo in map(_codigo, chaves) if codigo is not None)
+
+
+def esquecer_chaves():
+    """Descarta o conjunto (ex.: após recriar as tabelas); é recarregado no próximo uso."""
+    global _banco_carregado
+    with _lock:
+        _chaves.clear()
+        _banco_carregado = None
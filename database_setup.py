@@ -1,55 +1,57 @@
-import sqlite3
-
-def setup_database(db_name="opme_control.db"):
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-
-    # Tabela para cabeçalho da NF-e
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS nfe_header (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nNF TEXT NOT NULL,
-            dEmi TEXT NOT NULL,
-            CNPJ_emit TEXT NOT NULL,
-            xNome_emit TEXT NOT NULL,
-            CNPJ_dest TEXT NOT NULL,
-            xNome_dest TEXT NOT NULL
-        )
-    ''')
-
-    # Tabela para itens da NF-e (produtos)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS nfe_item (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nfe_id INTEGER NOT NULL,
-            cProd TEXT NOT NULL,
-            xProd TEXT NOT NULL,
-            CFOP TEXT NOT NULL,
-            qCom REAL NOT NULL,
-            vUnCom REAL NOT NULL,
-            vProd REAL NOT NULL,
-            FOREIGN KEY (nfe_id) REFERENCES nfe_header(id)
-        )
-    ''')
-
-    # Tabela para informações de lote (rastreabilidade)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS lote_info (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nfe_item_id INTEGER NOT NULL,
-            nLote TEXT,
-            qLote REAL,
-            dFab TEXT,
-            dVal TEXT,
-            FOREIGN KEY (nfe_item_id) REFERENCES nfe_item(id)
-        )
-    ''')
-
-    conn.commit()
-    conn.close()
-
-if __name__ == '__main__':
-    setup_database()
-    print("Banco de dados 'opme_control.db' configurado com sucesso.")
+"""
+Criação e atualização do esquema do banco a partir dos modelos de models/user.py.
+
+É o único esquema da aplicação: as rotas, o opme_logic e os scripts usam as
+mesmas tabelas (nota_fiscal, item_nota_fiscal, movimento, saldo, ...).
+
+Uso (banco de DATABASE_URL):
+    python database_setup.py
+"""
+from flask import Flask
+from sqlalchemy import inspect, text
+
+from catalogo import criar_indices_busca
+from models.user import db
+from repositorio import configurar_banco
+
+
+def sincronizar_esquema():
+    """
+    Acrescenta a tabelas já existentes as colunas e índices novos dos modelos.
+    O create_all só cria tabelas inexistentes; não altera as que já estão no banco.
+    """
+    inspetor = inspect(db.engine)
+    tabelas_existentes = set(inspetor.get_table_names())
+    with db.engine.begin() as conn:
+        for tabela in db.metadata.sorted_tables:
+            if tabela.name not in tabelas_existentes:
+                continue
+            colunas_existentes = {c['name'] for c in inspetor.get_columns(tabela.name)}
+            for coluna in tabela.columns:
+                if coluna.name not in colunas_existentes:
+                    tipo = coluna.type.compile(dialect=conn.dialect)
+                    conn.execute(text(f'ALTER TABLE {tabela.name} ADD COLUMN "{coluna.name}" {tipo}'))
+                    print(f"Coluna {tabela.name}.{coluna.name} adicionada.")
+        for tabela in db.metadata.sorted_tables:
+            for indice in tabela.indexes:
+                indice.create(bind=conn, checkfirst=True)
+        criar_indices_busca(conn)
+
+
+def setup_database(app):
+    """Cria as tabelas inexistentes e sincroniza colunas e índices das existentes."""
+    with app.app_context():
+        db.create_all()
+        sincronizar_esquema()
+
+
+def criar_app_minimo():
+    """App Flask só com o banco configurado, para scripts que não precisam das rotas."""
+    app = Flask(__name__)
+    configurar_banco(app)
+    return app
 
 
+if __name__ == '__main__':
+    setup_database(criar_app_minimo())
+    print("Esquema do banco de dados criado ou atualizado.")
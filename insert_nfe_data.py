@@ -1,7 +1,120 @@
-import xml.etree.ElementTree as ET
-from models.user import NotaFiscal, ItemNotaFiscal, db 
+import logging
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import IntegrityError
+from models.user import Movimento, NotaFiscal, ItemNotaFiscal, LoteItemNotaFiscal, db 
 from flask import current_app
-from datetime import datetime
+from nfe_parser import parse_nfe, ler_documento
+from movimentos import projetar_movimentos, gravar_movimentos
+from saldo import aplicar_movimentos
+from snapshots import ajustar_snapshots
+from lotes import registrar_lotes
+from catalogo import registrar_catalogo
+from metrics import registrar_ingestao
+from versao_dados import incrementar_versao, escopos_ingestao
+from chaves_nfe import chave_do_xml, chave_conhecida, lembrar_chaves
+from arquivo_nfe import arquivar
+
+logger = logging.getLogger(__name__)
+
+# Quantidade de notas gravadas por transação na importação em lote
+TAMANHO_LOTE_GRAVACAO = 200
+
+
+def _gravar_registros(registros):
+    """
+    Grava cabeçalhos, itens, lotes e movimentos de várias NF-es já lidas com inserts
+    em massa e atualiza a tabela de saldos.
+    Não faz commit: a transação é controlada por quem chama.
+    """
+    if not registros:
+        return []
+
+    notas = db.session.execute(
+        insert(NotaFiscal).returning(NotaFiscal.id, sort_by_parameter_order=True),
+        [{
+            'chave_acesso': registro.chave_acesso,
+            'numero': registro.nNF,
+            'serie': registro.serie,
+            'data_emissao': registro.data_emissao,
+            'destinatario_nome': registro.xNome_dest,
+            'destinatario_cnpj': registro.CNPJ_dest,
+            'cfop': registro.itens[0].CFOP if registro.itens else None,
+        } for registro in registros]
+    ).all()
+
+    itens = [(item, {
+        'codigo_produto': item.cProd,
+        'descricao_produto': item.xProd,
+        'quantidade': item.qCom,
+        'valor_total': item.vProd,
+        'cfop': item.CFOP,
+        'nota_fiscal_id': nota.id,
+    }) for nota, registro in zip(notas, registros) for item in registro.itens]
+    if itens:
+        ids_itens = db.session.execute(
+            insert(ItemNotaFiscal).returning(ItemNotaFiscal.id, sort_by_parameter_order=True),
+            [linha for _, linha in itens]
+        ).scalars().all()
+        lotes = [{
+            'nLote': lote.nLote,
+            'qLote': lote.qLote,
+            'dFab': lote.dFab,
+            'dVal': lote.dVal,
+            'item_nota_fiscal_id': item_id,
+        } for item_id, (item, _) in zip(ids_itens, itens) for lote in item.lotes]
+        if lotes:
+            db.session.execute(insert(LoteItemNotaFiscal), lotes)
+            registrar_lotes(registros)
+
+    movimentos = [movimento for nota, registro in zip(notas, registros)
+                  for movimento in projetar_movimentos(registro, nota.id)]
+    gravar_movimentos(movimentos)
+    aplicar_movimentos(movimentos)
+    ajustar_snapshots(movimentos)
+    registrar_catalogo(registros)
+    incrementar_versao(escopos_ingestao(registro.CNPJ_dest for registro in registros))
+
+    return [nota.id for nota in notas]
+
+
+def _chaves_existentes(chaves):
+    """Retorna quais chaves de acesso já estão gravadas (consulta única por bloco de 1000)."""
+    chaves = list(chaves)
+    existentes = set()
+    for inicio in range(0, len(chaves), 1000):
+        bloco = chaves[inicio:inicio + 1000]
+        existentes.update(db.session.scalars(
+            select(NotaFiscal.chave_acesso).where(NotaFiscal.chave_acesso.in_(bloco))
+        ))
+    return existentes
+
+
+def _remover_notas(chaves):
+    """
+    Apaga as notas das chaves com itens, lotes e movimentos, desfazendo os movimentos
+    nos saldos e snapshots, para regravá-las. Não faz commit.
+    """
+    notas = select(NotaFiscal.id).where(NotaFiscal.chave_acesso.in_(chaves))
+    estornos = [dict(linha._mapping) for linha in db.session.execute(
+        select(Movimento.cnpj_dest, Movimento.xNome_dest, Movimento.cProd, Movimento.xProd,
+               Movimento.nLote, Movimento.dEmi, (-func.coalesce(Movimento.qSinal, 0.0)).label('qSinal'))
+        .where(Movimento.nota_fiscal_id.in_(notas))
+    )]
+    aplicar_movimentos(estornos)
+    ajustar_snapshots(estornos)
+
+    itens = select(ItemNotaFiscal.id).where(ItemNotaFiscal.nota_fiscal_id.in_(notas))
+    db.session.execute(delete(LoteItemNotaFiscal).where(LoteItemNotaFiscal.item_nota_fiscal_id.in_(itens)))
+    db.session.execute(delete(ItemNotaFiscal).where(ItemNotaFiscal.nota_fiscal_id.in_(notas)))
+    db.session.execute(delete(Movimento).where(Movimento.nota_fiscal_id.in_(notas)))
+    db.session.execute(delete(NotaFiscal).where(NotaFiscal.chave_acesso.in_(chaves)))
+
+
+def _duplicada(chave_acesso):
+    registrar_ingestao(duplicadas=1)
+    return {'success': False, 'message': f'Nota fiscal com chave {chave_acesso} já existe.'}
+
 
 def insert_nfe_data(xml_data, is_content=False):
     """
@@ -11,64 +124,145 @@ def insert_nfe_data(xml_data, is_content=False):
     try:
         app = current_app._get_current_object()
         with app.app_context():
-            # Parse do XML
-            if is_content:
-                # Se for conteúdo, decodifica se for bytes e faz o parse da string
-                if isinstance(xml_data, bytes):
-                    xml_data = xml_data.decode('utf-8')
-                root = ET.fromstring(xml_data)
-            else:
-                # Se for um caminho de arquivo, faz o parse do arquivo
-                tree = ET.parse(xml_data)
-                root = tree.getroot()
-
-            ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
-            
-            inf_nfe_element = root.find('.//nfe:infNFe', ns)
-            if inf_nfe_element is None:
-                raise ValueError("XML inválido: tag infNFe não encontrada.")
+            if not is_content:
+                with open(xml_data, 'rb') as arquivo:
+                    xml_data = arquivo.read()
 
-            chave_acesso = inf_nfe_element.attrib.get('Id', '').replace('NFe', '')
+            # Caminho rápido: nota já conhecida pelo worker, descartada sem parse nem consulta
+            chave_acesso = chave_do_xml(xml_data)
+            if chave_conhecida(chave_acesso):
+                arquivar([(chave_acesso, xml_data)])
+                return _duplicada(chave_acesso)
+
+            # Parse do XML em uma única passada
+            registro = parse_nfe(xml_data, is_file=False)
+
+            chave_acesso = registro.chave_acesso
             if not chave_acesso:
-                 raise ValueError("Chave de acesso não encontrada no XML.")
-
-            # Verificação de duplicidade
-            existing_nfe = NotaFiscal.query.filter_by(chave_acesso=chave_acesso).first()
-            if existing_nfe:
-                return {'success': False, 'message': f'Nota fiscal com chave {chave_acesso} já existe.'}
-
-            # Extrair dados da NF-e
-            ide = inf_nfe_element.find('nfe:ide', ns)
-            dest = inf_nfe_element.find('nfe:dest', ns)
-            
-            nova_nfe = NotaFiscal(
-                chave_acesso=chave_acesso,
-                numero=ide.find('nfe:nNF', ns).text,
-                serie=ide.find('nfe:serie', ns).text,
-                data_emissao=datetime.fromisoformat(ide.find('nfe:dhEmi', ns).text),
-                destinatario_nome=dest.find('nfe:xNome', ns).text,
-                destinatario_cnpj=dest.find('nfe:CNPJ', ns).text,
-                # Adicione outras colunas conforme necessário
-            )
-            db.session.add(nova_nfe)
-            
-            # Extrair dados dos itens
-            for det in root.findall('.//nfe:det', ns):
-                prod = det.find('nfe:prod', ns)
-                novo_item = ItemNotaFiscal(
-                    codigo_produto=prod.find('nfe:cProd', ns).text,
-                    descricao_produto=prod.find('nfe:xProd', ns).text,
-                    quantidade=float(prod.find('nfe:qCom', ns).text),
-                    valor_total=float(prod.find('nfe:vProd', ns).text),
-                    nota_fiscal=nova_nfe
-                )
-                db.session.add(novo_item)
+                raise ValueError("XML inválido: tag infNFe não encontrada.")
 
-            db.session.commit()
-            return {'success': True, 'message': f'Nota fiscal {nova_nfe.numero} inserida com sucesso!'}
+            # A restrição única de chave_acesso decide a duplicidade (sem consulta prévia)
+            try:
+                _gravar_registros([registro])
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                if not _chaves_existentes([chave_acesso]):
+                    raise
+                lembrar_chaves([chave_acesso])
+                arquivar([(chave_acesso, xml_data)])
+                return _duplicada(chave_acesso)
+
+            lembrar_chaves([chave_acesso])
+            arquivar([(chave_acesso, xml_data)])
+            registrar_ingestao(inseridas=1, itens=len(registro.itens))
+            return {'success': True, 'message': f'Nota fiscal {registro.nNF} inserida com sucesso!'}
 
     except Exception as e:
         db.session.rollback()
-        # Logar o erro pode ser útil em produção
-        print(f"ERRO em insert_nfe_data: {str(e)}")
+        registrar_ingestao(falhas=1)
+        logger.exception(f"Erro em insert_nfe_data: {str(e)}")
         raise e
+
+
+def insert_nfe_batch(documentos, tamanho_lote=TAMANHO_LOTE_GRAVACAO, executor=None, substituir=False,
+                     ao_gravar_bloco=None):
+    """
+    Insere várias NF-es de uma vez. Os XMLs gravados (e os duplicados ainda não
+    arquivados) vão para o arquivo local de NF-e.
+
+    Args:
+        documentos: iterável de (nome_arquivo, conteúdo_xml)
+        tamanho_lote: quantidade de notas gravadas por transação
+        executor: pool opcional (ex.: nfe_parser.pool_de_leitura) usado para o parse dos XMLs
+        substituir: regrava as notas já existentes (reprocessamento com o parser atual)
+        ao_gravar_bloco: chamada com os resultados de cada bloco gravado antes do commit,
+            para gravar dados próprios (ex.: checkpoints) na mesma transação das notas
+
+    Returns:
+        list: um resultado por arquivo ({'arquivo', 'chave_acesso', 'success', 'duplicada', 'message'})
+    """
+    resultados = []
+    lidos = []
+    a_ler = []
+    conhecidas = 0
+    for nome, conteudo in documentos:
+        resultado = {'arquivo': nome, 'chave_acesso': None, 'success': False, 'duplicada': False, 'message': ''}
+        resultados.append(resultado)
+        lidos.append((resultado, conteudo))
+        # Notas já conhecidas pelo worker não passam pelo parse
+        chave = chave_do_xml(conteudo)
+        if not substituir and chave_conhecida(chave):
+            resultado.update(chave_acesso=chave, duplicada=True, message=f'Nota fiscal com chave {chave} já existe.')
+            conhecidas += 1
+            continue
+        a_ler.append((resultado, conteudo))
+    registrar_ingestao(duplicadas=conhecidas)
+
+    conteudos = [conteudo for _, conteudo in a_ler]
+    if executor is not None:
+        leituras = executor.map(ler_documento, conteudos, chunksize=16)
+    else:
+        leituras = map(ler_documento, conteudos)
+
+    pendentes = []
+    for (resultado, _), (registro, erro) in zip(a_ler, leituras):
+        if erro:
+            resultado['message'] = erro
+            continue
+        if not registro.chave_acesso:
+            resultado['message'] = 'XML inválido: tag infNFe não encontrada.'
+            continue
+        resultado['chave_acesso'] = registro.chave_acesso
+        pendentes.append((resultado, registro))
+
+    registrar_ingestao(falhas=len(a_ler) - len(pendentes))
+    _inserir_registros(pendentes, tamanho_lote, substituir, ao_gravar_bloco)
+    arquivar((resultado['chave_acesso'], conteudo) for resultado, conteudo in lidos
+             if resultado['success'] or resultado['duplicada'])
+    return resultados
+
+
+def _inserir_registros(pendentes, tamanho_lote, substituir=False, ao_gravar_bloco=None):
+    """
+    Descarta duplicadas (banco e próprio lote) e grava o restante em transações por bloco.
+    Com `substituir`, as notas já gravadas são apagadas e regravadas na transação do bloco.
+    `ao_gravar_bloco` recebe os resultados do bloco (já marcados como sucesso) antes do commit.
+    """
+    existentes = _chaves_existentes({registro.chave_acesso for _, registro in pendentes})
+    lembrar_chaves(existentes)
+
+    novos = []
+    vistas = set()
+    for resultado, registro in pendentes:
+        chave = registro.chave_acesso
+        if (chave in existentes and not substituir) or chave in vistas:
+            resultado['duplicada'] = True
+            resultado['message'] = f'Nota fiscal com chave {chave} já existe.'
+            continue
+        vistas.add(chave)
+        novos.append((resultado, registro))
+    registrar_ingestao(duplicadas=len(pendentes) - len(novos))
+
+    for inicio in range(0, len(novos), tamanho_lote):
+        bloco = novos[inicio:inicio + tamanho_lote]
+        try:
+            substituidas = [registro.chave_acesso for _, registro in bloco if registro.chave_acesso in existentes]
+            if substituidas:
+                _remover_notas(substituidas)
+            _gravar_registros([registro for _, registro in bloco])
+            for resultado, registro in bloco:
+                resultado['success'] = True
+                resultado['message'] = f'Nota fiscal {registro.nNF} inserida com sucesso!'
+            if ao_gravar_bloco:
+                ao_gravar_bloco([resultado for resultado, _ in bloco])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            for resultado, _ in bloco:
+                resultado['success'] = False
+                resultado['message'] = f'Erro ao gravar nota fiscal: {str(e)}'
+            registrar_ingestao(falhas=len(bloco))
+            continue
+        lembrar_chaves(registro.chave_acesso for _, registro in bloco)
+        registrar_ingestao(inseridas=len(bloco), itens=sum(len(registro.itens) for _, registro in bloco))
@@ -0,0 +1,124 @@
+"""
+Datas de fabricação e validade dos lotes (tabela lote).
+
+A ingestão registra dFab/dVal de cada lote informado no rastro das NF-es
+(registrar_lotes). O relatório de vencimentos parte do índice em dVal e
+cruza apenas os lotes do intervalo com a tabela saldo, sem percorrer
+movimento.
+
+Uso (preencher a tabela com as notas já gravadas):
+    python lotes.py reconstruir
+"""
+import argparse
+from datetime import date, timedelta
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models.user import ItemNotaFiscal, Lote, LoteItemNotaFiscal, Saldo, db
+from saldo import TOLERANCIA
+
+
+def _data(valor):
+    try:
+        return date.fromisoformat(valor[:10]) if valor else None
+    except ValueError:
+        return None
+
+
+def _agrupar_lotes(lotes):
+    """Uma linha por (cProd, nLote); datas informadas prevalecem sobre as vazias."""
+    por_chave = {}
+    for cprod, lote in lotes:
+        if not lote.nLote:
+            continue
+        atual = por_chave.setdefault((cprod, lote.nLote), {'cProd': cprod, 'nLote': lote.nLote,
+                                                           'dFab': None, 'dVal': None})
+        atual['dFab'] = _data(lote.dFab) or atual['dFab']
+        atual['dVal'] = _data(lote.dVal) or atual['dVal']
+    return list(por_chave.values())
+
+
+def registrar_lotes(registros):
+    """
+    Grava (ou completa) as datas dos lotes das NF-es lidas.
+    Não faz commit: deve rodar na mesma transação da ingestão.
+    """
+    linhas = _agrupar_lotes((item.cProd, lote) for registro in registros
+                            for item in registro.itens for lote in item.lotes)
+    if not linhas:
+        return
+    # Ordem fixa da chave: ingestões concorrentes não travam as linhas em ciclo
+    linhas.sort(key=lambda linha: (linha['cProd'] or '', linha['nLote']))
+
+    dialeto = db.session.get_bind().dialect.name
+    if dialeto in ('postgresql', 'sqlite'):
+        modulo = postgresql if dialeto == 'postgresql' else sqlite
+        stmt = modulo.insert(Lote)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['cProd', 'nLote'],
+            set_={
+                'dFab': func.coalesce(stmt.excluded.dFab, Lote.dFab),
+                'dVal': func.coalesce(stmt.excluded.dVal, Lote.dVal),
+            }
+        )
+        db.session.execute(stmt, linhas)
+        return
+
+    # Outros bancos: atualização linha a linha
+    for linha in linhas:
+        existente = Lote.query.filter_by(cProd=linha['cProd'], nLote=linha['nLote']).first()
+        if existente:
+            existente.dFab = linha['dFab'] or existente.dFab
+            existente.dVal = linha['dVal'] or existente.dVal
+        else:
+            db.session.add(Lote(**linha))
+
+
+def reconstruir_lotes():
+    """Preenche a tabela lote a partir dos lotes das notas já gravadas."""
+    resultado = db.session.execute(
+        select(ItemNotaFiscal.codigo_produto, LoteItemNotaFiscal)
+        .join(ItemNotaFiscal, LoteItemNotaFiscal.item_nota_fiscal_id == ItemNotaFiscal.id)
+    ).all()
+    linhas = _agrupar_lotes(resultado)
+    db.session.execute(delete(Lote))
+    if linhas:
+        db.session.execute(insert(Lote), linhas)
+    db.session.commit()
+    return len(linhas)
+
+
+def lotes_vencendo(dias, cnpj_cliente=None, incluir_vencidos=False):
+    """
+    Lotes em consignação (saldo negativo) com validade nos próximos `dias` dias.
+
+    Returns:
+        list: linhas (cnpj_dest, xNome_dest, cProd, xProd, nLote, dFab, dVal, consignado)
+    """
+    hoje = date.today()
+    stmt = (
+        select(Saldo.cnpj_dest, Saldo.xNome_dest, Saldo.cProd, Saldo.xProd, Saldo.nLote,
+               Lote.dFab, Lote.dVal, (-Saldo.saldo).label('consignado'))
+        .select_from(Lote)
+        .join(Saldo, (Saldo.cProd == Lote.cProd) & (Saldo.nLote == Lote.nLote))
+        .where(Lote.dVal <= hoje + timedelta(days=dias))
+        .where(Saldo.saldo < -TOLERANCIA)
+        .order_by(Lote.dVal, Saldo.cnpj_dest, Saldo.cProd)
+    )
+    if not incluir_vencidos:
+        stmt = stmt.where(Lote.dVal >= hoje)
+    if cnpj_cliente:
+        stmt = stmt.where(Saldo.cnpj_dest == cnpj_cliente)
+    return db.session.execute(stmt).all()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Datas de fabricação e validade dos lotes')
+    parser.add_argument('comando', choices=['reconstruir'])
+    args = parser.parse_args()
+
+    from main import app
+
+    with app.app_context():
+        print(f"Tabela lote reconstruída: {reconstruir_lotes()} lotes.")
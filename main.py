@@ -1,12 +1,18 @@
 import os
-from flask import Flask, send_from_directory, jsonify
+from flask import Flask
 from flask_cors import CORS
 
 # Imports dos módulos da aplicação
-from models.user import db
+from repositorio import configurar_banco
+from database_setup import setup_database
 from routes.user import user_bp
 from routes.opme import opme_bp
 from routes.maino import maino_bp
+from routes.export import export_bp
+from sync_scheduler import iniciar_agendador
+from metrics import instalar_metricas
+from profiler import instalar_profiler
+from static_assets import ManifestoEstatico
 
 app = Flask(__name__, static_folder='static')
 
@@ -14,43 +20,48 @@ app = Flask(__name__, static_folder='static')
 app.config["SECRET_KEY"] = "asdf#FGSgvasgf$5$WGT"
 
 # 2. Configuração do CORS: Usando o curinga "*"
-CORS(app, resources={r"/api/*": {"origins": "*"}})
+CORS(app, resources={r"/api/*": {"origins": "*"}}, expose_headers=["X-Next-Cursor", "ETag", "Content-Disposition"])
 
 # 3. Configuração e Inicialização do Banco de Dados
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db.init_app(app)
+# URI de DATABASE_URL, pool de conexões por worker e PRAGMAs do SQLite (ver repositorio.py)
+configurar_banco(app)
 
 # 4. Registro dos Blueprints (As rotas da API TÊM PRIORIDADE)
 # Colocar o registro dos blueprints aqui garante que o Flask os reconheça antes da rota catch-all
 app.register_blueprint(user_bp, url_prefix='/api')
 app.register_blueprint(opme_bp, url_prefix='/api')
 app.register_blueprint(maino_bp, url_prefix='/api')
+app.register_blueprint(export_bp, url_prefix='/api')
+
+# Latência por rota, SQL por requisição e contadores de ingestão em /api/metrics
+instalar_metricas(app)
+
+# Profiling por requisição (cabeçalho X-Profile), ativo só com PROFILER_TOKEN
+instalar_profiler(app)
+
+# Sincronização incremental periódica com o Mainô (ativada por MAINO_SYNC_INTERVALO_MIN)
+iniciar_agendador(app)
 
 
 # 5. Rota "pega-tudo" para servir o frontend React (ÚLTIMA PRIORIDADE)
+# Manifesto de static/ montado uma vez: variantes gzip/brotli, ETags e cabeçalhos de cache
+manifesto_estatico = ManifestoEstatico(app.static_folder)
+
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
-    static_folder_path = app.static_folder
-    if static_folder_path is None:
+    # Arquivo estático (CSS, JS, imagem) ou, para rotas do frontend, o index.html
+    resposta = manifesto_estatico.servir(path)
+    if resposta is None:
         # Se o static folder não estiver configurado (não deve acontecer no Railway)
         return "Static folder not configured", 404
-
-    # Primeiro, verifica se o caminho corresponde a um arquivo estático (CSS, JS, imagem)
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
-    
-    # Se não for um arquivo estático E não for uma rota de API (o Flask verifica isso primeiro),
-    # retorna o index.html para o roteador do frontend
-    else:
-        return send_from_directory(static_folder_path, 'index.html')
+    return resposta
 
 # Bloco de execução principal
 if __name__ == '__main__':
     # Cria as tabelas do banco de dados ANTES de iniciar o servidor
-    with app.app_context():
-        db.create_all()
+    setup_database(app)
     
     # Define a porta e inicia o servidor
     port = int(os.environ.get('PORT', 5000))
@@ -1,26 +1,74 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
-from datetime import datetime
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import tempfile
 import zipfile
 import os
 import logging
-from insert_nfe_data import insert_nfe_data
-from models.opme import NotaFiscal, ItemNotaFiscal, db # Importação corrigida
+from insert_nfe_data import insert_nfe_batch
+from nfe_parser import pool_de_leitura
+from profiler import perfilado
+from models.user import NotaFiscal, ItemNotaFiscal, db
 
 # Configuração de logging para diagnóstico no backend
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Download do ZIP em blocos; até este tamanho o arquivo fica em memória, acima vai para disco
+TAMANHO_BLOCO_DOWNLOAD = 1024 * 1024
+LIMITE_ZIP_EM_MEMORIA = 32 * 1024 * 1024
+# XMLs lidos do ZIP e entregues de uma vez ao gravador em lote (limita a memória usada)
+XMLS_POR_LOTE = 500
+# Processos usados no parse dos XMLs (padrão: número de CPUs)
+PROCESSOS_PARSE = int(os.getenv('MAINO_PARSE_WORKERS', '0')) or None
+
+# Listagem de notas: o período é dividido em janelas buscadas em paralelo, página a página
+JANELA_LISTAGEM_DIAS = int(os.getenv('MAINO_JANELA_DIAS', '30'))
+ITENS_POR_PAGINA = int(os.getenv('MAINO_ITENS_POR_PAGINA', '100'))
+THREADS_LISTAGEM = int(os.getenv('MAINO_THREADS_LISTAGEM', '4'))
+# Teto de páginas por janela: uma paginação que não termina vira erro em vez de laço infinito
+MAX_PAGINAS_JANELA = int(os.getenv('MAINO_MAX_PAGINAS', '1000'))
+CHAVES_LISTA_NOTAS = ('notas_fiscais', 'notas_fiscais_emitidas', 'nfes', 'data', 'items')
+# Novas tentativas em 429/5xx, com espera exponencial (ou Retry-After, quando enviado)
+MAX_TENTATIVAS = 5
+ESPERA_BASE_SEGUNDOS = 0.5
+STATUS_REPETIVEIS = {429, 500, 502, 503, 504}
+FORMATOS_DATA = ('%d/%m/%Y', '%Y-%m-%d')
+
+# Conexões HTTP: pool de keep-alive compartilhado e timeouts (conexão, leitura) em segundos
+TAMANHO_POOL_HTTP = int(os.getenv('MAINO_POOL_SIZE', '10'))
+TIMEOUT_CONEXAO = float(os.getenv('MAINO_TIMEOUT_CONEXAO', '5'))
+TIMEOUT_LEITURA = float(os.getenv('MAINO_TIMEOUT_LEITURA', '30'))
+# Validade assumida do token quando a resposta não traz expires_in, e margem de renovação
+VALIDADE_TOKEN_PADRAO = int(os.getenv('MAINO_TOKEN_VALIDADE', '3600'))
+MARGEM_RENOVACAO_TOKEN = 60
+
 class MainoAPI:
-    _access_token = None 
 
-    def __init__(self, api_key=None, email=None, password=None):
+    def __init__(self, api_key=None, email=None, password=None, pool_size=TAMANHO_POOL_HTTP,
+                 timeout=(TIMEOUT_CONEXAO, TIMEOUT_LEITURA)):
         # Corrigido para a URL base oficial da API
-        self.base_url = "https://api.maino.com.br"
+        self.base_url = os.getenv('MAINO_BASE_URL', "https://api.maino.com.br")
         self.api_key = api_key
         self.email = email
         self.password = password
+        self.timeout = timeout
+
+        # Sessão com pool de conexões keep-alive, reaproveitada por todas as chamadas
+        self.session = requests.Session()
+        self.session.verify = False
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._access_token = None
+        self._token_expira_em = 0.0
+        self._token_lock = threading.Lock()
         
     def _authenticate(self):
         """Faz a requisição para obter o access_token."""
@@ -36,14 +84,16 @@ class MainoAPI:
         logger.info("Tentando autenticar na API do Maino...")
         
         try:
-            response = requests.post(endpoint, headers=headers, json=payload, timeout=10, verify=False)
+            response = self.session.post(endpoint, headers=headers, json=payload, timeout=self.timeout)
             response.raise_for_status()
             
             result = response.json()
             token = result.get('access_token')
             
             if token:
-                MainoAPI._access_token = token
+                validade = int(result.get('expires_in') or VALIDADE_TOKEN_PADRAO)
+                self._access_token = token
+                self._token_expira_em = time.monotonic() + validade
                 logger.info("Autenticação bem-sucedida! Token obtido.")
                 return True
             else:
@@ -57,17 +107,37 @@ class MainoAPI:
             logger.error(f"Erro inesperado durante a autenticação: {e}")
             return False
 
-    def _get_headers(self):
+    def _obter_token(self, token_rejeitado=None):
+        """
+        Retorna um token válido, autenticando quando não há token, quando ele está
+        perto de expirar ou quando `token_rejeitado` (recusado com 401) ainda é o atual.
+        O lock garante uma única reautenticação em andamento: as demais threads
+        esperam e reaproveitam o token novo.
+        """
+        with self._token_lock:
+            valido = (self._access_token
+                      and time.monotonic() < self._token_expira_em - MARGEM_RENOVACAO_TOKEN
+                      and self._access_token != token_rejeitado)
+            if not valido:
+                if not self._authenticate():
+                    raise Exception("Falha na autenticação. Verifique application_uid, email e password.")
+            return self._access_token
+
+    def _get_headers(self, token_rejeitado=None):
         """Retorna os headers para requisições autenticadas."""
         headers = {"Content-Type": "application/json"}
-        
-        if not MainoAPI._access_token:
-            if not self._authenticate():
-                raise Exception("Falha na autenticação. Verifique application_uid, email e password.")
-
-        headers["Authorization"] = f"Bearer {MainoAPI._access_token}"
-        
+        headers["Authorization"] = f"Bearer {self._obter_token(token_rejeitado)}"
         return headers
+
+    def _requisicao(self, metodo, endpoint, **kwargs):
+        """Requisição autenticada pela sessão compartilhada; um 401 renova o token e repete uma vez."""
+        kwargs.setdefault('timeout', self.timeout)
+        headers = self._get_headers()
+        response = self.session.request(metodo, endpoint, headers=headers, **kwargs)
+        if response.status_code == 401:
+            token_rejeitado = headers["Authorization"].split(" ", 1)[1]
+            response = self.session.request(metodo, endpoint, headers=self._get_headers(token_rejeitado), **kwargs)
+        return response
     
     def test_connection(self):
         """
@@ -80,28 +150,111 @@ class MainoAPI:
             logger.error(f"Erro no teste de conexão: {e}")
             return {"status": "error", "message": str(e), "code": 401}
             
-    def listar_notas_fiscais_emitidas(self, data_inicio, data_fim, numero_nfe=None, cnpj_destinatario=None, exibir_xmls=False):
-        """Lista notas fiscais emitidas"""
+    def _get_com_retry(self, endpoint, params):
+        """GET autenticado com novas tentativas e espera exponencial em 429/5xx."""
+        for tentativa in range(MAX_TENTATIVAS):
+            response = self._requisicao("GET", endpoint, params=params)
+            if response.status_code not in STATUS_REPETIVEIS or tentativa == MAX_TENTATIVAS - 1:
+                response.raise_for_status()
+                return response
+            retry_after = response.headers.get('Retry-After')
+            espera = float(retry_after) if retry_after and retry_after.isdigit() else \
+                ESPERA_BASE_SEGUNDOS * (2 ** tentativa) + random.uniform(0, ESPERA_BASE_SEGUNDOS)
+            logger.warning(f"Mainô respondeu {response.status_code}; nova tentativa em {espera:.1f}s")
+            time.sleep(espera)
+
+    @staticmethod
+    def _janelas(data_inicio, data_fim, dias=JANELA_LISTAGEM_DIAS):
+        """Divide o período em janelas de `dias` dias, mantendo o formato de data recebido."""
+        for formato in FORMATOS_DATA:
+            try:
+                inicio = datetime.strptime(data_inicio, formato)
+                fim = datetime.strptime(data_fim, formato)
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError(f"Formato de data não reconhecido: {data_inicio} / {data_fim}")
+
+        janelas = []
+        while inicio <= fim:
+            fim_janela = min(inicio + timedelta(days=dias - 1), fim)
+            janelas.append((inicio.strftime(formato), fim_janela.strftime(formato)))
+            inicio = fim_janela + timedelta(days=1)
+        return janelas
+
+    @staticmethod
+    def _itens_da_pagina(pagina):
+        """
+        Extrai a lista de notas da resposta (lista direta ou uma das CHAVES_LISTA_NOTAS).
+        Uma resposta em outro formato gera ValueError, em vez de ser lida como página vazia.
+        """
+        if isinstance(pagina, list):
+            return pagina, None
+        if not isinstance(pagina, dict):
+            raise ValueError(f"Resposta da listagem do Mainô em formato desconhecido: {type(pagina).__name__}")
+        total_paginas = pagina.get('total_pages') or (pagina.get('pagination') or {}).get('total_pages')
+        for chave in CHAVES_LISTA_NOTAS:
+            if isinstance(pagina.get(chave), list):
+                return pagina[chave], total_paginas
+        raise ValueError(f"Resposta da listagem do Mainô sem lista de notas (chaves: {', '.join(sorted(pagina))})")
+
+    def _listar_janela(self, params):
+        """
+        Busca todas as páginas de uma janela de datas. Para quando uma página repete a
+        anterior (API ignorando o parâmetro page) e falha ao passar de MAX_PAGINAS_JANELA.
+        """
         endpoint = f"{self.base_url}/api/v2/notas_fiscais_emitidas"
-        
-        params = {
-            "data_inicio": data_inicio,
-            "data_fim": data_fim,
-            "exibir_xmls": str(exibir_xmls).lower()
-        }
-        
+        notas = []
+        anterior = None
+        for pagina in range(1, MAX_PAGINAS_JANELA + 1):
+            response = self._get_com_retry(endpoint, dict(params, page=pagina, per_page=ITENS_POR_PAGINA))
+            itens, total_paginas = self._itens_da_pagina(response.json())
+            if itens and itens == anterior:
+                logger.warning(f"Página {pagina} repete a anterior na janela "
+                               f"{params.get('data_inicio')} a {params.get('data_fim')}; listagem encerrada")
+                return notas
+            notas.extend(itens)
+            anterior = itens
+            if total_paginas:
+                if pagina >= int(total_paginas):
+                    return notas
+            elif len(itens) < ITENS_POR_PAGINA:
+                return notas
+        raise RuntimeError(f"Listagem da janela {params.get('data_inicio')} a {params.get('data_fim')} "
+                           f"passou de {MAX_PAGINAS_JANELA} páginas")
+
+    def iterar_notas_fiscais_emitidas(self, data_inicio, data_fim, numero_nfe=None, cnpj_destinatario=None,
+                                      exibir_xmls=False, threads=THREADS_LISTAGEM):
+        """
+        Gera as notas emitidas no período, buscando as janelas de datas em paralelo
+        (pool limitado de threads) e todas as páginas de cada janela.
+        """
+        filtros = {"exibir_xmls": str(exibir_xmls).lower()}
         if numero_nfe:
-            params["numero_nfe"] = numero_nfe
+            filtros["numero_nfe"] = numero_nfe
         if cnpj_destinatario:
-            params["cnpj_destinatario"] = cnpj_destinatario
-        
+            filtros["cnpj_destinatario"] = cnpj_destinatario
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            futuros = [
+                executor.submit(self._listar_janela, dict(filtros, data_inicio=inicio, data_fim=fim))
+                for inicio, fim in self._janelas(data_inicio, data_fim)
+            ]
+            for futuro in as_completed(futuros):
+                yield from futuro.result()
+
+    def listar_notas_fiscais_emitidas(self, data_inicio, data_fim, numero_nfe=None, cnpj_destinatario=None, exibir_xmls=False):
+        """Lista notas fiscais emitidas (todas as páginas de todo o período)"""
         try:
-            response = requests.get(endpoint, headers=self._get_headers(), params=params, verify=False)
-            response.raise_for_status()
-            return response.json()
+            notas = list(self.iterar_notas_fiscais_emitidas(
+                data_inicio, data_fim, numero_nfe=numero_nfe,
+                cnpj_destinatario=cnpj_destinatario, exibir_xmls=exibir_xmls
+            ))
+            return {"notas_fiscais": notas, "total": len(notas)}
         except requests.exceptions.HTTPError as e:
             logger.error(f"Erro HTTP ao listar notas fiscais: {e}")
-            return {"error": f"Erro na API do Mainô: {response.status_code}. {e}"}
+            return {"error": f"Erro na API do Mainô: {e.response.status_code}. {e}"}
         except requests.exceptions.RequestException as e:
             logger.error(f"Erro de rede/conexão: {e}")
             return {"error": f"Erro de rede ao conectar à API do Mainô: {e}"}
@@ -119,7 +272,7 @@ class MainoAPI:
         }
         
         try:
-            response = requests.get(endpoint, headers=self._get_headers(), params=params, verify=False)
+            response = self._requisicao("GET", endpoint, params=params)
             response.raise_for_status()
             result = response.json()
             return result.get("zip_url")
@@ -127,6 +280,95 @@ class MainoAPI:
             logger.error(f"Erro ao exportar XMLs: {e}")
             return None
     
+    def baixar_zip(self, zip_url, destino=None):
+        """
+        Baixa o ZIP exportado em blocos. Sem `destino`, grava em um arquivo temporário
+        "spooled" (em memória até LIMITE_ZIP_EM_MEMORIA, depois em disco) e o devolve
+        aberto; com `destino`, grava nesse caminho (via um arquivo .part exclusivo deste
+        download, para que downloads simultâneos não se misturem) e devolve o caminho.
+        """
+        if destino:
+            descritor, parcial = tempfile.mkstemp(prefix=os.path.basename(destino) + '.',
+                                                  suffix='.part', dir=os.path.dirname(destino) or '.')
+            arquivo = os.fdopen(descritor, 'wb')
+        else:
+            arquivo = tempfile.SpooledTemporaryFile(max_size=LIMITE_ZIP_EM_MEMORIA, suffix='.zip')
+        try:
+            with self.session.get(zip_url, stream=True, timeout=(TIMEOUT_CONEXAO, 60)) as zip_response:
+                zip_response.raise_for_status()
+                for bloco in zip_response.iter_content(chunk_size=TAMANHO_BLOCO_DOWNLOAD):
+                    arquivo.write(bloco)
+        except Exception:
+            arquivo.close()
+            if destino:
+                os.remove(parcial)
+            raise
+        if destino:
+            arquivo.close()
+            os.replace(parcial, destino)
+            return destino
+        arquivo.seek(0)
+        return arquivo
+
+    @staticmethod
+    def _membros_xml(zip_ref):
+        return [membro for membro in zip_ref.infolist()
+                if not membro.is_dir() and membro.filename.lower().endswith('.xml')]
+
+    @classmethod
+    def contar_xmls(cls, arquivo_zip):
+        with zipfile.ZipFile(arquivo_zip, 'r') as zip_ref:
+            return len(cls._membros_xml(zip_ref))
+
+    @classmethod
+    def _lotes_de_xmls(cls, zip_ref, tamanho_lote, ignorar_arquivos=()):
+        """Lê os XMLs direto do ZIP (sem extrair para disco) em lotes de (nome, conteúdo)."""
+        lote = []
+        for membro in cls._membros_xml(zip_ref):
+            if membro.filename in ignorar_arquivos:
+                continue
+            lote.append((membro.filename, zip_ref.read(membro)))
+            if len(lote) >= tamanho_lote:
+                yield lote
+                lote = []
+        if lote:
+            yield lote
+
+    def processar_zip(self, arquivo_zip, processos=PROCESSOS_PARSE, tamanho_lote=XMLS_POR_LOTE,
+                      ignorar_arquivos=(), ao_concluir_lote=None, ao_gravar_bloco=None):
+        """
+        Processa os XMLs de um ZIP já baixado: parse em um pool de processos e
+        gravação em lote (insert_nfe_batch) no processo atual.
+
+        Args:
+            ignorar_arquivos: nomes de membros já processados (retomada de sincronização)
+            ao_concluir_lote: chamada com os resultados de cada lote já gravado
+            ao_gravar_bloco: repassada a insert_nfe_batch (roda na transação de cada bloco de notas)
+
+        Returns:
+            dict: contagens de inseridas e duplicadas e lista de erros
+        """
+        processed_count = 0
+        duplicate_count = 0
+        errors = []
+
+        with zipfile.ZipFile(arquivo_zip, 'r') as zip_ref, \
+                pool_de_leitura(processos) as executor:
+            for lote in self._lotes_de_xmls(zip_ref, tamanho_lote, ignorar_arquivos):
+                resultados = insert_nfe_batch(lote, executor=executor, ao_gravar_bloco=ao_gravar_bloco)
+                for resultado in resultados:
+                    if resultado['success']:
+                        processed_count += 1
+                    elif resultado['duplicada']:
+                        duplicate_count += 1
+                    else:
+                        errors.append(f"Erro ao processar {resultado['arquivo']}: {resultado['message']}")
+                if ao_concluir_lote:
+                    ao_concluir_lote(resultados)
+
+        return {"processed_count": processed_count, "duplicate_count": duplicate_count, "errors": errors}
+
+    @perfilado('maino_baixar_e_processar_xmls')
     def baixar_e_processar_xmls(self, data_inicio, data_fim, db_path="database/app.db"):
         """
         Baixa XMLs do Mainô e processa automaticamente
@@ -140,37 +382,36 @@ class MainoAPI:
             return {"success": False, "message": "Erro ao obter URL do ZIP"}
         
         try:
-            zip_response = requests.get(zip_url, verify=False)
-            zip_response.raise_for_status()
-            
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as temp_zip:
-                temp_zip.write(zip_response.content)
-                temp_zip_path = temp_zip.name
-            
-            processed_count = 0
-            errors = []
-            
-            with zipfile.ZipFile(temp_zip_path, 'r') as zip_ref:
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    zip_ref.extractall(temp_dir)
-                    
-                    for filename in os.listdir(temp_dir):
-                        if filename.lower().endswith('.xml'):
-                            xml_path = os.path.join(temp_dir, filename)
-                            try:
-                                insert_nfe_data(xml_path)
-                                processed_count += 1
-                            except Exception as e:
-                                errors.append(f"Erro ao processar {filename}: {str(e)}")
-            
-            os.unlink(temp_zip_path)
-            
+            with self.baixar_zip(zip_url) as arquivo_zip:
+                resultado = self.processar_zip(arquivo_zip)
+
             return {
                 "success": True,
-                "processed_count": processed_count,
-                "errors": errors,
-                "message": f"Processados {processed_count} XMLs com sucesso"
+                "processed_count": resultado["processed_count"],
+                "duplicate_count": resultado["duplicate_count"],
+                "errors": resultado["errors"],
+                "message": f"Processados {resultado['processed_count']} XMLs com sucesso"
             }
             
         except Exception as e:
             return {"success": False, "message": f"Erro ao processar XMLs: {str(e)}"}
+
+
+_cliente = None
+_cliente_lock = threading.Lock()
+
+
+def obter_cliente_maino():
+    """
+    Cliente Mainô compartilhado pelo processo (sessão HTTP e token únicos),
+    criado na primeira chamada a partir de MAINO_API_KEY, MAINO_EMAIL e MAINO_PASSWORD.
+    """
+    global _cliente
+    with _cliente_lock:
+        if _cliente is None:
+            _cliente = MainoAPI(
+                api_key=os.getenv('MAINO_API_KEY'),
+                email=os.getenv('MAINO_EMAIL'),
+                password=os.getenv('MAINO_PASSWORD')
+            )
+        return _cliente
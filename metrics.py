@@ -0,0 +1,185 @@
+"""
+Métricas da aplicação no formato texto do Prometheus (GET /api/metrics).
+
+- latência por rota (histograma), com quantidade de comandos SQL e tempo
+  de banco por requisição, medidos pelos eventos do engine do SQLAlchemy;
+- contadores de ingestão (NF-es inseridas, itens, duplicadas, falhas);
+- log de requisições lentas (acima de METRICS_LENTA_MS) com os comandos
+  SQL mais demorados e os repetidos, para expor N+1 e varreduras completas.
+
+As métricas são do processo: com vários workers, cada um expõe as suas.
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from flask import Response, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LIMITE_REQUISICAO_LENTA = float(os.getenv('METRICS_LENTA_MS', '1000')) / 1000
+# Comandos SQL guardados por requisição para o log de lentidão
+MAX_SQL_POR_REQUISICAO = 200
+FAIXAS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAIXAS_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 500)
+
+# SQL da requisição corrente; fora do `g` porque a ingestão abre app contexts aninhados
+_sql_requisicao = ContextVar('sql_requisicao', default=None)
+
+_lock = threading.Lock()
+_contadores = {}
+_histogramas = {}
+_ajuda = {
+    'opme_http_requisicao_segundos': ('histogram', 'Latência das requisições HTTP por rota'),
+    'opme_http_sql_comandos': ('histogram', 'Comandos SQL executados por requisição'),
+    'opme_http_sql_segundos_total': ('counter', 'Tempo gasto em SQL pelas requisições'),
+    'opme_sql_comandos_total': ('counter', 'Comandos SQL executados (requisições e jobs)'),
+    'opme_sql_segundos_total': ('counter', 'Tempo total gasto em SQL'),
+    'opme_nfe_inseridas_total': ('counter', 'NF-es gravadas'),
+    'opme_nfe_itens_total': ('counter', 'Itens de NF-e gravados'),
+    'opme_nfe_duplicadas_total': ('counter', 'NF-es descartadas por já existirem'),
+    'opme_nfe_falhas_total': ('counter', 'NF-es com erro de leitura ou gravação'),
+}
+
+
+def contar(nome, valor=1, **rotulos):
+    chave = (nome, tuple(sorted(rotulos.items())))
+    with _lock:
+        _contadores[chave] = _contadores.get(chave, 0) + valor
+
+
+def observar(nome, valor, faixas, **rotulos):
+    chave = (nome, tuple(sorted(rotulos.items())))
+    with _lock:
+        histograma = _histogramas.get(chave)
+        if histograma is None:
+            histograma = _histogramas[chave] = {'faixas': faixas, 'contagens': [0] * len(faixas),
+                                                'soma': 0.0, 'total': 0}
+        for i, limite in enumerate(faixas):
+            if valor <= limite:
+                histograma['contagens'][i] += 1
+        histograma['soma'] += valor
+        histograma['total'] += 1
+
+
+def registrar_ingestao(inseridas=0, itens=0, duplicadas=0, falhas=0):
+    """Atualiza os contadores de ingestão de NF-e."""
+    for nome, valor in (('opme_nfe_inseridas_total', inseridas), ('opme_nfe_itens_total', itens),
+                        ('opme_nfe_duplicadas_total', duplicadas), ('opme_nfe_falhas_total', falhas)):
+        if valor:
+            contar(nome, valor)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _antes_sql(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('inicio_sql', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _depois_sql(conn, cursor, statement, parameters, context, executemany):
+    duracao = time.perf_counter() - conn.info['inicio_sql'].pop()
+    contar('opme_sql_comandos_total')
+    contar('opme_sql_segundos_total', duracao)
+    medicao = _sql_requisicao.get()
+    if medicao is not None:
+        medicao['comandos'] += 1
+        medicao['segundos'] += duracao
+        if len(medicao['sql']) < MAX_SQL_POR_REQUISICAO:
+            medicao['sql'].append((duracao, statement))
+
+
+@event.listens_for(Engine, 'handle_error')
+def _erro_sql(contexto):
+    # Comando que falhou não passa por after_cursor_execute: descarta o início dele
+    conexao = contexto.connection
+    if conexao is not None and conexao.info.get('inicio_sql'):
+        conexao.info['inicio_sql'].pop()
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _rotulos(valores):
+    if not valores:
+        return ''
+    return '{' + ','.join(f'{nome}="{_escapar(valor)}"' for nome, valor in valores) + '}'
+
+
+def exportar():
+    """Todas as métricas no formato texto de exposição do Prometheus."""
+    with _lock:
+        contadores = dict(_contadores)
+        histogramas = {chave: dict(h, contagens=list(h['contagens'])) for chave, h in _histogramas.items()}
+
+    linhas = []
+    nomes = sorted({nome for nome, _ in contadores} | {nome for nome, _ in histogramas})
+    for nome in nomes:
+        tipo, ajuda = _ajuda.get(nome, ('untyped', nome))
+        linhas.append(f'# HELP {nome} {ajuda}')
+        linhas.append(f'# TYPE {nome} {tipo}')
+        for (n, rotulos), valor in sorted(contadores.items()):
+            if n == nome:
+                linhas.append(f'{nome}{_rotulos(rotulos)} {valor}')
+        for (n, rotulos), h in sorted(histogramas.items()):
+            if n != nome:
+                continue
+            for limite, contagem in zip(h['faixas'], h['contagens']):
+                linhas.append(f'{nome}_bucket{_rotulos(rotulos + (("le", limite),))} {contagem}')
+            linhas.append(f'{nome}_bucket{_rotulos(rotulos + (("le", "+Inf"),))} {h["total"]}')
+            linhas.append(f'{nome}_sum{_rotulos(rotulos)} {h["soma"]}')
+            linhas.append(f'{nome}_count{_rotulos(rotulos)} {h["total"]}')
+    return '\n'.join(linhas) + '\n'
+
+
+def _registrar_lenta(duracao, response, medicao):
+    repetidos = Counter(comando for _, comando in medicao['sql'])
+    mais_lentos = sorted(medicao['sql'], key=lambda item: item[0], reverse=True)[:5]
+    detalhes = [f'  {segundos * 1000:8.1f} ms  {comando[:500]}' for segundos, comando in mais_lentos]
+    detalhes += [f'  repetido {vezes}x: {comando[:500]}' for comando, vezes in repetidos.most_common(3) if vezes > 1]
+    logger.warning(
+        "Requisição lenta: %s %s -> %s em %.0f ms (%d comandos SQL, %.0f ms no banco)\n%s",
+        request.method, request.full_path.rstrip('?'), response.status_code, duracao * 1000,
+        medicao['comandos'], medicao['segundos'] * 1000, '\n'.join(detalhes)
+    )
+
+
+def instalar_metricas(app):
+    """Mede cada requisição do app e publica GET /api/metrics."""
+
+    @app.before_request
+    def _inicio_requisicao():
+        g.inicio_requisicao = time.perf_counter()
+        g.medicao_sql = _sql_requisicao.set({'comandos': 0, 'segundos': 0.0, 'sql': []})
+
+    @app.after_request
+    def _fim_requisicao(response):
+        if 'inicio_requisicao' not in g:
+            return response
+        # Respostas em streaming contam só até o início do envio
+        duracao = time.perf_counter() - g.inicio_requisicao
+        medicao = _sql_requisicao.get()
+        rota = request.url_rule.rule if request.url_rule else 'sem_rota'
+        rotulos = {'rota': rota, 'metodo': request.method, 'status': response.status_code}
+        observar('opme_http_requisicao_segundos', duracao, FAIXAS_LATENCIA, **rotulos)
+        observar('opme_http_sql_comandos', medicao['comandos'], FAIXAS_CONSULTAS, rota=rota)
+        contar('opme_http_sql_segundos_total', medicao['segundos'], rota=rota)
+        if duracao > LIMITE_REQUISICAO_LENTA:
+            _registrar_lenta(duracao, response, medicao)
+        return response
+
+    @app.teardown_request
+    def _limpar_medicao(exc):
+        # Também roda quando a rota levanta exceção ou a resposta é em streaming
+        token = g.pop('medicao_sql', None)
+        if token is not None:
+            _sql_requisicao.reset(token)
+
+    @app.route('/api/metrics', methods=['GET'])
+    def metrics():
+        return Response(exportar(), mimetype='text/plain; version=0.0.4')
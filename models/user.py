@@ -1,5 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import DateTime
+from sqlalchemy import Date, DateTime
 
 db = SQLAlchemy()
 
@@ -41,8 +41,37 @@ class ItemNotaFiscal(db.Model):
     descricao_produto = db.Column(db.String, nullable=False)
     quantidade = db.Column(db.Float, nullable=False)
     valor_total = db.Column(db.Float, nullable=False)
+    cfop = db.Column(db.String)
     
-    nota_fiscal_id = db.Column(db.Integer, db.ForeignKey('nota_fiscal.id'), nullable=False)
+    nota_fiscal_id = db.Column(db.Integer, db.ForeignKey('nota_fiscal.id'), nullable=False, index=True)
+
+    lotes = db.relationship('LoteItemNotaFiscal', backref='item', lazy=True, cascade="all, delete-orphan")
+
+class LoteItemNotaFiscal(db.Model):
+    """Grupo rastro (lote) de um item da NF-e."""
+    __tablename__ = 'lote_item_nota_fiscal'
+    id = db.Column(db.Integer, primary_key=True)
+    nLote = db.Column(db.String)
+    qLote = db.Column(db.Float)
+    dFab = db.Column(db.String)
+    dVal = db.Column(db.String)
+
+    item_nota_fiscal_id = db.Column(db.Integer, db.ForeignKey('item_nota_fiscal.id'), nullable=False, index=True)
+
+class Lote(db.Model):
+    """Datas de fabricação e validade por (produto, lote), vindas do rastro das NF-es."""
+    __tablename__ = 'lote'
+    id = db.Column(db.Integer, primary_key=True)
+    cProd = db.Column(db.String, nullable=False)
+    nLote = db.Column(db.String, nullable=False)
+    dFab = db.Column(Date)
+    dVal = db.Column(Date, index=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('cProd', 'nLote', name='uq_lote_produto_lote'),
+        # Rastreabilidade sem o produto: a restrição única começa por cProd e não serve
+        db.Index('ix_lote_nlote', 'nLote'),
+    )
 
 class Produto(db.Model):
     __tablename__ = 'produto'
@@ -60,7 +89,7 @@ class Movimento(db.Model):
     __tablename__ = 'movimento'
     id = db.Column(db.Integer, primary_key=True)
     nNF = db.Column(db.String, nullable=False)
-    dEmi = db.Column(DateTime)
+    dEmi = db.Column(DateTime, index=True)
     cnpj_dest = db.Column(db.String, nullable=False)
     xNome_dest = db.Column(db.String)
     cProd = db.Column(db.String, nullable=False)
@@ -69,3 +98,115 @@ class Movimento(db.Model):
     qCom = db.Column(db.Float, nullable=False)
     nLote = db.Column(db.String)
     qLote = db.Column(db.Float)
+    # Quantidade efetiva já com o sinal do CFOP (opme_logic.SINAL_CFOP)
+    qSinal = db.Column(db.Float)
+    nota_fiscal_id = db.Column(db.Integer, db.ForeignKey('nota_fiscal.id'), index=True)
+
+    __table_args__ = (
+        db.Index('ix_movimento_cliente_produto_lote', 'cnpj_dest', 'cProd', 'nLote'),
+        # Rastreabilidade: histórico de um lote em ordem de emissão, com ou sem o produto
+        db.Index('ix_movimento_lote_emissao', 'nLote', 'dEmi'),
+        db.Index('ix_movimento_produto_lote', 'cProd', 'nLote'),
+    )
+
+class Saldo(db.Model):
+    """Saldo materializado por (cliente, produto, lote), mantido junto com a ingestão."""
+    __tablename__ = 'saldo'
+    id = db.Column(db.Integer, primary_key=True)
+    cnpj_dest = db.Column(db.String, nullable=False)
+    xNome_dest = db.Column(db.String)
+    cProd = db.Column(db.String, nullable=False)
+    xProd = db.Column(db.String)
+    # Lote vazio ('') para itens sem rastro, para que a chave única funcione com NULLs
+    nLote = db.Column(db.String, nullable=False, default='')
+    saldo = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        db.UniqueConstraint('cnpj_dest', 'cProd', 'nLote', name='uq_saldo_cliente_produto_lote'),
+        # Junção com lote (relatório de vencimentos)
+        db.Index('ix_saldo_produto_lote', 'cProd', 'nLote'),
+        # Rastreabilidade: saldo de um lote em todos os clientes
+        db.Index('ix_saldo_lote', 'nLote'),
+    )
+
+class SaldoSnapshot(db.Model):
+    """Saldo por (cliente, produto, lote) no início de cada mês: soma dos movimentos com dEmi < data_corte."""
+    __tablename__ = 'saldo_snapshot'
+    id = db.Column(db.Integer, primary_key=True)
+    data_corte = db.Column(DateTime, nullable=False)
+    cnpj_dest = db.Column(db.String, nullable=False)
+    xNome_dest = db.Column(db.String)
+    cProd = db.Column(db.String, nullable=False)
+    xProd = db.Column(db.String)
+    nLote = db.Column(db.String, nullable=False, default='')
+    saldo = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        db.UniqueConstraint('data_corte', 'cnpj_dest', 'cProd', 'nLote', name='uq_saldo_snapshot_corte_chave'),
+    )
+
+class VersaoDados(db.Model):
+    """Contador de versão dos dados, incrementado após cada ingestão (invalida caches e ETags)."""
+    __tablename__ = 'versao_dados'
+    escopo = db.Column(db.String, primary_key=True)
+    versao = db.Column(db.BigInteger, nullable=False, default=0)
+
+class SyncJob(db.Model):
+    """Sincronização com o Mainô executada em segundo plano."""
+    __tablename__ = 'sync_job'
+    id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String, nullable=False, default='pendente')
+    data_inicio = db.Column(db.String, nullable=False)
+    data_fim = db.Column(db.String, nullable=False)
+    # Conta Mainô cujo watermark é avançado ao concluir (apenas syncs incrementais)
+    conta = db.Column(db.String)
+    # Execução que detém o job: só ela grava checkpoints, contadores e o status final
+    execucao = db.Column(db.String(32))
+    total = db.Column(db.Integer)
+    processados = db.Column(db.Integer, nullable=False, default=0)
+    duplicados = db.Column(db.Integer, nullable=False, default=0)
+    falhas = db.Column(db.Integer, nullable=False, default=0)
+    mensagem = db.Column(db.String)
+    criado_em = db.Column(DateTime, nullable=False)
+    atualizado_em = db.Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        # No máximo um job ativo por conta: agendadores de vários workers não criam jobs sobrepostos
+        db.Index('uq_sync_job_conta_ativo', 'conta', unique=True,
+                 postgresql_where=db.text("status IN ('pendente', 'executando')"),
+                 sqlite_where=db.text("status IN ('pendente', 'executando')")),
+    )
+
+    def to_dict(self):
+        concluidos = self.processados + self.duplicados + self.falhas
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'data_inicio': self.data_inicio,
+            'data_fim': self.data_fim,
+            'total': self.total,
+            'processados': self.processados,
+            'duplicados': self.duplicados,
+            'falhas': self.falhas,
+            'restantes': self.total - concluidos if self.total is not None else None,
+            'mensagem': self.mensagem,
+            'criado_em': self.criado_em.isoformat(),
+            'atualizado_em': self.atualizado_em.isoformat()
+        }
+
+class SyncCheckpoint(db.Model):
+    """XML do ZIP de um job já tratado (inserido, duplicado ou com falha)."""
+    __tablename__ = 'sync_checkpoint'
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(32), db.ForeignKey('sync_job.id'), nullable=False, index=True)
+    arquivo = db.Column(db.String, nullable=False)
+    chave_acesso = db.Column(db.String(44))
+    situacao = db.Column(db.String, nullable=False)
+    erro = db.Column(db.String)
+
+class SyncWatermark(db.Model):
+    """Maior data de emissão já sincronizada por conta do Mainô."""
+    __tablename__ = 'sync_watermark'
+    conta = db.Column(db.String, primary_key=True)
+    ultima_emissao = db.Column(DateTime, nullable=False)
+    atualizado_em = db.Column(DateTime, nullable=False)
@@ -0,0 +1,236 @@
+"""
+Projeção das NF-es na tabela movimento.
+
+Cada item (ou cada lote do item, quando há rastro) vira uma linha de
+movimento com a quantidade efetiva já multiplicada pelo sinal do CFOP
+(qSinal), de modo que saldos sejam uma soma simples.
+
+Uso (reconstrução da projeção a partir das notas já gravadas):
+    python movimentos.py reconstruir [--workers 4] [--tamanho-bloco 500]
+
+Notas gravadas antes de os itens guardarem CFOP e lotes (item_nota_fiscal.cfop
+nulo) não têm como ser projetadas só com o banco: sem nenhum CFOP ficam fora
+da projeção (seriam movimentos de quantidade zero) e, com o CFOP da nota,
+entram sem lote. A reconstrução relata essas notas e regrava pelo XML as que
+estiverem no arquivo local (arquivo_nfe); as demais precisam ser reimportadas.
+"""
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import case, delete, func, insert, select, update
+
+from models.user import Movimento, NotaFiscal, ItemNotaFiscal, LoteItemNotaFiscal, db
+from nfe_parser import RegistroNFe, ItemNFe, LoteNFe
+from opme_logic import SINAL_CFOP, sinal_cfop
+from versao_dados import incrementar_versao, ESCOPOS_RECONSTRUCAO
+
+logger = logging.getLogger(__name__)
+
+# Quantidade que movimenta o saldo: qLote do rastro quando informado, senão qCom do item
+# (mesma regra de opme_logic.calculate_balance)
+QUANTIDADE_EFETIVA = func.coalesce(func.nullif(Movimento.qLote, 0), Movimento.qCom)
+
+# Expressão SQL equivalente a opme_logic.sinal_cfop, usada para linhas antigas sem qSinal
+SINAL_CFOP_SQL = case(
+    *[(Movimento.cfop == cfop, sinal) for cfop, sinal in SINAL_CFOP.items() if sinal],
+    else_=0
+)
+
+
+def projetar_movimentos(registro, nota_fiscal_id):
+    """
+    Converte uma NF-e lida (RegistroNFe) nas linhas de movimento correspondentes:
+    uma por lote do item, ou uma única linha para itens sem rastro.
+    """
+    movimentos = []
+    for item in registro.itens:
+        sinal = sinal_cfop(item.CFOP)
+        base = {
+            'nNF': registro.nNF,
+            'dEmi': registro.data_emissao,
+            'cnpj_dest': registro.CNPJ_dest,
+            'xNome_dest': registro.xNome_dest,
+            'cProd': item.cProd,
+            'xProd': item.xProd,
+            'cfop': item.CFOP,
+            'qCom': item.qCom,
+            'nota_fiscal_id': nota_fiscal_id,
+        }
+        if not item.lotes:
+            movimentos.append(dict(base, nLote=None, qLote=None, qSinal=sinal * item.qCom))
+        for lote in item.lotes:
+            quantidade = lote.qLote or item.qCom
+            movimentos.append(dict(base, nLote=lote.nLote or None, qLote=lote.qLote,
+                                   qSinal=sinal * quantidade))
+    return movimentos
+
+
+def gravar_movimentos(movimentos):
+    """Insere as linhas de movimento em massa (sem commit)."""
+    if movimentos:
+        db.session.execute(insert(Movimento), movimentos)
+
+
+def _registros_gravados(nota_inicio, nota_fim):
+    """
+    Remonta como RegistroNFe as notas com id no intervalo [nota_inicio, nota_fim).
+    Notas com item sem CFOP ficam de fora; notas gravadas antes dos lotes entram sem lote.
+
+    Returns:
+        tuple: lista de (nota_id, RegistroNFe) e dict {chave_acesso: motivo} das notas incompletas
+    """
+    notas = db.session.execute(
+        select(NotaFiscal).where(NotaFiscal.id >= nota_inicio, NotaFiscal.id < nota_fim)
+    ).scalars().all()
+    if not notas:
+        return [], {}
+
+    itens_por_nota = {}
+    for item in db.session.execute(
+        select(ItemNotaFiscal)
+        .where(ItemNotaFiscal.nota_fiscal_id >= nota_inicio, ItemNotaFiscal.nota_fiscal_id < nota_fim)
+        .order_by(ItemNotaFiscal.id)
+    ).scalars():
+        itens_por_nota.setdefault(item.nota_fiscal_id, []).append(item)
+
+    lotes_por_item = {}
+    for lote in db.session.execute(
+        select(LoteItemNotaFiscal)
+        .join(ItemNotaFiscal, LoteItemNotaFiscal.item_nota_fiscal_id == ItemNotaFiscal.id)
+        .where(ItemNotaFiscal.nota_fiscal_id >= nota_inicio, ItemNotaFiscal.nota_fiscal_id < nota_fim)
+        .order_by(LoteItemNotaFiscal.id)
+    ).scalars():
+        lotes_por_item.setdefault(lote.item_nota_fiscal_id, []).append(
+            LoteNFe(nLote=lote.nLote or '', qLote=lote.qLote, dFab=lote.dFab or '', dVal=lote.dVal or '')
+        )
+
+    registros = []
+    incompletas = {}
+    for nota in notas:
+        itens_gravados = itens_por_nota.get(nota.id, [])
+        if any(not (item.cfop or nota.cfop) for item in itens_gravados):
+            incompletas[nota.chave_acesso] = 'sem CFOP'
+            continue
+        if any(item.cfop is None for item in itens_gravados):
+            incompletas[nota.chave_acesso] = 'sem lotes (gravada antes do rastro)'
+        itens = tuple(
+            ItemNFe(cProd=item.codigo_produto, xProd=item.descricao_produto,
+                    CFOP=item.cfop or nota.cfop or '', qCom=item.quantidade,
+                    vUnCom=item.valor_total / item.quantidade if item.quantidade else 0.0,
+                    vProd=item.valor_total, lotes=tuple(lotes_por_item.get(item.id, ())))
+            for item in itens_gravados
+        )
+        registros.append((nota.id, RegistroNFe(
+            chave_acesso=nota.chave_acesso, nNF=nota.numero, serie=nota.serie or '',
+            dEmi='', dhEmi=nota.data_emissao.isoformat() if nota.data_emissao else '',
+            CNPJ_emit='', xNome_emit='',
+            CNPJ_dest=nota.destinatario_cnpj or '', xNome_dest=nota.destinatario_nome or '',
+            itens=itens
+        )))
+    return registros, incompletas
+
+
+def reprojetar_bloco(app, nota_inicio, nota_fim):
+    """
+    Refaz, em uma transação própria, os movimentos das notas de um intervalo de ids.
+
+    Returns:
+        tuple: movimentos gravados e {chave_acesso: motivo} das notas incompletas
+    """
+    with app.app_context():
+        try:
+            db.session.execute(delete(Movimento).where(
+                Movimento.nota_fiscal_id >= nota_inicio, Movimento.nota_fiscal_id < nota_fim
+            ))
+            registros, incompletas = _registros_gravados(nota_inicio, nota_fim)
+            movimentos = [movimento for nota_id, registro in registros
+                          for movimento in projetar_movimentos(registro, nota_id)]
+            gravar_movimentos(movimentos)
+            incrementar_versao(ESCOPOS_RECONSTRUCAO)
+            db.session.commit()
+            return len(movimentos), incompletas
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+
+
+def reconstruir_projecao(app, workers=4, tamanho_bloco=500):
+    """
+    Reconstrói a tabela movimento a partir das notas gravadas, em blocos de ids
+    processados em paralelo, e recalcula o sinal das linhas antigas sem nota associada.
+
+    Returns:
+        tuple: movimentos gravados e {chave_acesso: motivo} das notas incompletas
+    """
+    with app.app_context():
+        menor, maior = db.session.execute(select(func.min(NotaFiscal.id), func.max(NotaFiscal.id))).one()
+        db.session.execute(
+            update(Movimento)
+            .where(Movimento.nota_fiscal_id.is_(None))
+            .values(qSinal=SINAL_CFOP_SQL * QUANTIDADE_EFETIVA)
+        )
+        sem_cfop = db.session.scalar(
+            select(func.count()).select_from(Movimento)
+            .where(Movimento.nota_fiscal_id.is_(None), func.coalesce(Movimento.cfop, '') == '')
+        )
+        if sem_cfop:
+            logger.warning(f"{sem_cfop} movimento(s) antigo(s) sem nota e sem CFOP ficam com quantidade zero")
+        incrementar_versao(ESCOPOS_RECONSTRUCAO)
+        db.session.commit()
+
+    if menor is None:
+        return 0, {}
+
+    blocos = [(inicio, inicio + tamanho_bloco) for inicio in range(menor, maior + 1, tamanho_bloco)]
+    total, incompletas = 0, {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for movimentos, incompletas_bloco in executor.map(lambda bloco: reprojetar_bloco(app, *bloco), blocos):
+            total += movimentos
+            incompletas.update(incompletas_bloco)
+    return total, incompletas
+
+
+def completar_pelo_arquivo(app, chaves):
+    """
+    Regrava pelo XML do arquivo local (reprocessamento com substituir) as notas
+    incompletas que estiverem arquivadas. Retorna as chaves regravadas.
+    """
+    from arquivo_nfe import arquivo_padrao, reprocessar
+
+    arquivo = arquivo_padrao()
+    if arquivo is None or not chaves:
+        return set()
+    arquivadas = {chave for chave in chaves if arquivo.contem(chave)}
+    if arquivadas:
+        reprocessar(app, arquivo, substituir=True, chaves=arquivadas)
+    return arquivadas
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Projeção das NF-es na tabela movimento')
+    parser.add_argument('comando', choices=['reconstruir'])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--tamanho-bloco', type=int, default=500)
+    args = parser.parse_args()
+
+    from main import app
+    from saldo import reconstruir_saldos
+    from snapshots import construir_snapshots
+
+    total, incompletas = reconstruir_projecao(app, workers=args.workers, tamanho_bloco=args.tamanho_bloco)
+    print(f"Projeção reconstruída: {total} movimentos.")
+    if incompletas:
+        regravadas = completar_pelo_arquivo(app, set(incompletas))
+        print(f"{len(incompletas)} nota(s) gravada(s) sem CFOP/lotes nos itens; "
+              f"{len(regravadas)} regravada(s) pelo XML arquivado.")
+        pendentes = sorted(chave for chave in incompletas if chave not in regravadas)
+        for chave in pendentes[:50]:
+            print(f"  {chave}: {incompletas[chave]}")
+        if pendentes:
+            print(f"{len(pendentes)} nota(s) sem XML arquivado: reimporte-as para corrigir a projeção.")
+    with app.app_context():
+        print(f"Tabela saldo reconstruída: {reconstruir_saldos()} linhas.")
+        print(f"Snapshots mensais recriados: {construir_snapshots(recriar=True)} corte(s).")
@@ -0,0 +1,194 @@
+import io
+import multiprocessing
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Motor único de leitura de NF-e: percorre o documento uma única vez com
+# iterparse, descartando cada <det> assim que o item é lido, e devolve um
+# registro compacto usado tanto pela ingestão quanto por parse_nfe_xml.
+
+NFE_NS = "http://www.portalfiscal.inf.br/nfe"
+
+# Fuso em que as datas de emissão são gravadas (sem tzinfo) e agrupadas por mês.
+# Sem a base de fusos do sistema, usa o horário de Brasília sem horário de verão
+try:
+    FUSO_EMISSAO = ZoneInfo('America/Sao_Paulo')
+except ZoneInfoNotFoundError:
+    FUSO_EMISSAO = timezone(timedelta(hours=-3))
+
+_CAMPOS_IDE = {"nNF", "serie", "dEmi", "dhEmi"}
+_CAMPOS_PARTE = {"CNPJ", "xNome"}
+_CAMPOS_PROD = {"cProd", "xProd", "CFOP", "qCom", "vUnCom", "vProd"}
+_CAMPOS_RASTRO = {"nLote", "qLote", "dFab", "dVal"}
+
+
+class LoteNFe(NamedTuple):
+    nLote: str
+    qLote: Optional[float]
+    dFab: str
+    dVal: str
+
+
+class ItemNFe(NamedTuple):
+    cProd: str
+    xProd: str
+    CFOP: str
+    qCom: float
+    vUnCom: float
+    vProd: float
+    lotes: Tuple[LoteNFe, ...]
+
+
+class RegistroNFe(NamedTuple):
+    chave_acesso: str
+    nNF: str
+    serie: str
+    dEmi: str
+    dhEmi: str
+    CNPJ_emit: str
+    xNome_emit: str
+    CNPJ_dest: str
+    xNome_dest: str
+    itens: Tuple[ItemNFe, ...]
+
+    @property
+    def data_emissao(self):
+        """Data de emissão (dhEmi na versão 4.00, dEmi nas anteriores) no horário de FUSO_EMISSAO."""
+        valor = self.dhEmi or self.dEmi
+        return data_local(datetime.fromisoformat(valor)) if valor else None
+
+
+def data_local(valor):
+    """
+    Datetime sem tzinfo no horário de FUSO_EMISSAO: um valor com fuso é convertido,
+    um valor sem fuso já é considerado local. Gravar sempre datas sem fuso evita que
+    o banco as converta para o fuso da sessão (Postgres, coluna sem time zone).
+    """
+    if valor.tzinfo is None:
+        return valor
+    return valor.astimezone(FUSO_EMISSAO).replace(tzinfo=None)
+
+
+_nomes_locais = {}
+
+
+def _nome_local(tag):
+    nome = _nomes_locais.get(tag)
+    if nome is None:
+        nome = tag.rpartition("}")[2]
+        _nomes_locais[tag] = nome
+    return nome
+
+
+def _float(valor, padrao=0.0):
+    return float(valor) if valor else padrao
+
+
+def _abrir_fonte(xml_source, is_file):
+    if is_file:
+        return xml_source
+    if isinstance(xml_source, str):
+        xml_source = xml_source.encode("utf-8")
+    if isinstance(xml_source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(xml_source)
+    # Objeto tipo arquivo já aberto
+    return xml_source
+
+
+def parse_nfe(xml_source, is_file=True):
+    """
+    Lê uma NF-e (caminho, bytes, str ou arquivo aberto) em uma única passada.
+
+    Returns:
+        RegistroNFe: cabeçalho, itens e lotes (rastro) do documento
+    """
+    cabecalho = {"chave_acesso": "", "nNF": "", "serie": "", "dEmi": "", "dhEmi": "",
+                 "CNPJ_emit": "", "xNome_emit": "", "CNPJ_dest": "", "xNome_dest": ""}
+    itens = []
+    prod = {}
+    rastro = {}
+    lotes = []
+
+    pilha = []
+    elementos = []
+    for evento, elem in ET.iterparse(_abrir_fonte(xml_source, is_file), events=("start", "end")):
+        if evento == "start":
+            nome = _nome_local(elem.tag)
+            if nome == "infNFe" and not cabecalho["chave_acesso"]:
+                cabecalho["chave_acesso"] = elem.get("Id", "").replace("NFe", "")
+            pilha.append(nome)
+            elementos.append(elem)
+            continue
+
+        nome = pilha.pop()
+        elementos.pop()
+        pai = pilha[-1] if pilha else ""
+
+        if pai == "prod":
+            if nome in _CAMPOS_PROD:
+                prod[nome] = elem.text
+        elif pai == "rastro":
+            if nome in _CAMPOS_RASTRO:
+                rastro[nome] = elem.text
+        elif pai == "ide":
+            if nome in _CAMPOS_IDE:
+                cabecalho[nome] = elem.text or ""
+        elif pai == "emit":
+            if nome in _CAMPOS_PARTE:
+                cabecalho[nome + "_emit"] = elem.text or ""
+        elif pai == "dest":
+            if nome in _CAMPOS_PARTE:
+                cabecalho[nome + "_dest"] = elem.text or ""
+
+        if nome == "rastro":
+            lotes.append(LoteNFe(
+                nLote=rastro.get("nLote") or "",
+                qLote=_float(rastro.get("qLote"), None),
+                dFab=rastro.get("dFab") or "",
+                dVal=rastro.get("dVal") or "",
+            ))
+            rastro = {}
+        elif nome == "det":
+            itens.append(ItemNFe(
+                cProd=prod.get("cProd") or "",
+                xProd=prod.get("xProd") or "",
+                CFOP=prod.get("CFOP") or "",
+                qCom=_float(prod.get("qCom")),
+                vUnCom=_float(prod.get("vUnCom")),
+                vProd=_float(prod.get("vProd")),
+                lotes=tuple(lotes),
+            ))
+            prod = {}
+            lotes = []
+            # Libera o item já lido para manter a memória constante
+            elem.clear()
+            if elementos:
+                elementos[-1].remove(elem)
+
+    return RegistroNFe(itens=tuple(itens), **cabecalho)
+
+
+def ler_documento(conteudo):
+    """
+    Versão de parse_nfe para uso em pools de processos: nunca lança exceção.
+
+    Returns:
+        tuple: (RegistroNFe ou None, mensagem de erro ou None)
+    """
+    try:
+        return parse_nfe(conteudo, is_file=False), None
+    except Exception as e:
+        return None, f'Erro ao processar XML: {str(e)}'
+
+
+def pool_de_leitura(processos=None):
+    """
+    Pool de processos para ler_documento. Os processos são criados por forkserver
+    (spawn onde não existe), nunca por fork: o processo do app tem threads (jobs,
+    agendador, pool do banco) e o fork copiaria locks no estado em que estavam.
+    """
+    metodo = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(max_workers=processos, mp_context=multiprocessing.get_context(metodo))
@@ -1,86 +1,206 @@
-import sqlite3
-
-def get_opme_movements(db_name="opme_control.db", cnpj_cliente=None):
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-
-    query = """
-        SELECT
-            nh.nNF,
-            nh.dEmi,
-            nh.CNPJ_dest,
-            nh.xNome_dest,
-            ni.cProd,
-            ni.xProd,
-            ni.CFOP,
-            ni.qCom,
-            li.nLote,
-            li.qLote
-        FROM
-            nfe_header nh
-        JOIN
-            nfe_item ni ON nh.id = ni.nfe_id
-        LEFT JOIN
-            lote_info li ON ni.id = li.nfe_item_id
+import warnings
+from datetime import datetime
+
+import numpy as np
+
+from nfe_parser import data_local
+
+def get_opme_movements(cnpj_clientes=None):
+    """Movimentos (tuplas na ordem de COLUNAS_MOVIMENTO) lidos pelo engine do app; requer app context."""
+    from repositorio import consultar_movimentos
+    if isinstance(cnpj_clientes, str):
+        cnpj_clientes = [cnpj_clientes]
+    return consultar_movimentos(cnpj_clientes)
+
+# CFOPs de saída para consignação
+CFOP_SAIDA_CONSIGNACAO = ("5917", "6917")
+# CFOPs de retorno de consignação
+CFOP_RETORNO_CONSIGNACAO = ("1918", "2918")
+# CFOPs de retorno simbólico (utilizado)
+CFOP_RETORNO_SIMBOLICO = ("1919", "2919")
+# CFOPs de faturamento (venda)
+CFOP_FATURAMENTO = ("5114", "6114")
+
+# Sinal aplicado à quantidade de cada CFOP no saldo de consignação.
+# CFOPs de faturamento (5114, 6114) não afetam o saldo de consignação diretamente
+# pois representam a venda do material que já estava em consignação.
+# O controle de saldo aqui é sobre o que está em posse do cliente.
+SINAL_CFOP = dict(
+    [(cfop, -1) for cfop in CFOP_SAIDA_CONSIGNACAO] +
+    [(cfop, 1) for cfop in CFOP_RETORNO_CONSIGNACAO + CFOP_RETORNO_SIMBOLICO] +
+    [(cfop, 0) for cfop in CFOP_FATURAMENTO]
+)
+
+
+def sinal_cfop(cfop):
+    """Sinal (-1, 0 ou 1) do CFOP no saldo; CFOPs fora das regras não movimentam saldo."""
+    return SINAL_CFOP.get(cfop, 0)
+
+
+# Colunas das tuplas de movimento (mesma ordem de get_opme_movements)
+COLUNAS_MOVIMENTO = ("nNF", "dEmi", "CNPJ_dest", "xNome_dest", "cProd", "xProd", "CFOP", "qCom", "nLote", "qLote")
+# Colunas guardadas com codificação por dicionário (códigos inteiros + valores distintos)
+COLUNAS_CATEGORICAS = ("CNPJ_dest", "xNome_dest", "cProd", "xProd", "CFOP", "nLote")
+# Chave de agrupamento usada por calculate_balance
+CHAVE_SALDO = ("CNPJ_dest", "xNome_dest", "cProd", "xProd", "nLote")
+# Lote dos itens sem rastro
+SEM_LOTE = "SEM_LOTE"
+LIMITE_CHAVE_COMPOSTA = 2 ** 62
+
+
+def _codificar(valores):
+    """Codificação por dicionário: códigos inteiros por ordem de aparição e os valores distintos."""
+    distintos = list(dict.fromkeys(valores))
+    mapa = {valor: codigo for codigo, valor in enumerate(distintos)}
+    codigos = np.fromiter(map(mapa.__getitem__, valores), dtype=np.int64, count=len(valores))
+    unicos = np.empty(len(distintos), dtype=object)
+    unicos[:] = distintos
+    return codigos, unicos
+
+
+def _data(valor):
+    if not valor:
+        return datetime.min
+    if not isinstance(valor, datetime):
+        valor = datetime.fromisoformat(str(valor))
+    return data_local(valor)
+
+
+def _datas(valores):
+    """Datas de emissão como datetime64; movimentos sem data contam desde sempre."""
+    try:
+        # Caminho rápido: strings ISO ou datetimes sem fuso (com fuso o NumPy converte
+        # para UTC e avisa; nesse caso usa a mesma regra de _data, hora local)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            datas = np.array(valores, dtype="datetime64[s]")
+    except (ValueError, TypeError, UserWarning, DeprecationWarning):
+        return np.array([_data(d) for d in valores], dtype="datetime64[s]")
+    return np.where(np.isnat(datas), np.datetime64(datetime.min, "s"), datas)
+
+
+def movimentos_colunares(movements):
     """
-    params = []
-
-    if cnpj_cliente:
-        query += " WHERE nh.CNPJ_dest = ?"
-        params.append(cnpj_cliente)
+    Converte as tuplas de movimento em colunas NumPy. Colunas de texto viram códigos
+    inteiros ({nome}: códigos, {nome}_valores: valores distintos), de modo que os
+    agrupamentos trabalham só com inteiros. É a única passada em Python sobre as linhas;
+    o resultado pode ser reaproveitado em vários cálculos.
+    """
+    linhas = list(zip(*movements)) if movements else [()] * len(COLUNAS_MOVIMENTO)
+    brutas = dict(zip(COLUNAS_MOVIMENTO, linhas))
 
-    cursor.execute(query, params)
-    movements = cursor.fetchall()
-    conn.close()
-    return movements
+    colunas = {}
+    brutas["nLote"] = [lote if lote else SEM_LOTE for lote in brutas["nLote"]]
+    for nome in COLUNAS_CATEGORICAS:
+        colunas[nome], colunas[nome + "_valores"] = _codificar(brutas[nome])
 
-def calculate_balance(movements):
-    balance = {}
-    # CFOPs de saída para consignação
-    cfop_saida_consignacao = ["5917", "6917"]
-    # CFOPs de retorno de consignação
-    cfop_retorno_consignacao = ["1918", "2918"]
-    # CFOPs de retorno simbólico (utilizado)
-    cfop_retorno_simbolico = ["1919", "2919"]
-    # CFOPs de faturamento (venda)
-    cfop_faturamento = ["5114", "6114"]
+    qCom = np.array(brutas["qCom"], dtype=float)
+    qLote = np.array([q or 0.0 for q in brutas["qLote"]], dtype=float)
+    # Usar qCom do item da NF, se qLote da lote_info não estiver disponível ou for 0
+    colunas["quantidade"] = np.where(qLote != 0, qLote, qCom)
+    colunas["dEmi"] = _datas(brutas["dEmi"])
+    return colunas
 
-    for movement in movements:
-        nNF, dEmi, CNPJ_dest, xNome_dest, cProd, xProd, CFOP, qCom, nLote, qLote_lote_info = movement
 
-        # Usar qCom do item da NF, se qLote da lote_info não estiver disponível ou for 0
-        quantity = qLote_lote_info if qLote_lote_info else qCom
+def calcular_saldos_colunar(colunas, clientes=None, datas_corte=None, chave=CHAVE_SALDO):
+    """
+    Saldos por chave (cliente, produto, lote) com group-by vetorizado.
 
-        key = (CNPJ_dest, xNome_dest, cProd, xProd, nLote if nLote else "SEM_LOTE")
+    O sinal de cada linha vem de uma tabela de consulta indexada pelo código do
+    CFOP e a soma por grupo é feita com np.bincount sobre a chave composta.
 
-        if key not in balance:
-            balance[key] = 0.0
+    Args:
+        colunas: resultado de movimentos_colunares
+        clientes: CNPJs a considerar (todos, se None)
+        datas_corte: datas (inclusivas) para saldos em vários cortes na mesma passada
 
-        if CFOP in cfop_saida_consignacao:
-            balance[key] -= quantity
-        elif CFOP in cfop_retorno_consignacao or CFOP in cfop_retorno_simbolico:
-            balance[key] += quantity
-        # CFOPs de faturamento (5114, 6114) não afetam o saldo de consignação diretamente
-        # pois representam a venda do material que já estava em consignação.
-        # O controle de saldo aqui é sobre o que está em posse do cliente.
+    Returns:
+        dict: 'chaves' (lista de tuplas) e 'saldos' (array de tamanho G, ou G x cortes,
+        na ordem de datas_corte ordenada)
+    """
+    tabela_sinal = np.array([sinal_cfop(cfop) for cfop in colunas["CFOP_valores"]] or [0], dtype=float)
+    pesos = tabela_sinal[colunas["CFOP"]] * colunas["quantidade"]
+
+    # Chave composta em base mista a partir dos códigos de cada coluna
+    combinada = np.zeros(len(pesos), dtype=np.int64)
+    faixa = 1
+    for nome in chave:
+        cardinalidade = max(len(colunas[nome + "_valores"]), 1)
+        if faixa * cardinalidade >= LIMITE_CHAVE_COMPOSTA:
+            # Recompacta os códigos antes que a chave estoure int64
+            _, combinada = np.unique(combinada, return_inverse=True)
+            faixa = int(combinada.max()) + 1 if len(combinada) else 1
+        combinada = combinada * cardinalidade + colunas[nome]
+        faixa *= cardinalidade
+
+    linhas = slice(None)
+    if clientes is not None:
+        codigos_cliente = {cnpj: codigo for codigo, cnpj in enumerate(colunas["CNPJ_dest_valores"])}
+        selecionados = [codigos_cliente[cnpj] for cnpj in clientes if cnpj in codigos_cliente]
+        linhas = np.isin(colunas["CNPJ_dest"], np.array(selecionados, dtype=np.int64))
+    combinada = combinada[linhas]
+    pesos = pesos[linhas]
+
+    _, primeira_linha, grupo = np.unique(combinada, return_index=True, return_inverse=True)
+    qtd_grupos = len(primeira_linha)
+
+    chaves = list(zip(*(
+        colunas[nome + "_valores"][colunas[nome][linhas][primeira_linha]].tolist()
+        for nome in chave
+    )))
+
+    if datas_corte is None:
+        saldos = np.bincount(grupo, weights=pesos, minlength=qtd_grupos)
+        return {"chaves": chaves, "saldos": saldos}
+
+    cortes = np.sort(np.array([np.datetime64(d, "s") for d in datas_corte]))
+    # Primeiro corte em que a linha já conta; linhas depois do último corte são descartadas
+    indice_corte = np.searchsorted(cortes, colunas["dEmi"][linhas], side="left")
+    validas = indice_corte < len(cortes)
+    matriz = np.bincount(
+        grupo[validas] * len(cortes) + indice_corte[validas],
+        weights=pesos[validas],
+        minlength=qtd_grupos * len(cortes)
+    ).reshape(qtd_grupos, len(cortes))
+    return {"chaves": chaves, "saldos": np.cumsum(matriz, axis=1)}
+
+
+def carregar_movimentos_colunar(cnpj_clientes=None):
+    """
+    Lê a tabela movimento direto para colunas NumPy (mesmo formato de movimentos_colunares).
+    As colunas vêm do cursor do driver, já com lote e quantidade efetiva resolvidos no SQL,
+    sem passar por tuplas de movimento; requer app context.
+    """
+    from repositorio import colunas_movimentos
+    if isinstance(cnpj_clientes, str):
+        cnpj_clientes = [cnpj_clientes]
+    dEmi, *categoricas, quantidade = colunas_movimentos(cnpj_clientes)
 
-    return balance
+    colunas = {}
+    for nome, valores in zip(COLUNAS_CATEGORICAS, categoricas):
+        colunas[nome], colunas[nome + "_valores"] = _codificar(valores)
+    colunas["quantidade"] = np.fromiter(quantidade, dtype=float, count=len(quantidade))
+    colunas["dEmi"] = _datas(dEmi)
+    return colunas
 
-if __name__ == '__main__':
-    # Exemplo de uso
-    # from insert_nfe_data import insert_nfe_data
-    # insert_nfe_data("nfe_exemplo.xml") # Certifique-se de que o XML de exemplo foi inserido
 
-    all_movements = get_opme_movements()
-    print("Todos os movimentos:", all_movements)
+def calculate_balance(movements):
+    # Aceita as tuplas de get_opme_movements ou colunas já convertidas
+    colunas = movements if isinstance(movements, dict) else movimentos_colunares(movements)
+    resultado = calcular_saldos_colunar(colunas)
+    return {chave: float(saldo) for chave, saldo in zip(resultado["chaves"], resultado["saldos"])}
 
-    saldo_geral = calculate_balance(all_movements)
-    print("Saldo Geral:", saldo_geral)
+if __name__ == '__main__':
+    # Exemplo de uso (banco de DATABASE_URL)
+    from main import app
 
-    # Exemplo com CNPJ específico (substitua pelo CNPJ do destinatário do seu XML de exemplo)
-    # movements_cliente = get_opme_movements(cnpj_cliente="00000000000191")
-    # print("Movimentos para cliente específico:", movements_cliente)
-    # saldo_cliente = calculate_balance(movements_cliente)
-    # print("Saldo para cliente específico:", saldo_cliente)
+    with app.app_context():
+        all_movements = get_opme_movements()
+        print("Todos os movimentos:", len(all_movements))
 
+        saldo_geral = calculate_balance(all_movements)
+        print("Saldo Geral:", saldo_geral)
 
+        # Exemplo com CNPJ específico (substitua pelo CNPJ do destinatário de uma nota gravada)
+        # movements_cliente = get_opme_movements("00000000000191")
+        # print("Saldo para cliente específico:", calculate_balance(movements_cliente))
@@ -0,0 +1,161 @@
+"""
+Profiling sob demanda (cProfile) para diagnosticar lentidão em produção.
+
+Desligado enquanto PROFILER_TOKEN não estiver definido. Com o token:
+
+- uma requisição com o cabeçalho `X-Profile: <token>` (ou `?_perfil=<token>`)
+  roda sob cProfile; o perfil é salvo em PROFILER_DIR e o nome do arquivo
+  volta no cabeçalho X-Profile-Arquivo;
+- GET /api/perfis lista os perfis salvos e GET /api/perfis/<nome> devolve as
+  funções mais caras (ambos exigem o mesmo token);
+- com PROFILER_JOBS=1, as funções marcadas com @perfilado (sincronizações com
+  o Mainô) também gravam um perfil a cada execução.
+
+Cada perfil gera um .prof (para pstats/snakeviz) e um .txt com as funções
+mais caras; só os PROFILER_MAX_ARQUIVOS perfis mais recentes são mantidos.
+"""
+import cProfile
+import glob
+import hmac
+import io
+import itertools
+import logging
+import os
+import pstats
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import Response, abort, g, jsonify, request
+
+logger = logging.getLogger(__name__)
+
+TOKEN = os.getenv('PROFILER_TOKEN')
+DIRETORIO_PERFIS = os.getenv('PROFILER_DIR', os.path.join(tempfile.gettempdir(), 'opme_perfis'))
+MAX_ARQUIVOS = int(os.getenv('PROFILER_MAX_ARQUIVOS', '50'))
+PERFILAR_JOBS = os.getenv('PROFILER_JOBS') == '1'
+FUNCOES_NO_RESUMO = 40
+
+_sequencia = itertools.count(1)
+
+
+def _token_valido(valor):
+    return bool(TOKEN) and bool(valor) and hmac.compare_digest(valor, TOKEN)
+
+
+def _rotacionar():
+    perfis = sorted(glob.glob(os.path.join(DIRETORIO_PERFIS, '*.prof')), key=os.path.getmtime)
+    for antigo in perfis[:max(len(perfis) - MAX_ARQUIVOS, 0)]:
+        for caminho in (antigo, antigo[:-len('.prof')] + '.txt'):
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+
+
+def salvar_perfil(perfil, nome, descricao=''):
+    """Grava o .prof e o resumo .txt do perfil e remove os mais antigos. Retorna o nome base."""
+    os.makedirs(DIRETORIO_PERFIS, exist_ok=True)
+    nome = re.sub(r'[^A-Za-z0-9_.-]+', '_', nome)[:80]
+    base = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_sequencia)}-{nome}"
+    perfil.dump_stats(os.path.join(DIRETORIO_PERFIS, base + '.prof'))
+
+    resumo = io.StringIO()
+    if descricao:
+        resumo.write(descricao + '\n\n')
+    pstats.Stats(perfil, stream=resumo).sort_stats('cumulative').print_stats(FUNCOES_NO_RESUMO)
+    with open(os.path.join(DIRETORIO_PERFIS, base + '.txt'), 'w') as arquivo:
+        arquivo.write(resumo.getvalue())
+
+    _rotacionar()
+    return base
+
+
+@contextmanager
+def perfilar(nome, descricao=''):
+    """Executa o bloco sob cProfile e grava o perfil (para jobs e scripts)."""
+    perfil = cProfile.Profile()
+    try:
+        perfil.enable()
+    except ValueError:
+        # Outro profiler já ativo nesta thread
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        perfil.disable()
+        duracao = time.perf_counter() - inicio
+        base = salvar_perfil(perfil, nome, f"{descricao or nome}: {duracao * 1000:.0f} ms")
+        logger.info(f"Perfil de {nome} gravado em {os.path.join(DIRETORIO_PERFIS, base)}.prof")
+
+
+def perfilado(nome):
+    """Decorator: grava um perfil de cada chamada quando PROFILER_JOBS=1."""
+    def decorator(funcao):
+        @wraps(funcao)
+        def wrapper(*args, **kwargs):
+            if not PERFILAR_JOBS:
+                return funcao(*args, **kwargs)
+            with perfilar(nome):
+                return funcao(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instalar_profiler(app):
+    """Ativa o profiling por requisição e as rotas /api/perfis (só com PROFILER_TOKEN)."""
+    if not TOKEN:
+        return
+
+    @app.before_request
+    def _iniciar_perfil():
+        if request.path.startswith('/api/perfis'):
+            return
+        if not _token_valido(request.headers.get('X-Profile') or request.args.get('_perfil')):
+            return
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+        except ValueError:
+            return
+        g.perfil = perfil
+        g.inicio_perfil = time.perf_counter()
+
+    @app.after_request
+    def _finalizar_perfil(response):
+        perfil = g.pop('perfil', None)
+        if perfil is None:
+            return response
+        perfil.disable()
+        duracao = time.perf_counter() - g.inicio_perfil
+        rota = request.url_rule.rule if request.url_rule else request.path
+        # O token não vai para o resumo gravado
+        parametros = '&'.join(f'{k}={v}' for k, v in request.args.items(multi=True) if k != '_perfil')
+        base = salvar_perfil(perfil, f'{request.method}-{rota}',
+                             f"{request.method} {request.path}{'?' + parametros if parametros else ''} "
+                             f"-> {response.status_code} em {duracao * 1000:.0f} ms")
+        response.headers['X-Profile-Arquivo'] = base
+        return response
+
+    def _exigir_token():
+        if not _token_valido(request.headers.get('X-Profile') or request.args.get('_perfil')):
+            abort(404)
+
+    @app.route('/api/perfis', methods=['GET'])
+    def listar_perfis():
+        _exigir_token()
+        resumos = sorted(glob.glob(os.path.join(DIRETORIO_PERFIS, '*.txt')), key=os.path.getmtime, reverse=True)
+        return jsonify([os.path.basename(caminho)[:-len('.txt')] for caminho in resumos])
+
+    @app.route('/api/perfis/<nome>', methods=['GET'])
+    def ver_perfil(nome):
+        _exigir_token()
+        caminho = os.path.join(DIRETORIO_PERFIS, os.path.basename(nome) + '.txt')
+        if not os.path.exists(caminho):
+            abort(404)
+        with open(caminho) as arquivo:
+            return Response(arquivo.read(), mimetype='text/plain')
@@ -0,0 +1,62 @@
+"""
+Rastreabilidade de lotes (recolhimentos da ANVISA): as movimentações de um lote
+em ordem cronológica -- remessas em consignação, retornos e faturamentos, com
+nota e cliente -- e o saldo atual do lote em cada cliente.
+
+As consultas partem dos índices de movimento por (nLote, dEmi) e por
+(cProd, nLote) e do índice de saldo por lote, sem varrer o histórico.
+"""
+from sqlalchemy import select
+
+from models.user import Lote, Movimento, NotaFiscal, Saldo, db
+from movimentos import QUANTIDADE_EFETIVA
+from opme_logic import CFOP_SAIDA_CONSIGNACAO, CFOP_RETORNO_CONSIGNACAO, CFOP_RETORNO_SIMBOLICO, CFOP_FATURAMENTO
+
+# Grupos de CFOP com os mesmos nomes do resumo de saldos
+GRUPO_CFOP = {
+    cfop: grupo
+    for grupo, cfops in (('saida_consignacao', CFOP_SAIDA_CONSIGNACAO),
+                         ('retorno_consignacao', CFOP_RETORNO_CONSIGNACAO),
+                         ('retorno_simbolico', CFOP_RETORNO_SIMBOLICO),
+                         ('faturamento', CFOP_FATURAMENTO))
+    for cfop in cfops
+}
+
+
+def grupo_cfop(cfop):
+    return GRUPO_CFOP.get(cfop, 'outro')
+
+
+def rastrear_lote(nLote, cProd=None):
+    """
+    Movimentações e saldos de um lote (opcionalmente de um único produto).
+
+    Returns:
+        dict: 'movimentos' (por data de emissão), 'saldos' (por cliente e produto)
+        e 'lotes' (fabricação e validade por produto)
+    """
+    movimentos = (
+        select(Movimento.dEmi, Movimento.nNF, NotaFiscal.chave_acesso, Movimento.cfop,
+               Movimento.cnpj_dest, Movimento.xNome_dest, Movimento.cProd, Movimento.xProd,
+               QUANTIDADE_EFETIVA.label('quantidade'), Movimento.qSinal)
+        .outerjoin(NotaFiscal, NotaFiscal.id == Movimento.nota_fiscal_id)
+        .where(Movimento.nLote == nLote)
+        # Mesma ordem do índice (nLote, dEmi): sem NULLS FIRST, que no Postgres o impediria de ser usado
+        .order_by(Movimento.dEmi, Movimento.id)
+    )
+    saldos = (
+        select(Saldo.cnpj_dest, Saldo.xNome_dest, Saldo.cProd, Saldo.xProd, Saldo.saldo)
+        .where(Saldo.nLote == nLote)
+        .order_by(Saldo.saldo, Saldo.cnpj_dest, Saldo.cProd)
+    )
+    lotes = select(Lote.cProd, Lote.dFab, Lote.dVal).where(Lote.nLote == nLote).order_by(Lote.cProd)
+    if cProd:
+        movimentos = movimentos.where(Movimento.cProd == cProd)
+        saldos = saldos.where(Saldo.cProd == cProd)
+        lotes = lotes.where(Lote.cProd == cProd)
+
+    return {
+        'movimentos': db.session.execute(movimentos).all(),
+        'saldos': db.session.execute(saldos).all(),
+        'lotes': db.session.execute(lotes).all(),
+    }
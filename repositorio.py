@@ -0,0 +1,160 @@
+"""
+Camada de acesso ao banco compartilhada pelo app, pelos scripts e pelo opme_logic.
+
+- configurar_banco(app): URI, opções do pool (tamanho, pre-ping, reciclagem) e
+  tamanho do cache de SQL compilado, lidos do ambiente; o engine é criado uma
+  vez por worker pelo Flask-SQLAlchemy e reaproveitado por todas as chamadas;
+- no SQLite, cada conexão nova recebe WAL e os PRAGMAs de desempenho;
+- consultas de movimento montadas uma única vez (mesmo SQL compilado em cache
+  para as rotas e para o cálculo de saldo), filtros comuns das rotas de
+  movimento e leitura em streaming por cursor do lado do servidor;
+- leitura colunar dos movimentos direto do cursor do driver, para o motor
+  NumPy do opme_logic.
+
+Variáveis de ambiente:
+    DATABASE_URL          URI do banco
+    DB_POOL_SIZE          conexões mantidas abertas por worker (padrão 5)
+    DB_MAX_OVERFLOW       conexões extras em picos (padrão 10)
+    DB_POOL_RECYCLE       segundos até reabrir uma conexão (padrão 1800)
+    DB_POOL_TIMEOUT       espera máxima por uma conexão livre (padrão 30)
+    DB_QUERY_CACHE_SIZE   comandos SQL compilados em cache por engine (padrão 1500)
+"""
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, case, event, func, select
+from sqlalchemy.engine import Engine
+
+from models.user import Movimento, db
+from opme_logic import COLUNAS_CATEGORICAS, SEM_LOTE
+
+# PRAGMAs aplicados a cada conexão SQLite: WAL deixa leituras em paralelo com a
+# gravação, NORMAL só sincroniza o disco nos checkpoints e busy_timeout espera o
+# lock em vez de falhar com "database is locked"
+PRAGMAS_SQLITE = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA temp_store=MEMORY',
+)
+
+# Colunas das movimentações nas rotas de listagem e exportação (sem carregar objetos ORM)
+COLUNAS_MOVIMENTO = (
+    Movimento.id, Movimento.nNF, Movimento.dEmi, Movimento.cnpj_dest, Movimento.xNome_dest,
+    Movimento.cProd, Movimento.xProd, Movimento.cfop, Movimento.qCom, Movimento.nLote, Movimento.qLote
+)
+
+# Parâmetros de filtro das rotas de movimento (listagem e exportação) e colunas correspondentes
+FILTROS_MOVIMENTO = {
+    'cnpj_cliente': Movimento.cnpj_dest,
+    'codigo_produto': Movimento.cProd,
+    'lote': Movimento.nLote,
+    'cfop': Movimento.cfop,
+}
+
+# Tuplas de movimento na ordem de opme_logic.COLUNAS_MOVIMENTO
+CONSULTA_MOVIMENTOS = select(
+    Movimento.nNF, Movimento.dEmi, Movimento.cnpj_dest, Movimento.xNome_dest, Movimento.cProd,
+    Movimento.xProd, Movimento.cfop, Movimento.qCom, Movimento.nLote, Movimento.qLote
+)
+CONSULTA_MOVIMENTOS_CLIENTES = CONSULTA_MOVIMENTOS.where(
+    Movimento.cnpj_dest.in_(bindparam('cnpj_clientes', expanding=True))
+)
+
+# Colunas de opme_logic.carregar_movimentos_colunar: dEmi, as categóricas (na ordem de
+# COLUNAS_CATEGORICAS) e a quantidade efetiva (qLote quando informado, senão qCom)
+CONSULTA_COLUNAR = select(
+    Movimento.dEmi, Movimento.cnpj_dest, Movimento.xNome_dest, Movimento.cProd, Movimento.xProd,
+    Movimento.cfop, func.coalesce(func.nullif(Movimento.nLote, ''), SEM_LOTE),
+    case((func.coalesce(Movimento.qLote, 0) != 0, Movimento.qLote), else_=Movimento.qCom),
+)
+CONSULTA_COLUNAR_CLIENTES = CONSULTA_COLUNAR.where(
+    Movimento.cnpj_dest.in_(bindparam('cnpj_clientes', expanding=True))
+)
+
+
+def opcoes_engine(uri):
+    """Opções de create_engine para a URI: pool configurável fora do SQLite."""
+    opcoes = {
+        'pool_pre_ping': True,
+        'query_cache_size': int(os.getenv('DB_QUERY_CACHE_SIZE', '1500')),
+    }
+    if uri and not uri.startswith('sqlite'):
+        opcoes.update(
+            pool_size=int(os.getenv('DB_POOL_SIZE', '5')),
+            max_overflow=int(os.getenv('DB_MAX_OVERFLOW', '10')),
+            pool_recycle=int(os.getenv('DB_POOL_RECYCLE', '1800')),
+            pool_timeout=int(os.getenv('DB_POOL_TIMEOUT', '30')),
+        )
+    return opcoes
+
+
+def configurar_banco(app, uri=None):
+    """Configura o banco do app (URI do ambiente por padrão) e inicializa o SQLAlchemy."""
+    uri = uri or os.getenv('DATABASE_URL')
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opcoes_engine(uri)
+    db.init_app(app)
+
+
+@event.listens_for(Engine, 'connect')
+def _pragmas_sqlite(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma in PRAGMAS_SQLITE:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def consultar_movimentos(cnpj_clientes=None):
+    """Movimentos como tuplas (ordem de opme_logic.COLUNAS_MOVIMENTO), opcionalmente de alguns clientes."""
+    if cnpj_clientes:
+        return db.session.execute(CONSULTA_MOVIMENTOS_CLIENTES, {'cnpj_clientes': list(cnpj_clientes)}).all()
+    return db.session.execute(CONSULTA_MOVIMENTOS).all()
+
+
+def colunas_movimentos(cnpj_clientes=None):
+    """
+    Colunas de CONSULTA_COLUNAR, uma tupla por coluna. As linhas são lidas direto do
+    cursor do driver, sem Row do SQLAlchemy nem conversão de tipos (no SQLite, dEmi
+    chega como texto ISO).
+    """
+    if cnpj_clientes:
+        resultado = db.session.connection().execute(CONSULTA_COLUNAR_CLIENTES,
+                                                    {'cnpj_clientes': list(cnpj_clientes)})
+    else:
+        resultado = db.session.connection().execute(CONSULTA_COLUNAR)
+    try:
+        linhas = resultado.cursor.fetchall()
+    finally:
+        resultado.close()
+    return list(zip(*linhas)) if linhas else [()] * (len(COLUNAS_CATEGORICAS) + 2)
+
+
+def filtrar_movimentos(stmt, args):
+    """
+    Aplica à consulta de movimentos os filtros de cliente, produto, lote, CFOP e período
+    (data_inicio/data_fim em AAAA-MM-DD). Data inválida gera ValueError.
+    """
+    for parametro, coluna in FILTROS_MOVIMENTO.items():
+        valor = args.get(parametro)
+        if valor:
+            stmt = stmt.where(coluna == valor)
+
+    if args.get('data_inicio'):
+        stmt = stmt.where(Movimento.dEmi >= datetime.strptime(args['data_inicio'], '%Y-%m-%d'))
+    if args.get('data_fim'):
+        data_fim = datetime.strptime(args['data_fim'], '%Y-%m-%d') + timedelta(days=1)
+        stmt = stmt.where(Movimento.dEmi < data_fim)
+    return stmt
+
+
+def ler_em_blocos(stmt, linhas_por_bloco=1000):
+    """Executa a consulta com cursor do lado do servidor e gera o resultado em blocos de linhas."""
+    with db.engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=linhas_por_bloco).execute(stmt)
+        yield from result.partitions()
@@ -0,0 +1,92 @@
+import csv
+import io
+import zlib
+
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from sqlalchemy import select
+
+from models.user import Movimento, Saldo
+from repositorio import COLUNAS_MOVIMENTO, filtrar_movimentos, ler_em_blocos
+
+export_bp = Blueprint('export', __name__)
+
+# Linhas acumuladas antes de enviar um pedaço da resposta
+LINHAS_POR_BLOCO = 1000
+
+CABECALHO_MOVIMENTOS = ['id', 'numero_nf', 'data_emissao', 'cnpj_cliente', 'nome_cliente', 'codigo_produto',
+                        'descricao_produto', 'cfop', 'quantidade', 'lote', 'quantidade_lote']
+CABECALHO_SALDOS = ['cnpj_cliente', 'nome_cliente', 'codigo_produto', 'descricao_produto', 'lote', 'saldo']
+
+
+def _linhas_csv(stmt, cabecalho, converter):
+    """Escreve o resultado em CSV a partir de um cursor do lado do servidor, em blocos de texto."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(cabecalho)
+    for bloco in ler_em_blocos(stmt, LINHAS_POR_BLOCO):
+        escritor.writerows(converter(linha) for linha in bloco)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _gzip(blocos):
+    compressor = zlib.compressobj(wbits=31)  # 31: cabeçalho gzip
+    for bloco in blocos:
+        dados = compressor.compress(bloco.encode('utf-8'))
+        if dados:
+            yield dados
+    yield compressor.flush()
+
+
+def _resposta_csv(blocos, nome_arquivo):
+    """
+    Resposta em streaming; compactada com gzip quando o cliente aceita
+    (Accept-Encoding com qualidade maior que zero), a menos que venha gzip=0.
+    """
+    headers = {'Content-Disposition': f'attachment; filename={nome_arquivo}', 'Vary': 'Accept-Encoding'}
+    if request.accept_encodings['gzip'] > 0 and request.args.get('gzip') != '0':
+        headers['Content-Encoding'] = 'gzip'
+        blocos = _gzip(blocos)
+    return Response(stream_with_context(blocos), mimetype='text/csv', headers=headers)
+
+
+def _movimento_csv(m):
+    return [m.id, m.nNF, m.dEmi.strftime('%Y-%m-%d') if m.dEmi else '', m.cnpj_dest, m.xNome_dest,
+            m.cProd, m.xProd, m.cfop, m.qCom, m.nLote or '', '' if m.qLote is None else m.qLote]
+
+
+def _saldo_csv(s):
+    return [s.cnpj_dest, s.xNome_dest, s.cProd, s.xProd, s.nLote, s.saldo]
+
+
+@export_bp.route('/export/movimentos.csv', methods=['GET'])
+def export_movimentos():
+    """
+    Todas as movimentações em CSV, com os mesmos filtros de /notas-fiscais/listar
+    (cnpj_cliente, codigo_produto, lote, cfop, data_inicio, data_fim).
+    """
+    try:
+        stmt = filtrar_movimentos(select(*COLUNAS_MOVIMENTO), request.args).order_by(Movimento.id)
+        return _resposta_csv(_linhas_csv(stmt, CABECALHO_MOVIMENTOS, _movimento_csv), 'movimentos.csv')
+    except ValueError as e:
+        return jsonify({'error': f'Parâmetro inválido: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'error': f'Erro ao exportar movimentações: {str(e)}'}), 500
+
+
+@export_bp.route('/export/saldos.csv', methods=['GET'])
+def export_saldos():
+    """Saldos da tabela materializada em CSV (filtros: cnpj_cliente, codigo_produto, lote)."""
+    try:
+        stmt = select(Saldo.cnpj_dest, Saldo.xNome_dest, Saldo.cProd, Saldo.xProd, Saldo.nLote, Saldo.saldo)
+        filtros = {'cnpj_cliente': Saldo.cnpj_dest, 'codigo_produto': Saldo.cProd, 'lote': Saldo.nLote}
+        for parametro, coluna in filtros.items():
+            valor = request.args.get(parametro)
+            if valor:
+                stmt = stmt.where(coluna == valor)
+        stmt = stmt.order_by(Saldo.cnpj_dest, Saldo.cProd, Saldo.nLote)
+        return _resposta_csv(_linhas_csv(stmt, CABECALHO_SALDOS, _saldo_csv), 'saldos.csv')
+    except Exception as e:
+        return jsonify({'error': f'Erro ao exportar saldos: {str(e)}'}), 500
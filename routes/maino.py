@@ -1,8 +1,10 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, url_for
 import os
-from maino_integration import MainoAPI
+from maino_integration import obter_cliente_maino
+from sync_jobs import criar_job, retomar_job
+from sync_scheduler import agendar_sync_incremental
 # CORREÇÃO: A importação agora aponta para 'models.user' e usa os nomes corretos
-from models.user import NotaFiscal, ItemNotaFiscal, db 
+from models.user import NotaFiscal, ItemNotaFiscal, SyncJob, db 
 
 maino_bp = Blueprint('maino', __name__)
 
@@ -14,7 +16,7 @@ def test_maino():
         if not api_key:
             return jsonify({'success': False, 'error': 'Variável de ambiente MAINO_API_KEY não configurada'}), 500
 
-        maino_api = MainoAPI(api_key=api_key)
+        maino_api = obter_cliente_maino()
         response = maino_api.test_connection() 
         
         if response and response.get('status') == 'ok':
@@ -26,7 +28,7 @@ def test_maino():
 
 @maino_bp.route('/sync_maino', methods=['POST'])
 def sync_maino():
-    """Sincronizar dados do Mainô"""
+    """Agenda a sincronização de dados do Mainô em segundo plano (retorna o job_id)"""
     try:
         data = request.get_json()
         
@@ -37,25 +39,61 @@ def sync_maino():
         if not api_key:
             return jsonify({'error': 'Variável de ambiente MAINO_API_KEY não configurada'}), 500
         
-        maino_api = MainoAPI(api_key=api_key)
+        job = criar_job(current_app._get_current_object(), data['data_inicio'], data['data_fim'])
         
-        resultado = maino_api.baixar_e_processar_xmls(
-            data['data_inicio'],
-            data['data_fim']
-        )
-        
-        if resultado['success']:
-            return jsonify({
-                'message': resultado['message'],
-                'processed_count': resultado['processed_count'],
-                'errors': resultado['errors']
-            }), 200
-        else:
-            return jsonify({'error': resultado['message']}), 500
+        return jsonify({
+            'message': 'Sincronização agendada',
+            'job_id': job.id,
+            'status_url': url_for('maino.status_sync_maino', job_id=job.id)
+        }), 202
             
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': f'Erro na sincronização: {str(e)}'}), 500
 
+@maino_bp.route('/sync_maino/incremental', methods=['POST'])
+def sync_maino_incremental():
+    """Agenda a sincronização apenas das notas emitidas desde o último watermark"""
+    try:
+        if not os.getenv('MAINO_API_KEY'):
+            return jsonify({'error': 'Variável de ambiente MAINO_API_KEY não configurada'}), 500
+
+        job = agendar_sync_incremental(current_app._get_current_object())
+        if not job:
+            return jsonify({'error': 'Já existe uma sincronização incremental em andamento'}), 409
+
+        return jsonify({
+            'message': 'Sincronização incremental agendada',
+            'job_id': job.id,
+            'data_inicio': job.data_inicio,
+            'data_fim': job.data_fim,
+            'status_url': url_for('maino.status_sync_maino', job_id=job.id)
+        }), 202
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Erro na sincronização: {str(e)}'}), 500
+
+@maino_bp.route('/sync_maino/<job_id>', methods=['GET'])
+def status_sync_maino(job_id):
+    """Progresso de uma sincronização (processados, duplicados, falhas e restantes)"""
+    job = db.session.get(SyncJob, job_id)
+    if not job:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    return jsonify(job.to_dict()), 200
+
+@maino_bp.route('/sync_maino/<job_id>/retomar', methods=['POST'])
+def retomar_sync_maino(job_id):
+    """Retoma uma sincronização com erro ou interrompida a partir do último checkpoint"""
+    try:
+        if not db.session.get(SyncJob, job_id):
+            return jsonify({'error': 'Job não encontrado'}), 404
+        if not retomar_job(current_app._get_current_object(), job_id):
+            return jsonify({'error': 'Job concluído ou ainda em execução'}), 409
+        return jsonify({'message': 'Sincronização retomada', 'job_id': job_id}), 202
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Erro ao retomar sincronização: {str(e)}'}), 500
+
 @maino_bp.route('/list_nfes_maino', methods=['POST'])
 def list_nfes_maino():
     """Listar NF-es do Mainô sem processar"""
@@ -69,7 +107,7 @@ def list_nfes_maino():
         if not api_key:
             return jsonify({'error': 'Variável de ambiente MAINO_API_KEY não configurada'}), 500
         
-        maino_api = MainoAPI(api_key=api_key)
+        maino_api = obter_cliente_maino()
         
         notas = maino_api.listar_notas_fiscais_emitidas(
             data['data_inicio'],
@@ -79,7 +117,7 @@ def list_nfes_maino():
             exibir_xmls=data.get('exibir_xmls', False)
         )
         
-        if notas:
+        if notas and 'error' not in notas:
             return jsonify(notas), 200
         else:
             return jsonify({'error': 'Erro ao listar notas fiscais do Mainô'}), 500
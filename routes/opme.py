@@ -1,12 +1,22 @@
-from flask import Blueprint, request, jsonify
-from sqlalchemy import func
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from sqlalchemy import case, distinct, func, select
 from datetime import datetime
+import json
 import xml.etree.ElementTree as ET
 import os
+import zipfile
 
 # Importação padronizada e completa
-from models.user import db, Movimento, NotaFiscal, ItemNotaFiscal, Produto, Cliente 
-from insert_nfe_data import insert_nfe_data
+from models.user import db, Movimento, NotaFiscal, ItemNotaFiscal, Produto, Cliente, Saldo
+from insert_nfe_data import insert_nfe_data, insert_nfe_batch
+from movimentos import QUANTIDADE_EFETIVA
+from snapshots import saldos_em
+from lotes import lotes_vencendo
+from rastreabilidade import rastrear_lote, grupo_cfop
+from catalogo import buscar, LIMITE_BUSCA, LIMITE_BUSCA_MAXIMO
+from opme_logic import CFOP_SAIDA_CONSIGNACAO, CFOP_RETORNO_CONSIGNACAO, CFOP_RETORNO_SIMBOLICO, CFOP_FATURAMENTO
+from versao_dados import cache_por_versao, etag_por_versao
+from repositorio import COLUNAS_MOVIMENTO, filtrar_movimentos, ler_em_blocos
 
 opme_bp = Blueprint('opme', __name__)
 
@@ -39,63 +49,308 @@ def upload_xml():
         return jsonify({'error': f'Erro ao processar XML: {str(e)}'}), 500
 
 
+def _ler_arquivos_enviados(arquivos):
+    """Separa os XMLs enviados (avulsos ou dentro de ZIPs) dos arquivos recusados."""
+    documentos = []
+    recusados = []
+    for file in arquivos:
+        nome = file.filename or ''
+        if nome.lower().endswith('.xml'):
+            documentos.append((nome, file.read()))
+        elif nome.lower().endswith('.zip'):
+            try:
+                with zipfile.ZipFile(file.stream) as zip_ref:
+                    xmls = [membro for membro in zip_ref.infolist()
+                            if not membro.is_dir() and membro.filename.lower().endswith('.xml')]
+                    for membro in xmls:
+                        documentos.append((f'{nome}/{membro.filename}', zip_ref.read(membro)))
+            except zipfile.BadZipFile:
+                recusados.append({'arquivo': nome, 'chave_acesso': None, 'success': False,
+                                  'duplicada': False, 'message': 'Arquivo ZIP inválido'})
+                continue
+            if not xmls:
+                recusados.append({'arquivo': nome, 'chave_acesso': None, 'success': False,
+                                  'duplicada': False, 'message': 'Arquivo ZIP sem XMLs'})
+        else:
+            recusados.append({'arquivo': nome, 'chave_acesso': None, 'success': False,
+                              'duplicada': False, 'message': 'Apenas arquivos XML ou ZIP são aceitos'})
+    return documentos, recusados
+
+
+@opme_bp.route('/notas-fiscais/upload-lote', methods=['POST'])
+def upload_lote():
+    """Importa vários XMLs (campo 'files') e/ou arquivos ZIP com XMLs de uma só vez."""
+    try:
+        arquivos = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+        if not arquivos:
+            return jsonify({'error': 'Nenhum arquivo foi enviado'}), 400
+
+        documentos, recusados = _ler_arquivos_enviados(arquivos)
+        resultados = recusados + insert_nfe_batch(documentos)
+
+        inseridas = sum(1 for r in resultados if r['success'])
+        duplicadas = sum(1 for r in resultados if r['duplicada'])
+        return jsonify({
+            'total': len(resultados),
+            'inseridas': inseridas,
+            'duplicadas': duplicadas,
+            'falhas': len(resultados) - inseridas - duplicadas,
+            'resultados': resultados
+        }), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Erro ao processar lote de XMLs: {str(e)}'}), 500
+
+
+def _saldo_dict(r):
+    return {'cnpj_cliente': r['cnpj_dest'], 'nome_cliente': r['xNome_dest'],
+            'codigo_produto': r['cProd'], 'descricao_produto': r['xProd'],
+            'lote': r['nLote'] or None, 'saldo': r['saldo']}
+
+
 @opme_bp.route('/saldos/consultar', methods=['GET'])
+@etag_por_versao()
 def get_balance():
     try:
+        cnpj_cliente = request.args.get('cnpj_cliente')
+        as_of = request.args.get('as_of')
+        if as_of:
+            # Saldo em uma data passada: snapshot mensal mais próximo + movimentos até a data
+            try:
+                data = datetime.strptime(as_of, '%Y-%m-%d').date()
+            except ValueError:
+                return jsonify({'error': 'Parâmetro as_of deve estar no formato AAAA-MM-DD'}), 400
+            return jsonify([_saldo_dict(r) for r in saldos_em(data, cnpj_cliente)]), 200
+
+        # Leitura da tabela materializada (mantida pela ingestão), sem agregar movimento
         query = db.session.query(
-            Movimento.cnpj_dest, Movimento.xNome_dest,
-            Movimento.cProd, Movimento.xProd,
-            Movimento.nLote, func.sum(Movimento.qCom).label('saldo')
-        ).group_by(
-            Movimento.cnpj_dest, Movimento.xNome_dest,
-            Movimento.cProd, Movimento.xProd, Movimento.nLote
+            Saldo.cnpj_dest, Saldo.xNome_dest,
+            Saldo.cProd, Saldo.xProd,
+            Saldo.nLote, Saldo.saldo
         )
 
-        cnpj_cliente = request.args.get('cnpj_cliente')
         if cnpj_cliente:
-            query = query.filter(Movimento.cnpj_dest == cnpj_cliente)
+            query = query.filter(Saldo.cnpj_dest == cnpj_cliente)
 
         results = query.all()
-        balance_list = [{'cnpj_cliente': r.cnpj_dest, 'nome_cliente': r.xNome_dest,
-                         'codigo_produto': r.cProd, 'descricao_produto': r.xProd,
-                         'lote': r.nLote, 'saldo': r.saldo} for r in results]
+        balance_list = [_saldo_dict(r._asdict()) for r in results]
         
         return jsonify(balance_list), 200
     except Exception as e:
         return jsonify({'error': f'Erro ao calcular saldo: {str(e)}'}), 500
 
 
+LIMITE_PADRAO = 500
+LIMITE_MAXIMO = 5000
+
+
+def _movimento_dict(m):
+    return {
+        'id': m.id,
+        'numero_nf': m.nNF, 'data_emissao': m.dEmi.strftime('%Y-%m-%d') if m.dEmi else None,
+        'cnpj_cliente': m.cnpj_dest, 'nome_cliente': m.xNome_dest,
+        'codigo_produto': m.cProd, 'descricao_produto': m.xProd,
+        'cfop': m.cfop, 'quantidade': m.qCom, 'lote': m.nLote, 'quantidade_lote': m.qLote
+    }
+
+
+def _stream_movimentos(stmt, formato):
+    """Gera as movimentações a partir de um cursor do lado do servidor, sem materializar o resultado."""
+    blocos = ler_em_blocos(stmt)
+    if formato == 'ndjson':
+        for bloco in blocos:
+            for m in bloco:
+                yield json.dumps(_movimento_dict(m), ensure_ascii=False) + '\n'
+        return
+    yield '['
+    separador = ''
+    for bloco in blocos:
+        for m in bloco:
+            yield separador + json.dumps(_movimento_dict(m), ensure_ascii=False)
+            separador = ','
+    yield ']'
+
+
 @opme_bp.route('/notas-fiscais/listar', methods=['GET'])
+@etag_por_versao()
 def get_movements():
+    """
+    Lista movimentações paginadas por cursor (id crescente).
+
+    Parâmetros: cnpj_cliente, codigo_produto, lote, cfop, data_inicio, data_fim,
+    limite, cursor (valor do cabeçalho X-Next-Cursor da página anterior) e
+    formato=ndjson|stream para receber todo o resultado em streaming.
+    """
     try:
-        query = Movimento.query
-        movements_db = query.all()
-        
-        movements_list = [{
-            'numero_nf': m.nNF, 'data_emissao': m.dEmi.strftime('%Y-%m-%d') if m.dEmi else None,
-            'cnpj_cliente': m.cnpj_dest, 'nome_cliente': m.xNome_dest,
-            'codigo_produto': m.cProd, 'descricao_produto': m.xProd,
-            'cfop': m.cfop, 'quantidade': m.qCom, 'lote': m.nLote, 'quantidade_lote': m.qLote
-        } for m in movements_db]
-        
-        return jsonify(movements_list), 200
+        stmt = filtrar_movimentos(select(*COLUNAS_MOVIMENTO), request.args).order_by(Movimento.id)
+
+        formato = request.args.get('formato')
+        if formato in ('ndjson', 'stream'):
+            mimetype = 'application/x-ndjson' if formato == 'ndjson' else 'application/json'
+            return Response(stream_with_context(_stream_movimentos(stmt, formato)), mimetype=mimetype)
+
+        limite = request.args.get('limite', LIMITE_PADRAO, type=int)
+        if limite < 1:
+            return jsonify({'error': 'Parâmetro limite deve ser maior que zero'}), 400
+        limite = min(limite, LIMITE_MAXIMO)
+        cursor = request.args.get('cursor')
+        if cursor is not None:
+            if not cursor.isdigit():
+                return jsonify({'error': 'Parâmetro cursor inválido: use o valor de X-Next-Cursor'}), 400
+            stmt = stmt.where(Movimento.id > int(cursor))
+
+        movements_db = db.session.execute(stmt.limit(limite)).all()
+        movements_list = [_movimento_dict(m) for m in movements_db]
+
+        response = jsonify(movements_list)
+        if len(movements_db) == limite:
+            response.headers['X-Next-Cursor'] = str(movements_db[-1].id)
+        return response, 200
+    except ValueError as e:
+        return jsonify({'error': f'Parâmetro inválido: {str(e)}'}), 400
     except Exception as e:
         return jsonify({'error': f'Erro ao obter movimentações: {str(e)}'}), 500
 
 
+@cache_por_versao
+def _calcular_estatisticas():
+    total_notas, valor_total, produtos_distintos, clientes_ativos = db.session.execute(
+        select(
+            func.count(distinct(NotaFiscal.id)),
+            func.coalesce(func.sum(ItemNotaFiscal.valor_total), 0.0),
+            func.count(distinct(ItemNotaFiscal.codigo_produto)),
+            func.count(distinct(NotaFiscal.destinatario_cnpj))
+        ).select_from(NotaFiscal).outerjoin(ItemNotaFiscal)
+    ).one()
+    return {"total_notas": total_notas, "valor_total": round(valor_total, 2),
+            "produtos_distintos": produtos_distintos, "clientes_ativos": clientes_ativos}
+
+
+def _quantidade_do_grupo(cfops):
+    return func.coalesce(func.sum(case((Movimento.cfop.in_(cfops), QUANTIDADE_EFETIVA), else_=0.0)), 0.0)
+
+
+@cache_por_versao
+def _calcular_resumo_saldos():
+    linha = db.session.execute(
+        select(
+            func.coalesce(func.sum(Movimento.qSinal), 0.0),
+            func.count(distinct(Movimento.cProd)),
+            func.count(distinct(Movimento.cnpj_dest)),
+            _quantidade_do_grupo(CFOP_SAIDA_CONSIGNACAO),
+            _quantidade_do_grupo(CFOP_RETORNO_CONSIGNACAO),
+            _quantidade_do_grupo(CFOP_RETORNO_SIMBOLICO),
+            _quantidade_do_grupo(CFOP_FATURAMENTO)
+        )
+    ).one()
+    return {
+        "saldo_total": linha[0], "produtos_distintos": linha[1], "clientes_atendidos": linha[2],
+        "quantidade_por_grupo_cfop": {
+            "saida_consignacao": linha[3], "retorno_consignacao": linha[4],
+            "retorno_simbolico": linha[5], "faturamento": linha[6]
+        }
+    }
+
+
+@opme_bp.route('/busca', methods=['GET'])
+@etag_por_versao(parametro_cliente=None)
+def search_catalogo():
+    """
+    Autocomplete de clientes (CNPJ ou nome) e produtos (código ou descrição).
+    Parâmetros: q, tipo=cliente|produto (padrão: ambos), limite.
+    """
+    try:
+        termo = request.args.get('q', '')
+        limite = request.args.get('limite', LIMITE_BUSCA, type=int)
+        if limite < 1:
+            return jsonify({'error': 'Parâmetro limite deve ser maior que zero'}), 400
+        limite = min(limite, LIMITE_BUSCA_MAXIMO)
+        tipos = [request.args['tipo']] if request.args.get('tipo') else ['cliente', 'produto']
+        if any(tipo not in ('cliente', 'produto') for tipo in tipos):
+            return jsonify({'error': 'Parâmetro tipo deve ser cliente ou produto'}), 400
+
+        resultado = {}
+        if 'cliente' in tipos:
+            resultado['clientes'] = [{'cnpj_cliente': cnpj, 'nome_cliente': nome}
+                                     for cnpj, nome in buscar(termo, 'cliente', limite)]
+        if 'produto' in tipos:
+            resultado['produtos'] = [{'codigo_produto': cprod, 'descricao_produto': nome}
+                                     for cprod, nome in buscar(termo, 'produto', limite)]
+        return jsonify(resultado), 200
+    except Exception as e:
+        return jsonify({'error': f'Erro na busca: {str(e)}'}), 500
+
+
+@opme_bp.route('/lotes/vencendo', methods=['GET'])
+def get_lotes_vencendo():
+    """Lotes em consignação com validade nos próximos `dias` dias (padrão 30)."""
+    try:
+        dias = request.args.get('dias', 30, type=int)
+        incluir_vencidos = request.args.get('incluir_vencidos') in ('1', 'true')
+        hoje = datetime.now().date()
+        lotes = lotes_vencendo(dias, request.args.get('cnpj_cliente'), incluir_vencidos)
+        return jsonify([{
+            'cnpj_cliente': l.cnpj_dest, 'nome_cliente': l.xNome_dest,
+            'codigo_produto': l.cProd, 'descricao_produto': l.xProd, 'lote': l.nLote,
+            'data_fabricacao': l.dFab.isoformat() if l.dFab else None,
+            'data_validade': l.dVal.isoformat(),
+            'dias_para_vencer': (l.dVal - hoje).days,
+            'quantidade_consignada': l.consignado,
+        } for l in lotes]), 200
+    except Exception as e:
+        return jsonify({'error': f'Erro ao consultar lotes a vencer: {str(e)}'}), 500
+
+
+@opme_bp.route('/rastreabilidade/<path:lote>', methods=['GET'])
+@etag_por_versao(parametro_cliente=None)
+def get_rastreabilidade(lote):
+    """
+    Caminho completo de um lote: movimentações em ordem de emissão (remessas,
+    retornos e faturamentos, com nota e cliente) e saldo atual por cliente.
+    Parâmetro opcional: codigo_produto, quando o mesmo lote existe em vários produtos.
+    """
+    try:
+        rastro = rastrear_lote(lote, request.args.get('codigo_produto'))
+        if not rastro['movimentos']:
+            return jsonify({'error': f'Lote {lote} não encontrado'}), 404
+        return jsonify({
+            'lote': lote,
+            'produtos': [{
+                'codigo_produto': l.cProd,
+                'data_fabricacao': l.dFab.isoformat() if l.dFab else None,
+                'data_validade': l.dVal.isoformat() if l.dVal else None,
+            } for l in rastro['lotes']],
+            'movimentos': [{
+                'data_emissao': m.dEmi.strftime('%Y-%m-%d') if m.dEmi else None,
+                'numero_nf': m.nNF, 'chave_acesso': m.chave_acesso,
+                'cfop': m.cfop, 'grupo_cfop': grupo_cfop(m.cfop),
+                'cnpj_cliente': m.cnpj_dest, 'nome_cliente': m.xNome_dest,
+                'codigo_produto': m.cProd, 'descricao_produto': m.xProd,
+                'quantidade': m.quantidade, 'quantidade_com_sinal': m.qSinal,
+            } for m in rastro['movimentos']],
+            'saldos': [{
+                'cnpj_cliente': s.cnpj_dest, 'nome_cliente': s.xNome_dest,
+                'codigo_produto': s.cProd, 'descricao_produto': s.xProd,
+                'saldo': s.saldo, 'quantidade_consignada': -s.saldo if s.saldo < 0 else 0.0,
+            } for s in rastro['saldos']],
+        }), 200
+    except Exception as e:
+        return jsonify({'error': f'Erro ao rastrear lote: {str(e)}'}), 500
+
+
 @opme_bp.route('/notas-fiscais/estatisticas', methods=['GET'])
+@etag_por_versao(parametro_cliente=None)
 def get_estatisticas():
     try:
-        dados_exemplo = {"total_notas": NotaFiscal.query.count(), "valor_total": 75000.50, "clientes_ativos": Cliente.query.count()}
-        return jsonify(dados_exemplo), 200
+        return jsonify(_calcular_estatisticas()), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @opme_bp.route('/saldos/resumo', methods=['GET'])
+@etag_por_versao(parametro_cliente=None)
 def get_resumo_saldos():
     try:
-        dados_resumo = {"saldo_total": db.session.query(func.sum(Movimento.qCom)).scalar() or 0, "produtos_distintos": 42, "clientes_atendidos": 15}
-        return jsonify(dados_resumo), 200
+        return jsonify(_calcular_resumo_saldos()), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -0,0 +1,149 @@
+"""
+Manutenção da tabela materializada de saldos (saldo).
+
+A tabela é atualizada na mesma transação da ingestão de cada NF-e
+(aplicar_movimentos) e pode ser reconstruída ou conferida contra a
+agregação completa da tabela movimento.
+
+Uso:
+    python saldo.py reconstruir
+    python saldo.py verificar
+"""
+import argparse
+import sys
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models.user import Movimento, Saldo, db
+from versao_dados import incrementar_versao, ESCOPOS_RECONSTRUCAO
+
+# Diferença máxima aceita entre a tabela saldo e a agregação completa
+TOLERANCIA = 1e-6
+
+
+def agrupar_deltas(movimentos):
+    deltas = {}
+    for movimento in movimentos:
+        chave = (movimento['cnpj_dest'], movimento['cProd'], movimento['nLote'] or '')
+        atual = deltas.get(chave)
+        if atual is None:
+            deltas[chave] = {
+                'cnpj_dest': chave[0], 'cProd': chave[1], 'nLote': chave[2],
+                'xNome_dest': movimento['xNome_dest'], 'xProd': movimento['xProd'],
+                'saldo': movimento['qSinal'],
+            }
+        else:
+            atual['saldo'] += movimento['qSinal']
+    return list(deltas.values())
+
+
+def somar_saldos(modelo, chave, linhas):
+    """
+    Soma o campo saldo das linhas às linhas existentes de `modelo` com a mesma chave
+    (lista de colunas com restrição única), inserindo as que ainda não existem.
+    As linhas são gravadas na ordem da chave: duas ingestões concorrentes travam
+    as mesmas linhas na mesma ordem e não entram em deadlock.
+    """
+    if not linhas:
+        return
+    linhas = sorted(linhas, key=lambda linha: tuple(linha[coluna] or '' for coluna in chave))
+
+    dialeto = db.session.get_bind().dialect.name
+    if dialeto in ('postgresql', 'sqlite'):
+        modulo = postgresql if dialeto == 'postgresql' else sqlite
+        stmt = modulo.insert(modelo)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=chave,
+            set_={
+                'saldo': modelo.saldo + stmt.excluded.saldo,
+                'xNome_dest': stmt.excluded.xNome_dest,
+                'xProd': stmt.excluded.xProd,
+            }
+        )
+        db.session.execute(stmt, linhas)
+        return
+
+    # Outros bancos: atualização linha a linha
+    for linha in linhas:
+        existente = modelo.query.filter_by(**{coluna: linha[coluna] for coluna in chave}).first()
+        if existente:
+            existente.saldo += linha['saldo']
+            existente.xNome_dest = linha['xNome_dest']
+            existente.xProd = linha['xProd']
+        else:
+            db.session.add(modelo(**linha))
+
+
+def aplicar_movimentos(movimentos):
+    """
+    Soma as quantidades com sinal (qSinal) dos movimentos recém-gravados aos saldos.
+    Não faz commit: deve rodar na mesma transação que gravou os movimentos.
+    """
+    somar_saldos(Saldo, ['cnpj_dest', 'cProd', 'nLote'], agrupar_deltas(movimentos))
+
+
+def _agregacao_completa():
+    lote = func.coalesce(Movimento.nLote, '')
+    return select(
+        Movimento.cnpj_dest, func.max(Movimento.xNome_dest),
+        Movimento.cProd, func.max(Movimento.xProd),
+        lote, func.coalesce(func.sum(Movimento.qSinal), 0.0)
+    ).group_by(Movimento.cnpj_dest, Movimento.cProd, lote)
+
+
+def reconstruir_saldos():
+    """Recalcula toda a tabela saldo a partir da tabela movimento."""
+    db.session.execute(delete(Saldo))
+    db.session.execute(insert(Saldo).from_select(
+        ['cnpj_dest', 'xNome_dest', 'cProd', 'xProd', 'nLote', 'saldo'],
+        _agregacao_completa()
+    ))
+    incrementar_versao(ESCOPOS_RECONSTRUCAO)
+    db.session.commit()
+    return db.session.scalar(select(func.count()).select_from(Saldo))
+
+
+def verificar_saldos():
+    """
+    Compara a tabela saldo com a agregação completa de movimento.
+
+    Returns:
+        list: divergências ({'chave', 'esperado', 'materializado'})
+    """
+    esperado = {
+        (cnpj, cprod, lote): total or 0.0
+        for cnpj, _, cprod, _, lote, total in db.session.execute(_agregacao_completa())
+    }
+    materializado = {
+        (s.cnpj_dest, s.cProd, s.nLote): s.saldo
+        for s in db.session.execute(select(Saldo.cnpj_dest, Saldo.cProd, Saldo.nLote, Saldo.saldo))
+    }
+
+    divergencias = []
+    for chave in esperado.keys() | materializado.keys():
+        valor_esperado = esperado.get(chave, 0.0)
+        valor_materializado = materializado.get(chave, 0.0)
+        if abs(valor_esperado - valor_materializado) > TOLERANCIA:
+            divergencias.append({'chave': chave, 'esperado': valor_esperado,
+                                 'materializado': valor_materializado})
+    return divergencias
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manutenção da tabela de saldos')
+    parser.add_argument('comando', choices=['reconstruir', 'verificar'])
+    args = parser.parse_args()
+
+    from main import app
+
+    with app.app_context():
+        if args.comando == 'reconstruir':
+            total = reconstruir_saldos()
+            print(f"Tabela saldo reconstruída: {total} linhas.")
+        else:
+            divergencias = verificar_saldos()
+            for d in divergencias[:50]:
+                print(f"Divergência em {d['chave']}: esperado {d['esperado']}, materializado {d['materializado']}")
+            print(f"{len(divergencias)} divergência(s) encontrada(s).")
+            sys.exit(1 if divergencias else 0)
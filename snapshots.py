@@ -0,0 +1,202 @@
+"""
+Snapshots mensais de saldo (saldo_snapshot) para consultas em datas passadas.
+
+Cada snapshot guarda o saldo por (cliente, produto, lote) no primeiro dia de
+um mês (data_corte, exclusiva): a soma de qSinal dos movimentos emitidos antes
+dessa data. O saldo em uma data D é o snapshot mais recente até D mais os
+movimentos entre o corte e o fim de D, sem repassar todo o histórico.
+
+Notas que chegam com emissão anterior a cortes já gravados ajustam esses
+snapshots na mesma transação da ingestão (ajustar_snapshots).
+
+Uso:
+    python snapshots.py construir [--recriar]
+    python snapshots.py verificar
+"""
+import argparse
+import sys
+from datetime import datetime, time, timedelta, timezone
+
+from sqlalchemy import delete, func, insert, or_, select
+
+from models.user import Movimento, SaldoSnapshot, db
+from nfe_parser import data_local
+from saldo import TOLERANCIA, agrupar_deltas, somar_saldos
+
+CHAVE_SNAPSHOT = ['data_corte', 'cnpj_dest', 'cProd', 'nLote']
+
+
+def _primeiro_dia_mes_seguinte(data):
+    return datetime(data.year + data.month // 12, data.month % 12 + 1, 1)
+
+
+def _data_movimento(movimento):
+    # Movimentos sem data contam desde sempre; o mês é o do horário de gravação de dEmi
+    return data_local(movimento['dEmi']) if movimento['dEmi'] else datetime.min
+
+
+def _agregacao(ate, desde=None, cnpj=None):
+    """
+    Soma de qSinal por chave dos movimentos com dEmi < ate (e >= desde, se informado).
+    Sem `desde`, inclui também os movimentos sem data de emissão.
+    """
+    lote = func.coalesce(Movimento.nLote, '')
+    stmt = select(
+        Movimento.cnpj_dest, func.max(Movimento.xNome_dest),
+        Movimento.cProd, func.max(Movimento.xProd),
+        lote, func.coalesce(func.sum(Movimento.qSinal), 0.0)
+    ).group_by(Movimento.cnpj_dest, Movimento.cProd, lote)
+    if desde is None:
+        stmt = stmt.where(or_(Movimento.dEmi.is_(None), Movimento.dEmi < ate))
+    else:
+        stmt = stmt.where(Movimento.dEmi >= desde, Movimento.dEmi < ate)
+    if cnpj:
+        stmt = stmt.where(Movimento.cnpj_dest == cnpj)
+    return stmt
+
+
+def _linhas_snapshot(corte, cnpj=None):
+    stmt = select(
+        SaldoSnapshot.cnpj_dest, SaldoSnapshot.xNome_dest,
+        SaldoSnapshot.cProd, SaldoSnapshot.xProd,
+        SaldoSnapshot.nLote, SaldoSnapshot.saldo
+    ).where(SaldoSnapshot.data_corte == corte)
+    if cnpj:
+        stmt = stmt.where(SaldoSnapshot.cnpj_dest == cnpj)
+    return stmt
+
+
+def _somar(saldos, linhas):
+    for cnpj, nome, cprod, xprod, lote, total in linhas:
+        atual = saldos.setdefault((cnpj, cprod, lote), {
+            'cnpj_dest': cnpj, 'xNome_dest': nome, 'cProd': cprod, 'xProd': xprod,
+            'nLote': lote, 'saldo': 0.0,
+        })
+        atual['saldo'] += total or 0.0
+    return saldos
+
+
+def cortes_gravados():
+    return db.session.scalars(
+        select(SaldoSnapshot.data_corte).distinct().order_by(SaldoSnapshot.data_corte)
+    ).all()
+
+
+def construir_snapshots(recriar=False):
+    """
+    Grava os snapshots que faltam, do mês seguinte ao último já gravado até o
+    início do mês corrente (só meses completos). Cada corte parte do anterior e
+    soma apenas os movimentos do mês; saldos zerados não são gravados.
+
+    Returns:
+        int: número de cortes gravados
+    """
+    if recriar:
+        db.session.execute(delete(SaldoSnapshot))
+        db.session.commit()
+
+    anterior = db.session.scalar(select(func.max(SaldoSnapshot.data_corte)))
+    if anterior is None:
+        primeira_emissao = db.session.scalar(select(func.min(Movimento.dEmi)))
+        if primeira_emissao is None:
+            return 0
+        saldos = {}
+        corte = _primeiro_dia_mes_seguinte(primeira_emissao)
+    else:
+        saldos = _somar({}, db.session.execute(_linhas_snapshot(anterior)))
+        corte = _primeiro_dia_mes_seguinte(anterior)
+
+    # Mês corrente no fuso das emissões (as datas gravadas são locais)
+    hoje = data_local(datetime.now(timezone.utc))
+    limite = datetime(hoje.year, hoje.month, 1)
+    gravados = 0
+    while corte <= limite:
+        _somar(saldos, db.session.execute(_agregacao(corte, desde=anterior)))
+        linhas = [dict(linha, data_corte=corte) for linha in saldos.values()
+                  if abs(linha['saldo']) > TOLERANCIA]
+        if linhas:
+            db.session.execute(insert(SaldoSnapshot), linhas)
+        db.session.commit()
+        gravados += 1
+        anterior, corte = corte, _primeiro_dia_mes_seguinte(corte)
+    return gravados
+
+
+def ajustar_snapshots(movimentos):
+    """
+    Soma aos snapshots já gravados os movimentos emitidos antes de cada corte
+    (notas que chegam depois do fechamento do mês).
+    Não faz commit: deve rodar na mesma transação que gravou os movimentos.
+    """
+    if not movimentos:
+        return
+    mais_antigo = min(_data_movimento(movimento) for movimento in movimentos)
+    cortes = db.session.scalars(
+        select(SaldoSnapshot.data_corte).where(SaldoSnapshot.data_corte > mais_antigo).distinct()
+    ).all()
+
+    linhas = []
+    for corte in cortes:
+        anteriores = [movimento for movimento in movimentos if _data_movimento(movimento) < corte]
+        linhas.extend(dict(linha, data_corte=corte) for linha in agrupar_deltas(anteriores))
+    somar_saldos(SaldoSnapshot, CHAVE_SNAPSHOT, linhas)
+
+
+def saldos_em(data, cnpj=None):
+    """
+    Saldos ao fim do dia `data`, a partir do snapshot mais recente até ela.
+
+    Returns:
+        list: dicts com cnpj_dest, xNome_dest, cProd, xProd, nLote e saldo
+    """
+    ate = datetime.combine(data, time.min) + timedelta(days=1)
+    corte = db.session.scalar(
+        select(func.max(SaldoSnapshot.data_corte)).where(SaldoSnapshot.data_corte <= ate)
+    )
+    saldos = {}
+    if corte is not None:
+        _somar(saldos, db.session.execute(_linhas_snapshot(corte, cnpj)))
+    _somar(saldos, db.session.execute(_agregacao(ate, desde=corte, cnpj=cnpj)))
+    return list(saldos.values())
+
+
+def verificar_snapshots():
+    """
+    Compara cada snapshot gravado com a soma completa dos movimentos anteriores ao corte.
+
+    Returns:
+        list: divergências ({'data_corte', 'chave', 'esperado', 'snapshot'})
+    """
+    divergencias = []
+    for corte in cortes_gravados():
+        esperado = {(cnpj, cprod, lote): total or 0.0
+                    for cnpj, _, cprod, _, lote, total in db.session.execute(_agregacao(corte))}
+        gravado = {(cnpj, cprod, lote): total
+                   for cnpj, _, cprod, _, lote, total in db.session.execute(_linhas_snapshot(corte))}
+        for chave in esperado.keys() | gravado.keys():
+            valor_esperado = esperado.get(chave, 0.0)
+            valor_gravado = gravado.get(chave, 0.0)
+            if abs(valor_esperado - valor_gravado) > TOLERANCIA:
+                divergencias.append({'data_corte': corte, 'chave': chave,
+                                     'esperado': valor_esperado, 'snapshot': valor_gravado})
+    return divergencias
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Snapshots mensais de saldo')
+    parser.add_argument('comando', choices=['construir', 'verificar'])
+    parser.add_argument('--recriar', action='store_true', help='apaga os snapshots existentes antes de construir')
+    args = parser.parse_args()
+
+    from main import app
+
+    with app.app_context():
+        if args.comando == 'construir':
+            print(f"{construir_snapshots(recriar=args.recriar)} snapshot(s) mensal(is) gravado(s).")
+        else:
+            divergencias = verificar_snapshots()
+            for d in divergencias[:50]:
+                print(f"Divergência em {d['data_corte']:%Y-%m-%d} {d['chave']}: "
+                      f"esperado {d['esperado']}, snapshot {d['snapshot']}")
+            print(f"{len(divergencias)} divergência(s) encontrada(s).")
+            sys.exit(1 if divergencias else 0)
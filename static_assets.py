@@ -0,0 +1,141 @@
+"""
+Entrega dos arquivos do frontend (static/) a partir de um manifesto em memória.
+
+O manifesto é montado uma vez na inicialização: para cada arquivo guarda o
+tipo, o ETag e as variantes gzip/brotli (arquivos .gz/.br gerados no build
+ou comprimidos na carga, para tipos textuais). Cada requisição escolhe a
+variante pelo Accept-Encoding, sem consultar o disco.
+
+Cache:
+    arquivos com hash no nome (app.3f2a9c1b.js) -- um ano, immutable
+    index.html (e o fallback da SPA)             -- no-cache, revalidado por ETag
+    demais arquivos                              -- uma hora
+
+Brotli é opcional: sem o pacote `brotli`, só as variantes .br já existentes
+em disco são usadas.
+
+Uso (gerar as variantes .gz/.br em disco, por exemplo no build):
+    python static_assets.py comprimir [--pasta static]
+"""
+import argparse
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+from flask import Response, request, send_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+INDEX = 'index.html'
+# Nome com hash de conteúdo gerado pelo bundler (ex.: main.3f2a9c1b.js, app-4e5d6f7a.css)
+PADRAO_FINGERPRINT = re.compile(r'[.-][0-9a-f]{8,}\.[A-Za-z0-9]+$')
+CACHE_IMUTAVEL = 'public, max-age=31536000, immutable'
+CACHE_PADRAO = 'public, max-age=3600'
+CACHE_REVALIDAR = 'no-cache'
+TIPOS_COMPRIMIVEIS = ('text/', 'application/javascript', 'application/json', 'image/svg+xml',
+                      'application/xml', 'image/x-icon', 'image/vnd.microsoft.icon')
+TAMANHO_MINIMO_COMPRESSAO = 1024
+# Arquivos maiores que isto são enviados do disco em vez de ficarem em memória
+LIMITE_MEMORIA = 4 * 1024 * 1024
+# Preferência quando o cliente aceita mais de uma codificação
+CODIFICACOES = (('br', '.br'), ('gzip', '.gz'))
+
+
+class ArquivoEstatico:
+    def __init__(self, caminho, relativo):
+        self.caminho = caminho
+        self.tipo = mimetypes.guess_type(relativo)[0] or 'application/octet-stream'
+        if self.tipo.startswith('text/') or self.tipo == 'application/javascript':
+            self.tipo += '; charset=utf-8'
+        self.cache = (CACHE_REVALIDAR if os.path.basename(relativo) == INDEX
+                      else CACHE_IMUTAVEL if PADRAO_FINGERPRINT.search(relativo) else CACHE_PADRAO)
+
+        with open(caminho, 'rb') as arquivo:
+            conteudo = arquivo.read()
+        self.etag = hashlib.sha1(conteudo).hexdigest()[:20]
+        self.tamanho = len(conteudo)
+        self.conteudo = conteudo if self.tamanho <= LIMITE_MEMORIA else None
+        self.variantes = self._variantes(conteudo)
+
+    def _variantes(self, conteudo):
+        variantes = {}
+        for codificacao, extensao in CODIFICACOES:
+            if os.path.exists(self.caminho + extensao):
+                with open(self.caminho + extensao, 'rb') as arquivo:
+                    variantes[codificacao] = arquivo.read()
+        if self.tamanho < TAMANHO_MINIMO_COMPRESSAO or not self.tipo.startswith(TIPOS_COMPRIMIVEIS):
+            return variantes
+        if 'gzip' not in variantes:
+            variantes['gzip'] = gzip.compress(conteudo, compresslevel=9, mtime=0)
+        if 'br' not in variantes and brotli is not None:
+            variantes['br'] = brotli.compress(conteudo)
+        # Só vale a pena servir variantes menores que o original
+        return {codificacao: dados for codificacao, dados in variantes.items() if len(dados) < self.tamanho}
+
+    def resposta(self):
+        """Resposta para a requisição corrente: variante comprimida, 304 ou o arquivo original."""
+        codificacao = next((c for c, _ in CODIFICACOES
+                            if c in self.variantes and request.accept_encodings[c] > 0), None)
+        etag = f'{self.etag}-{codificacao}' if codificacao else self.etag
+        headers = {'ETag': f'"{etag}"', 'Cache-Control': self.cache}
+        if self.variantes:
+            headers['Vary'] = 'Accept-Encoding'
+
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
+        if codificacao:
+            headers['Content-Encoding'] = codificacao
+            return Response(self.variantes[codificacao], content_type=self.tipo, headers=headers)
+        if self.conteudo is not None:
+            return Response(self.conteudo, content_type=self.tipo, headers=headers)
+        resposta = send_file(self.caminho, mimetype=self.tipo, conditional=False, etag=False, max_age=None)
+        resposta.headers.update(headers)
+        return resposta
+
+
+class ManifestoEstatico:
+    """Arquivos de uma pasta estática indexados pelo caminho relativo (com '/')."""
+
+    def __init__(self, pasta):
+        self.pasta = pasta
+        self.arquivos = {}
+        if not pasta or not os.path.isdir(pasta):
+            return
+        for raiz, _, nomes in os.walk(pasta):
+            for nome in nomes:
+                if nome.endswith(('.gz', '.br')) and os.path.exists(os.path.join(raiz, nome[:-3])):
+                    continue
+                caminho = os.path.join(raiz, nome)
+                relativo = os.path.relpath(caminho, pasta).replace(os.sep, '/')
+                self.arquivos[relativo] = ArquivoEstatico(caminho, relativo)
+
+    def servir(self, caminho):
+        """Arquivo pedido ou, para rotas do frontend, o index.html (None se nem ele existir)."""
+        arquivo = self.arquivos.get(caminho) or self.arquivos.get(INDEX)
+        return arquivo.resposta() if arquivo else None
+
+
+def comprimir_pasta(pasta):
+    """Grava as variantes .gz (e .br, com o pacote brotli) dos arquivos comprimíveis da pasta."""
+    gravados = 0
+    for arquivo in ManifestoEstatico(pasta).arquivos.values():
+        for codificacao, extensao in CODIFICACOES:
+            if codificacao in arquivo.variantes and not os.path.exists(arquivo.caminho + extensao):
+                with open(arquivo.caminho + extensao, 'wb') as destino:
+                    destino.write(arquivo.variantes[codificacao])
+                gravados += 1
+    return gravados
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Arquivos estáticos do frontend')
+    parser.add_argument('comando', choices=['comprimir'])
+    parser.add_argument('--pasta', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+    args = parser.parse_args()
+
+    print(f"{comprimir_pasta(args.pasta)} variante(s) comprimida(s) gravada(s) em {args.pasta}.")
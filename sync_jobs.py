@@ -0,0 +1,277 @@
+"""
+Sincronizações com o Mainô em segundo plano.
+
+POST /sync_maino cria um SyncJob e o entrega a um pool local de threads; o
+status é consultado por GET /sync_maino/<job_id>. O ZIP baixado fica em
+SYNC_JOBS_DIR até o job terminar e cada XML tratado é registrado em
+sync_checkpoint junto com os contadores, de modo que um job interrompido
+(erro, reinício do worker) é retomado sem baixar o ZIP de novo e sem
+reprocessar os XMLs já gravados. O checkpoint de uma nota inserida é gravado
+na mesma transação da nota; duplicadas e falhas, que não gravam nada, são
+registradas ao fim de cada lote.
+
+Jobs parados há mais de TEMPO_JOB_INATIVO são retomados automaticamente pelo
+agendador (retomar_jobs_interrompidos, a cada rodada de sync_scheduler).
+Enquanto roda, a execução renova atualizado_em em uma thread de pulso, também
+durante a exportação e o download, e só grava se ainda detém o job (coluna
+execucao): uma execução que perdeu o job para outra para no próximo bloco,
+sem gravar nada dele.
+
+Uso (retomar um job fora do servidor web):
+    python sync_jobs.py retomar <job_id>
+"""
+import argparse
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models.user import SyncCheckpoint, SyncJob, db
+from profiler import perfilado
+
+logger = logging.getLogger(__name__)
+
+DIRETORIO_JOBS = os.getenv('SYNC_JOBS_DIR', os.path.join(tempfile.gettempdir(), 'opme_sync_jobs'))
+WORKERS_JOBS = int(os.getenv('SYNC_JOBS_WORKERS', '1'))
+# Um job "executando" sem atualização há mais tempo que isto é considerado interrompido
+TEMPO_JOB_INATIVO = timedelta(minutes=int(os.getenv('SYNC_JOBS_INATIVIDADE_MIN', '10')))
+# Renovação de atualizado_em de um job em execução (bem abaixo de TEMPO_JOB_INATIVO)
+INTERVALO_PULSO = TEMPO_JOB_INATIVO / 4
+# Erros guardados na mensagem do job
+MAX_ERROS_MENSAGEM = 20
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS_JOBS, thread_name_prefix='sync-maino')
+
+
+class JobPerdido(Exception):
+    """A execução não detém mais o job (foi retomado por outro worker)."""
+
+
+def _caminho_zip(job_id):
+    os.makedirs(DIRETORIO_JOBS, exist_ok=True)
+    return os.path.join(DIRETORIO_JOBS, f'{job_id}.zip')
+
+
+def criar_job(app, data_inicio, data_fim, conta=None, enfileirar=True):
+    """
+    Registra um novo job de sincronização e o coloca na fila.
+    Com `conta`, o watermark dessa conta é avançado quando o job termina; se a
+    conta já tem um job ativo, o índice único uq_sync_job_conta_ativo faz o
+    commit falhar com IntegrityError.
+    """
+    agora = datetime.utcnow()
+    job = SyncJob(id=uuid.uuid4().hex, status='pendente', data_inicio=data_inicio, data_fim=data_fim,
+                  conta=conta, criado_em=agora, atualizado_em=agora)
+    db.session.add(job)
+    db.session.commit()
+    if enfileirar:
+        _executor.submit(executar_job, app, job.id)
+    return job
+
+
+def _reivindicar_job(job_id):
+    """
+    Marca como pendente um job com erro ou parado (sem atualização há TEMPO_JOB_INATIVO).
+    A troca de status é atômica, para que dois workers não retomem o mesmo job;
+    um job com erro não é retomado se a conta já tiver outro job ativo.
+    """
+    agora = datetime.utcnow()
+    try:
+        resultado = db.session.execute(
+            update(SyncJob)
+            .where(SyncJob.id == job_id)
+            .where((SyncJob.status == 'erro') |
+                   (SyncJob.status.in_(['pendente', 'executando']) & (SyncJob.atualizado_em < agora - TEMPO_JOB_INATIVO)))
+            .values(status='pendente', atualizado_em=agora)
+        )
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    return resultado.rowcount == 1
+
+
+def retomar_job(app, job_id, enfileirar=True):
+    """
+    Recoloca na fila um job com erro ou interrompido (sem `enfileirar`, só o marca
+    como pendente, para ser executado pelo chamador).
+
+    Returns:
+        bool: True se o job foi reivindicado
+    """
+    if not _reivindicar_job(job_id):
+        return False
+    if enfileirar:
+        _executor.submit(executar_job, app, job_id)
+    return True
+
+
+def retomar_jobs_interrompidos(app):
+    """Recoloca na fila os jobs pendentes/executando parados há mais de TEMPO_JOB_INATIVO."""
+    parados = db.session.scalars(
+        select(SyncJob.id).where(SyncJob.status.in_(['pendente', 'executando']),
+                                 SyncJob.atualizado_em < datetime.utcnow() - TEMPO_JOB_INATIVO)
+    ).all()
+    retomados = [job_id for job_id in parados if retomar_job(app, job_id)]
+    if retomados:
+        logger.info(f"Jobs de sincronização interrompidos retomados: {', '.join(retomados)}")
+    return retomados
+
+
+def _registrar_checkpoints(job_id, execucao, resultados):
+    """
+    Grava os checkpoints dos resultados e atualiza os contadores do job.
+    Não faz commit: roda dentro da transação que grava as notas, e lança
+    JobPerdido (desfazendo a transação) se a execução não detém mais o job.
+    """
+    if not resultados:
+        return
+    processados = sum(1 for r in resultados if r['success'])
+    duplicados = sum(1 for r in resultados if r['duplicada'])
+    falhas = len(resultados) - processados - duplicados
+
+    db.session.execute(insert(SyncCheckpoint), [{
+        'job_id': job_id,
+        'arquivo': r['arquivo'],
+        'chave_acesso': r['chave_acesso'],
+        'situacao': 'inserida' if r['success'] else ('duplicada' if r['duplicada'] else 'falha'),
+        'erro': None if r['success'] or r['duplicada'] else r['message'][:500],
+    } for r in resultados])
+    alterados = db.session.execute(
+        update(SyncJob).where(SyncJob.id == job_id, SyncJob.execucao == execucao).values(
+            processados=SyncJob.processados + processados,
+            duplicados=SyncJob.duplicados + duplicados,
+            falhas=SyncJob.falhas + falhas,
+            atualizado_em=datetime.utcnow()
+        )
+    ).rowcount
+    if not alterados:
+        raise JobPerdido(job_id)
+
+
+def _registrar_lote(job_id, execucao, resultados):
+    """Ao fim de um lote, registra os XMLs que não gravaram nota (duplicados e falhas)."""
+    try:
+        _registrar_checkpoints(job_id, execucao, [r for r in resultados if not r['success']])
+    except JobPerdido:
+        db.session.rollback()
+        raise
+    db.session.commit()
+
+
+def _atualizar_job(job_id, execucao, **valores):
+    """Atualiza o job se a execução ainda o detém. Retorna False caso contrário."""
+    alterados = db.session.execute(
+        update(SyncJob).where(SyncJob.id == job_id, SyncJob.execucao == execucao)
+        .values(atualizado_em=datetime.utcnow(), **valores)
+    ).rowcount
+    db.session.commit()
+    return alterados == 1
+
+
+def _assumir_job(job_id, execucao):
+    """Passa um job pendente para executando em nome da execução (troca atômica)."""
+    alterados = db.session.execute(
+        update(SyncJob).where(SyncJob.id == job_id, SyncJob.status == 'pendente')
+        .values(status='executando', execucao=execucao, atualizado_em=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    return alterados == 1
+
+
+def _pulsar(app, job_id, execucao, parar):
+    """Renova atualizado_em a cada INTERVALO_PULSO até `parar` ou até a execução perder o job."""
+    with app.app_context():
+        try:
+            while not parar.wait(INTERVALO_PULSO.total_seconds()):
+                if not _atualizar_job(job_id, execucao):
+                    return
+        except Exception:
+            logger.exception(f"Erro no pulso do job de sincronização {job_id}")
+        finally:
+            db.session.remove()
+
+
+@perfilado('sync_job')
+def executar_job(app, job_id):
+    """Executa (ou retoma) um job: baixa o ZIP se ainda não estiver em disco e processa o que falta."""
+    from maino_integration import obter_cliente_maino
+
+    execucao = uuid.uuid4().hex
+    parar_pulso = threading.Event()
+    with app.app_context():
+        try:
+            if not _assumir_job(job_id, execucao):
+                logger.info(f"Job de sincronização {job_id} não está pendente; execução ignorada")
+                return
+            threading.Thread(target=_pulsar, args=(app, job_id, execucao, parar_pulso),
+                             name=f'pulso-{job_id[:8]}', daemon=True).start()
+            job = db.session.get(SyncJob, job_id)
+
+            cliente = obter_cliente_maino()
+            caminho = _caminho_zip(job_id)
+            if not os.path.exists(caminho):
+                zip_url = cliente.exportar_xmls_nfes_emitidas(job.data_inicio, job.data_fim)
+                if not zip_url:
+                    raise Exception("Erro ao obter URL do ZIP")
+                cliente.baixar_zip(zip_url, destino=caminho)
+                if not _atualizar_job(job_id, execucao, total=cliente.contar_xmls(caminho)):
+                    raise JobPerdido(job_id)
+
+            ja_tratados = set(db.session.scalars(
+                select(SyncCheckpoint.arquivo).where(SyncCheckpoint.job_id == job_id)
+            ))
+            resultado = cliente.processar_zip(
+                caminho,
+                ignorar_arquivos=ja_tratados,
+                ao_gravar_bloco=lambda resultados: _registrar_checkpoints(job_id, execucao, resultados),
+                ao_concluir_lote=lambda resultados: _registrar_lote(job_id, execucao, resultados)
+            )
+
+            erros = resultado['errors']
+            db.session.refresh(job)
+            mensagem = f"Processados {job.processados} XMLs com sucesso"
+            if erros:
+                mensagem += f"; {len(erros)} erro(s): " + ' | '.join(erros[:MAX_ERROS_MENSAGEM])
+            if job.execucao != execucao:
+                raise JobPerdido(job_id)
+            if job.conta:
+                from sync_scheduler import avancar_watermark
+                if not avancar_watermark(job):
+                    mensagem += "; watermark mantido (há XMLs com falha)"
+            if not _atualizar_job(job_id, execucao, status='concluido', mensagem=mensagem):
+                raise JobPerdido(job_id)
+            os.remove(caminho)
+        except JobPerdido:
+            db.session.rollback()
+            logger.warning(f"Job de sincronização {job_id} retomado por outra execução; esta foi interrompida")
+        except Exception as e:
+            db.session.rollback()
+            logger.exception(f"Erro no job de sincronização {job_id}")
+            _atualizar_job(job_id, execucao, status='erro', mensagem=f"Erro ao processar XMLs: {str(e)}")
+        finally:
+            parar_pulso.set()
+            db.session.remove()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Jobs de sincronização com o Mainô')
+    parser.add_argument('comando', choices=['retomar'])
+    parser.add_argument('job_id')
+    args = parser.parse_args()
+
+    from main import app
+
+    with app.app_context():
+        if not _reivindicar_job(args.job_id):
+            raise SystemExit("Job inexistente, concluído ou ainda em execução.")
+    # Executa no processo atual, sem passar pelo pool
+    executar_job(app, args.job_id)
+    with app.app_context():
+        print(db.session.get(SyncJob, args.job_id).to_dict())
@@ -0,0 +1,168 @@
+"""
+Sincronização incremental com o Mainô baseada em watermark.
+
+Para cada conta guarda-se a maior data de emissão já sincronizada
+(sync_watermark). Cada rodada pede ao Mainô apenas o intervalo entre o
+watermark (menos uma pequena sobreposição, para notas emitidas com atraso)
+e hoje, e o job avança o watermark ao terminar, desde que nenhum XML tenha
+falhado (senão o watermark fica onde estava e a próxima rodada repete o
+intervalo; as notas já gravadas são descartadas como duplicadas).
+
+Uso:
+    python sync_scheduler.py            # uma rodada, no processo atual
+    python sync_scheduler.py --loop     # repete a cada MAINO_SYNC_INTERVALO_MIN minutos
+
+No servidor web, definir MAINO_SYNC_INTERVALO_MIN ativa o agendador em uma
+thread de cada worker (iniciar_agendador). O índice único parcial
+uq_sync_job_conta_ativo garante um só job pendente/executando por conta:
+quando vários workers agendam ao mesmo tempo, só o primeiro insert vale.
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from models.user import NotaFiscal, SyncCheckpoint, SyncJob, SyncWatermark, db
+from sync_jobs import TEMPO_JOB_INATIVO, criar_job, executar_job, retomar_job, retomar_jobs_interrompidos
+
+logger = logging.getLogger(__name__)
+
+CONTA_PADRAO = os.getenv('MAINO_CONTA', 'padrao')
+SOBREPOSICAO = timedelta(hours=int(os.getenv('MAINO_SYNC_SOBREPOSICAO_H', '24')))
+# Sem watermark, a primeira rodada busca este número de dias
+DIAS_CARGA_INICIAL = int(os.getenv('MAINO_SYNC_DIAS_INICIAIS', '30'))
+INTERVALO_MINUTOS = int(os.getenv('MAINO_SYNC_INTERVALO_MIN', '0'))
+FORMATO_DATA = '%d/%m/%Y'
+
+
+def _job_ativo(conta):
+    return db.session.scalar(
+        select(SyncJob)
+        .where(SyncJob.conta == conta, SyncJob.status.in_(['pendente', 'executando']))
+        .limit(1)
+    )
+
+
+def periodo_incremental(conta=CONTA_PADRAO, agora=None):
+    """Intervalo (data_inicio, data_fim) a sincronizar a partir do watermark da conta."""
+    agora = agora or datetime.now()
+    watermark = db.session.get(SyncWatermark, conta)
+    if watermark:
+        inicio = watermark.ultima_emissao - SOBREPOSICAO
+    else:
+        inicio = agora - timedelta(days=DIAS_CARGA_INICIAL)
+    return inicio.strftime(FORMATO_DATA), agora.strftime(FORMATO_DATA)
+
+
+def agendar_sync_incremental(app, conta=CONTA_PADRAO, enfileirar=True):
+    """
+    Cria o job incremental da conta, a menos que já exista um em andamento; um job
+    ativo parado há mais de TEMPO_JOB_INATIVO (worker reiniciado) é retomado.
+
+    Returns:
+        SyncJob (novo ou retomado) ou None
+    """
+    job = _job_ativo(conta)
+    if job:
+        if job.atualizado_em >= datetime.utcnow() - TEMPO_JOB_INATIVO or \
+                not retomar_job(app, job.id, enfileirar=enfileirar):
+            logger.info(f"Sincronização incremental da conta {conta} já em andamento")
+            return None
+        logger.info(f"Sincronização incremental {job.id} da conta {conta} retomada")
+        return job
+
+    data_inicio, data_fim = periodo_incremental(conta)
+    try:
+        job = criar_job(app, data_inicio, data_fim, conta=conta, enfileirar=enfileirar)
+    except IntegrityError:
+        # Outro worker criou o job da conta entre a consulta e o insert
+        db.session.rollback()
+        logger.info(f"Sincronização incremental da conta {conta} já em andamento")
+        return None
+    logger.info(f"Sincronização incremental da conta {conta}: {data_inicio} a {data_fim}")
+    return job
+
+
+def avancar_watermark(job):
+    """
+    Avança o watermark da conta do job até a maior emissão entre as notas que ele
+    tratou. Se algum XML do job falhou, o watermark não se move: a falha não tem
+    data de emissão conhecida e avançar poderia pular a nota para sempre.
+
+    Returns:
+        bool: False se o watermark foi mantido por causa de falhas
+    """
+    falhas = db.session.scalar(
+        select(func.count()).select_from(SyncCheckpoint)
+        .where(SyncCheckpoint.job_id == job.id, SyncCheckpoint.situacao == 'falha')
+    )
+    if falhas:
+        logger.warning(f"Job {job.id}: {falhas} XML(s) com falha; watermark da conta {job.conta} mantido")
+        return False
+
+    maior_emissao = db.session.scalar(
+        select(func.max(NotaFiscal.data_emissao))
+        .join(SyncCheckpoint, SyncCheckpoint.chave_acesso == NotaFiscal.chave_acesso)
+        .where(SyncCheckpoint.job_id == job.id)
+    )
+    if maior_emissao is None:
+        return True
+    maior_emissao = maior_emissao.replace(tzinfo=None)
+
+    watermark = db.session.get(SyncWatermark, job.conta)
+    agora = datetime.utcnow()
+    if watermark is None:
+        db.session.add(SyncWatermark(conta=job.conta, ultima_emissao=maior_emissao, atualizado_em=agora))
+    elif maior_emissao > watermark.ultima_emissao:
+        watermark.ultima_emissao = maior_emissao
+        watermark.atualizado_em = agora
+    db.session.commit()
+    return True
+
+
+def iniciar_agendador(app, intervalo_minutos=INTERVALO_MINUTOS, conta=CONTA_PADRAO):
+    """Agenda rodadas incrementais periódicas em uma thread daemon (desligado com intervalo 0)."""
+    if intervalo_minutos <= 0:
+        return None
+
+    def laco():
+        while True:
+            time.sleep(intervalo_minutos * 60)
+            try:
+                with app.app_context():
+                    retomar_jobs_interrompidos(app)
+                    agendar_sync_incremental(app, conta)
+            except Exception:
+                logger.exception("Erro no agendador de sincronização incremental")
+
+    thread = threading.Thread(target=laco, name='agendador-maino', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sincronização incremental com o Mainô')
+    parser.add_argument('--conta', default=CONTA_PADRAO)
+    parser.add_argument('--loop', action='store_true', help='repete a cada --intervalo minutos')
+    parser.add_argument('--intervalo', type=int, default=INTERVALO_MINUTOS or 15)
+    args = parser.parse_args()
+
+    from main import app
+
+    while True:
+        with app.app_context():
+            retomar_jobs_interrompidos(app)
+            job = agendar_sync_incremental(app, args.conta, enfileirar=False)
+            job_id = job.id if job else None
+        if job_id:
+            executar_job(app, job_id)
+            with app.app_context():
+                print(db.session.get(SyncJob, job_id).to_dict())
+        if not args.loop:
+            break
+        time.sleep(args.intervalo * 60)
@@ -0,0 +1,100 @@
+"""
+Listagem paginada do Mainô contra um servidor HTTP local que imita a API
+(autenticação, páginas por janela de datas, 429 com Retry-After).
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import maino_integration
+from maino_integration import MainoAPI
+
+
+class ServidorMaino(BaseHTTPRequestHandler):
+    # Configurados por teste: pagina(params) -> (status, corpo)
+    pagina = None
+    requisicoes = []
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, status, corpo, headers=None):
+        dados = json.dumps(corpo).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(dados)))
+        for nome, valor in (headers or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._responder(200, {'access_token': 'token-teste', 'expires_in': 3600})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {chave: valores[0] for chave, valores in parse_qs(url.query).items()}
+        type(self).requisicoes.append(params)
+        status, corpo, *headers = type(self).pagina(params)
+        self._responder(status, corpo, *headers)
+
+
+@pytest.fixture
+def api(monkeypatch):
+    ServidorMaino.requisicoes = []
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), ServidorMaino)
+    thread = threading.Thread(target=servidor.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(maino_integration, 'ITENS_POR_PAGINA', 2)
+    cliente = MainoAPI(api_key='app', email='a@b.c', password='x')
+    cliente.base_url = f'http://127.0.0.1:{servidor.server_address[1]}'
+    yield cliente
+    servidor.shutdown()
+    servidor.server_close()
+
+
+def test_pagina_e_divide_em_janelas(api):
+    notas_por_janela = {'01/01/2024': ['a1', 'a2', 'a3'], '31/01/2024': ['b1']}
+    falhou = set()
+
+    def pagina(params):
+        # Um 429 na primeira página de cada janela: o cliente espera e repete
+        if params['page'] == '1' and params['data_inicio'] not in falhou:
+            falhou.add(params['data_inicio'])
+            return 429, {}, {'Retry-After': '0'}
+        notas = notas_por_janela[params['data_inicio']]
+        inicio = (int(params['page']) - 1) * 2
+        return 200, {'notas_fiscais': [{'numero': n} for n in notas[inicio:inicio + 2]],
+                     'pagination': {'total_pages': (len(notas) + 1) // 2}}
+
+    ServidorMaino.pagina = staticmethod(pagina)
+    notas = api.iterar_notas_fiscais_emitidas('01/01/2024', '31/01/2024')
+    assert sorted(nota['numero'] for nota in notas) == ['a1', 'a2', 'a3', 'b1']
+
+
+def test_para_quando_a_pagina_se_repete(api):
+    # API que ignora o parâmetro page: devolve sempre a mesma página cheia
+    ServidorMaino.pagina = staticmethod(lambda params: (200, [{'numero': 1}, {'numero': 2}]))
+    notas = api._listar_janela({'data_inicio': '01/01/2024', 'data_fim': '02/01/2024'})
+    assert notas == [{'numero': 1}, {'numero': 2}]
+    assert len(ServidorMaino.requisicoes) == 2
+
+
+def test_limite_de_paginas(api, monkeypatch):
+    monkeypatch.setattr(maino_integration, 'MAX_PAGINAS_JANELA', 3)
+    ServidorMaino.pagina = staticmethod(
+        lambda params: (200, [{'numero': f"{params['page']}-{i}"} for i in range(2)]))
+    with pytest.raises(RuntimeError):
+        api._listar_janela({'data_inicio': '01/01/2024', 'data_fim': '02/01/2024'})
+    assert len(ServidorMaino.requisicoes) == 3
+
+
+def test_formato_desconhecido_e_erro(api):
+    ServidorMaino.pagina = staticmethod(lambda params: (200, {'resultado': {'notas': []}}))
+    resposta = api.listar_notas_fiscais_emitidas('01/01/2024', '02/01/2024')
+    assert 'error' in resposta
+    assert 'resultado' in resposta['error']
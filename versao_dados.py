@@ -0,0 +1,217 @@
+"""
+Versão dos dados de NF-e/movimentos.
+
+Toda gravação que altera notas, movimentos ou saldos marca os escopos
+afetados, e o contador é incrementado logo depois do commit, em uma
+transação curta própria: o lock da linha de versão não fica preso durante a
+gravação das notas, que assim não se serializam entre workers. Leituras
+agregadas ficam em cache no processo e só são recalculadas quando o
+contador muda, o que vale para todos os workers, já que o contador está no
+banco. As rotas de leitura usam as mesmas versões para emitir ETags e
+responder 304 sem consultar os dados.
+
+Como quem lê consulta a versão antes dos dados, o intervalo entre o commit
+e o incremento só pode causar um recálculo a mais. Se o incremento falhar
+(ou o processo morrer entre o commit e ele), os caches e ETags ficam velhos
+até a próxima gravação: por isso o incremento é repetido algumas vezes e,
+se ainda assim falhar, o processo descarta o próprio cache e guarda os
+escopos como pendentes, deixando de usar cache e de responder 304 até
+conseguir incrementá-los. Outros workers só percebem a mudança quando o
+incremento finalmente passar.
+
+Escopos:
+    global        -- qualquer ingestão ou reconstrução
+    cliente:CNPJ  -- ingestão de notas daquele destinatário
+    reconstrucao  -- reconstruções completas (afetam todos os clientes)
+"""
+import hashlib
+import logging
+import threading
+import time
+from functools import wraps
+
+from flask import make_response, request
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from models.user import VersaoDados, db
+
+logger = logging.getLogger(__name__)
+
+ESCOPO_GLOBAL = 'global'
+ESCOPO_RECONSTRUCAO = 'reconstrucao'
+ESCOPOS_RECONSTRUCAO = (ESCOPO_GLOBAL, ESCOPO_RECONSTRUCAO)
+
+# Escopos a incrementar no próximo commit da sessão (em session.info)
+CHAVE_PENDENTES = 'versoes_pendentes'
+
+TENTATIVAS_INCREMENTO = 3
+ESPERA_INCREMENTO = 0.2  # segundos, dobrando a cada tentativa
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+# Escopos cujo incremento falhou depois do commit: enquanto houver algum,
+# este processo não confia no próprio cache nem nas ETags
+_escopos_sujos = set()
+
+
+def incrementar_versao(escopos=(ESCOPO_GLOBAL,)):
+    """Marca os escopos para serem incrementados depois do commit da sessão atual."""
+    db.session.info.setdefault(CHAVE_PENDENTES, set()).update(escopos)
+
+
+def _incrementar(conexao, escopos):
+    # Ordem fixa das linhas: duas transações de incremento nunca esperam uma pela outra em ciclo
+    linhas = [{'escopo': escopo, 'versao': 1} for escopo in sorted(escopos)]
+    dialeto = conexao.dialect.name
+    if dialeto in ('postgresql', 'sqlite'):
+        modulo = postgresql if dialeto == 'postgresql' else sqlite
+        stmt = modulo.insert(VersaoDados)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['escopo'],
+            set_={'versao': VersaoDados.versao + 1}
+        )
+        conexao.execute(stmt, linhas)
+        return
+
+    for linha in linhas:
+        alteradas = conexao.execute(
+            update(VersaoDados).where(VersaoDados.escopo == linha['escopo'])
+            .values(versao=VersaoDados.versao + 1)
+        ).rowcount
+        if not alteradas:
+            conexao.execute(insert(VersaoDados), linha)
+
+
+def _incrementar_com_retentativas(engine, escopos):
+    for tentativa in range(TENTATIVAS_INCREMENTO):
+        try:
+            with engine.begin() as conexao:
+                _incrementar(conexao, escopos)
+            return True
+        except Exception:
+            if tentativa == TENTATIVAS_INCREMENTO - 1:
+                logger.exception(f"Erro ao incrementar a versão dos dados ({', '.join(sorted(escopos))})")
+                return False
+            time.sleep(ESPERA_INCREMENTO * 2 ** tentativa)
+
+
+def _marcar_sujos(escopos):
+    with _cache_lock:
+        _escopos_sujos.update(escopos)
+        _cache.clear()
+
+
+def _reaplicar_sujos():
+    """Tenta de novo os incrementos que falharam; True quando não resta nenhum pendente."""
+    with _cache_lock:
+        escopos = set(_escopos_sujos)
+    if not escopos:
+        return True
+    try:
+        with db.engine.begin() as conexao:
+            _incrementar(conexao, escopos)
+    except Exception:
+        logger.warning(f"Versão dos dados ainda não incrementada ({', '.join(sorted(escopos))})")
+        return False
+    with _cache_lock:
+        _escopos_sujos.difference_update(escopos)
+        _cache.clear()
+    return not _escopos_sujos
+
+
+@event.listens_for(Session, 'after_commit')
+def _incrementar_apos_commit(session):
+    escopos = session.info.pop(CHAVE_PENDENTES, None)
+    if not escopos:
+        return
+    # Os dados já estão gravados: sem o incremento, caches e ETags ficariam velhos
+    if not _incrementar_com_retentativas(session.get_bind(), escopos):
+        _marcar_sujos(escopos)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_pendentes(session):
+    session.info.pop(CHAVE_PENDENTES, None)
+
+
+def escopo_cliente(cnpj):
+    return f'cliente:{cnpj}'
+
+
+def escopos_ingestao(cnpjs):
+    """Escopos afetados pela gravação de notas destinadas aos CNPJs informados."""
+    return (ESCOPO_GLOBAL,) + tuple(escopo_cliente(cnpj) for cnpj in sorted(set(cnpjs)))
+
+
+def versao_atual(escopo=ESCOPO_GLOBAL):
+    return db.session.scalar(select(VersaoDados.versao).where(VersaoDados.escopo == escopo)) or 0
+
+
+def versoes(escopos):
+    """Versões de vários escopos em uma única leitura (0 para escopos nunca incrementados)."""
+    encontradas = dict(db.session.execute(
+        select(VersaoDados.escopo, VersaoDados.versao).where(VersaoDados.escopo.in_(escopos))
+    ).all())
+    return tuple(encontradas.get(escopo, 0) for escopo in escopos)
+
+
+def cache_por_versao(funcao):
+    """
+    Guarda o resultado da função (por argumentos) até a próxima mudança de versão
+    global dos dados. Cada chamada custa apenas a leitura do contador.
+    """
+    @wraps(funcao)
+    def wrapper(*args):
+        chave = (funcao.__qualname__, args)
+        if not _reaplicar_sujos():
+            return funcao(*args)
+        versao = versao_atual()
+        with _cache_lock:
+            em_cache = _cache.get(chave)
+        if em_cache is not None and em_cache[0] == versao:
+            return em_cache[1]
+        valor = funcao(*args)
+        with _cache_lock:
+            _cache[chave] = (versao, valor)
+        return valor
+    return wrapper
+
+
+def etag_por_versao(parametro_cliente='cnpj_cliente'):
+    """
+    Emite um ETag forte derivado da versão dos dados, da rota e dos parâmetros.
+    Se o If-None-Match já corresponde, responde 304 sem executar a rota.
+    Com o parâmetro de cliente presente, usa a versão daquele cliente, de modo
+    que ingestões de outros clientes não invalidam a resposta.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not _reaplicar_sujos():
+                # Versão desatualizada: responde sem ETag para o cliente não guardar
+                response = make_response(view(*args, **kwargs))
+                response.headers['Cache-Control'] = 'no-store'
+                return response
+            cnpj = request.args.get(parametro_cliente) if parametro_cliente else None
+            escopos = (ESCOPO_RECONSTRUCAO, escopo_cliente(cnpj)) if cnpj else (ESCOPO_GLOBAL,)
+            assinatura = '|'.join([
+                request.path,
+                '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True))),
+                ','.join(f'{e}={v}' for e, v in zip(escopos, versoes(escopos)))
+            ])
+            etag = hashlib.sha1(assinatura.encode('utf-8')).hexdigest()
+
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator